@@ -0,0 +1,839 @@
+'''
+Created on Oct 18, 2026
+
+The remailer on asyncio. One event loop does all the waiting - IDLE and
+FETCH on the IMAP connection (aioimaplib), sends over the mailbox's
+smtp_pool_size SMTP connections (aiosmtplib) and redirect lookups
+(aiohttp) - so a slow send or lookup for one message doesn't hold up any
+of the others. The work done on each message is the same as Remailer's
+(both take it from RemailerBase), run on a thread so that parsing and
+scanning don't stall the loop.
+
+Run this module instead of remailer.py to use it.
+'''
+
+import re
+import sys
+import time
+import asyncio
+import logging
+import traceback
+from urllib.parse import urlsplit
+
+import aiohttp
+import aioimaplib
+import aiosmtplib
+
+from remailer import RemailerBase
+from remailer import info
+from remailer import debug
+from remailer import uidSetString
+from remailer import mailboxFromArgs
+
+from metrics import startMetricsServer
+from metrics import stage_seconds
+from metrics import recipients_total
+from metrics import messages_total
+from metrics import smtp_sessions_total
+from metrics import errors_total
+from metrics import imap_reconnects_total
+from metrics import inbox_messages
+
+from profiling import CycleProfiler
+
+from bodystructure import parseFetchResponse
+
+from redirect_cache import RedirectCache
+from redirect_resolver import CircuitBreaker
+from url_redirect import connect_timeout
+from url_redirect import read_timeout
+
+class AsyncRemailer(RemailerBase):
+    # How many redirect lookups to have going at once.
+    redirect_lookup_limit = 8
+
+    def __init__(self, imap_service, imap_creds, smtp_service, smtp_creds,
+                 mailbox = None):
+        super().__init__(mailbox)
+
+        self._imap_service = imap_service
+        self._imap_creds = imap_creds
+        self._smtp_service = smtp_service
+        self._smtp_creds = smtp_creds
+
+        # Claiming messages in a shared incoming folder is left to Remailer.
+        if self._mailbox.worker_id is not None:
+            raise ValueError("Sharing an incoming folder between workers needs remailer.py")
+
+        # Everything below belongs to the event loop, and is set up by
+        # connect().
+        self._loop = None
+        self._imap = None
+        self._imap_command_lock = None
+        self._smtp_clients = None
+        self._http = None
+        self._lookup_limit = None
+        self._breaker = CircuitBreaker()
+
+        self.redirect_lookups = 0
+        self.redirect_failures = 0
+
+    async def connect(self):
+        self._loop = asyncio.get_running_loop()
+
+        # aioimaplib can have several commands outstanding, but we keep to
+        # one at a time so responses to SELECT and the like can't get
+        # mixed up with others.
+        self._imap_command_lock = asyncio.Lock()
+        await self.connectIMAP()
+
+        # Each slot holds a connected SMTP client, or None until one is
+        # needed. There are as many as the mailbox's smtp_pool_size.
+        self._smtp_clients = asyncio.Queue()
+        for i in range(max(self._mailbox.smtp_pool_size, 1)):
+            self._smtp_clients.put_nowait(None)
+
+        self._http = aiohttp.ClientSession(
+            timeout = aiohttp.ClientTimeout(sock_connect = connect_timeout,
+                                            sock_read = read_timeout))
+        self._lookup_limit = asyncio.Semaphore(self.redirect_lookup_limit)
+
+    async def connectIMAP(self):
+        if self._imap_service.get('ssl', True):
+            imap = aioimaplib.IMAP4_SSL(host = self._imap_service['server_addr'],
+                                        port = self._imap_service['port'])
+        else:
+            imap = aioimaplib.IMAP4(host = self._imap_service['server_addr'],
+                                    port = self._imap_service['port'])
+
+        await imap.wait_hello_from_server()
+
+        response = await imap.login(self._imap_creds.username, self._imap_creds.password)
+        self.checkIMAPResponse(response.result, response.lines)
+
+        # Ask again now we're logged in; the list can change.
+        await imap.protocol.capability()
+        self._noteIMAPCapabilities([capability.encode()
+                                    for capability in imap.protocol.capabilities])
+
+        self._imap = imap
+
+    async def reconnectIMAP(self):
+        try:
+            await self._imap.logout()
+        except Exception:
+            pass
+
+        await self.connectIMAP()
+        self._imap_reconnect_count += 1
+        imap_reconnects_total.inc()
+        self.resetIMAPTimer()
+        self._selected_folder = None
+
+    async def close(self):
+        while not self._smtp_clients.empty():
+            client = self._smtp_clients.get_nowait()
+            if client is not None and client.is_connected:
+                try:
+                    await client.quit()
+                except aiosmtplib.SMTPException:
+                    client.close()
+
+        await self._http.close()
+
+        if self._redirect_cache is not None:
+            self._redirect_cache.close()
+
+        try:
+            await self._imap.expunge()
+            await self._imap.close()
+            await self._imap.logout()
+        except Exception:
+            pass
+
+    async def imapCommand(self, command, *args):
+        # Run an IMAP command (a method of aioimaplib.IMAP4, by name) and
+        # return its response lines, raising if it didn't succeed.
+        async with self._imap_command_lock:
+            response = await getattr(self._imap, command)(*args)
+        self.checkIMAPResponse(response.result, response.lines)
+
+        if command != 'select':
+            self.noteFolderChanges(response.lines)
+
+        return response.lines
+
+    exists_prog = re.compile(rb'(\d+) (EXISTS|EXPUNGE)$')
+    uidnext_prog = re.compile(rb'\[UIDNEXT (\d+)\]')
+
+    def noteFolderChanges(self, lines):
+        # Keep what we know of the selected folder up to date from the
+        # EXISTS and EXPUNGE responses among lines, as
+        # Remailer.pollSelectedFolder does. aioimaplib gives them to us in
+        # order, along with the response to whichever command they came
+        # with, so here the count is exact.
+        known = self._folder_sync.get(self._selected_folder)
+        if known is None:
+            return
+
+        for line in lines:
+            if isinstance(line, bytearray):
+                continue
+
+            match = self.exists_prog.match(line)
+            if match is None:
+                continue
+
+            if match.group(2) == b'EXISTS':
+                known['MESSAGES'] = int(match.group(1))
+                self._new_mail_reported = True
+            else:
+                known['MESSAGES'] -= 1
+
+    async def folderStatus(self, folder):
+        # As Remailer's.
+        lines = await self.imapCommand('status', folder, '(UIDVALIDITY UIDNEXT MESSAGES)')
+        response = lines[0]
+        items = response[response.rindex(b'('):]
+
+        return dict((name.decode(), int(value))
+                    for name, value in self.status_item_prog.findall(items))
+
+    async def selectFolder(self, folder):
+        # As Remailer's.
+        lines = await self.imapCommand('select', folder)
+        self._selected_folder = folder
+
+        known = self._folder_sync.get(folder)
+        if known is None:
+            return
+
+        uidnext = None
+        for line in lines:
+            match = self.exists_prog.match(line)
+            if match is not None:
+                known['MESSAGES'] = int(match.group(1))
+
+            match = self.uidnext_prog.search(line)
+            if match is not None:
+                uidnext = int(match.group(1))
+
+        self._new_mail_reported = uidnext != known['UIDNEXT']
+
+    async def getAllFolderUIDs(self, folder):
+        await self.selectFolder(folder)
+
+        # The last line is the text of the tagged response.
+        lines = await self.imapCommand('uid_search', 'UNDELETED')
+        return b' '.join(lines[:-1]).split()
+
+    async def getNewFolderUIDs(self, folder):
+
+        # As Remailer's: a NOOP on the selected folder, or STATUS on any
+        # other, tells us whether there's new mail, and only UIDs from the
+        # last UIDNEXT on are searched for.
+        known = self._folder_sync.get(folder)
+
+        if known is not None and self._selected_folder == folder:
+            await self.imapCommand('noop')
+            status = dict(known)
+            new_mail = self._new_mail_reported
+        else:
+            status = await self.folderStatus(folder)
+            new_mail = known is not None and known['UIDNEXT'] != status['UIDNEXT']
+
+        if known is None or known['UIDVALIDITY'] != status['UIDVALIDITY']:
+            debug("Searching all of %s" % folder)
+            message_uids = await self.getAllFolderUIDs(folder)
+            self._new_mail_reported = False
+            self._unfinished_uids = set()
+
+        elif not new_mail:
+            # No new mail, but it's time to have another go at whatever
+            # we couldn't finish.
+            if self._unfinished_uids and time.monotonic() >= self._unfinished_retry_at:
+                if self._selected_folder != folder:
+                    await self.selectFolder(folder)
+
+                # Forget any that have gone from the folder in the meantime.
+                lines = await self.imapCommand('uid_search', 'UID',
+                                               uidSetString(self._unfinished_uids),
+                                               'UNDELETED')
+                self._unfinished_uids &= set(b' '.join(lines[:-1]).split())
+
+                debug("Retrying %d unfinished messages" % len(self._unfinished_uids))
+                message_uids = sorted(self._unfinished_uids, key = int)
+            else:
+                message_uids = []
+
+        else:
+            if self._selected_folder != folder:
+                await self.selectFolder(folder)
+
+            self._new_mail_reported = False
+
+            lines = await self.imapCommand('uid_search', 'UID', '%d:*' % known['UIDNEXT'],
+                                           'UNDELETED')
+            message_uids = [uid for uid in b' '.join(lines[:-1]).split()
+                            if int(uid) >= known['UIDNEXT']]
+
+            if message_uids:
+                status['UIDNEXT'] = max(status['UIDNEXT'], int(message_uids[-1]) + 1)
+
+            message_uids = sorted(self._unfinished_uids | set(message_uids), key = int)
+
+        self._folder_sync[folder] = status
+
+        return message_uids, status['MESSAGES']
+
+    async def fetchMessageUIDsAsBytes(self, message_uids):
+
+        # Like Remailer's, but yields a list of (uid, bytes) for each
+        # chunk. aioimaplib gives us a line with the envelope, then the
+        # literal as a bytearray.
+        for i in range(0, len(message_uids), self.fetch_chunk_size):
+            chunk = message_uids[i:i + self.fetch_chunk_size]
+            uid_set = uidSetString(chunk)
+
+            try:
+                with stage_seconds.time('fetch'):
+                    lines = await self.imapCommand('uid', 'fetch', uid_set, '(BODY.PEEK[])')
+
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error fetching messages %s - skipping." % uid_set)
+                errors_total.inc('fetch')
+                continue
+
+            messages = []
+            envelope = b''
+
+            for line in lines:
+                if not isinstance(line, bytearray):
+                    envelope = line
+                    continue
+
+                match = self.fetch_uid_prog.search(envelope)
+                if match is not None:
+                    messages.append((match.group(1), bytes(line)))
+
+            yield messages
+
+    fetch_prefix_prog = re.compile(rb'(\d+) FETCH ')
+
+    def fetchData(self, lines):
+        # The lines of a FETCH response as imaplib's uid('fetch', ...)
+        # would have given them, for parseFetchResponse: each literal
+        # paired with the line before it, and no FETCH after the sequence
+        # numbers. Other untagged responses that came with it, such as
+        # EXISTS, and the tagged response at the end are left out.
+        data = []
+
+        for line in lines[:-1]:
+            if isinstance(line, bytearray):
+                data[-1] = (data[-1], bytes(line))
+            elif self.fetch_prefix_prog.match(line) is not None:
+                data.append(self.fetch_prefix_prog.sub(rb'\1 ', line, count = 1))
+            elif not line[:1].isdigit():
+                data.append(line)
+
+        return data
+
+    async def classifyMessageUIDs(self, message_uids):
+
+        # As Remailer's: look at the BODYSTRUCTUREs, then fetch and scan
+        # only the text parts, so that messages without remail tags needn't
+        # be downloaded. Returns (tagged_uids, notag_uids).
+        tagged_uids = []
+        notag_uids = []
+
+        for i in range(0, len(message_uids), self.fetch_chunk_size):
+            chunk = message_uids[i:i + self.fetch_chunk_size]
+
+            try:
+                with stage_seconds.time('classify'):
+                    lines = await self.imapCommand('uid', 'fetch', uidSetString(chunk),
+                                                   '(BODYSTRUCTURE)')
+                structures = parseFetchResponse(self.fetchData(lines))
+
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error fetching message structure - fetching messages in full.")
+                errors_total.inc('classify')
+                tagged_uids.extend(chunk)
+                continue
+
+            sections_by_uid, uids_by_sections, multipart_uids = \
+                self.groupByTextSections(chunk, structures)
+
+            for message_uid in chunk:
+                if message_uid not in sections_by_uid:
+                    tagged_uids.append(message_uid)
+
+            for section_names, group_uids in uids_by_sections.items():
+
+                # No text at all means nothing to scan.
+                if len(section_names) == 0:
+                    notag_uids.extend(group_uids)
+                    continue
+
+                items = ' '.join('BODY.PEEK[%s]' % section for section in section_names)
+
+                try:
+                    with stage_seconds.time('classify'):
+                        lines = await self.imapCommand('uid', 'fetch', uidSetString(group_uids),
+                                                       '(%s)' % items)
+
+                    messages = {}
+                    for message in parseFetchResponse(self.fetchData(lines)):
+                        messages[message.get(b'UID')] = message
+
+                except Exception as e:
+                    traceback.print_tb(e.__traceback__)
+                    print("*** Error fetching message text - fetching messages in full.")
+                    errors_total.inc('classify')
+                    tagged_uids.extend(group_uids)
+                    continue
+
+                self.sortTextSections(group_uids, sections_by_uid, multipart_uids,
+                                      messages, tagged_uids, notag_uids)
+
+        return self.inInboxOrder(message_uids, tagged_uids, notag_uids)
+
+    async def moveMessageUIDSet(self, uid_set, destination_folder):
+
+        debug('Moving messages %s to %s' % (uid_set, destination_folder))
+
+        if self._imap_has_move:
+            await self.imapCommand('uid', 'move', uid_set, destination_folder)
+
+        else:
+            await self.imapCommand('uid', 'copy', uid_set, destination_folder)
+            await self.imapCommand('uid', 'store', uid_set, '+FLAGS.SILENT', r'(\Deleted)')
+
+            if self._imap_has_uidplus:
+                await self.imapCommand('uid', 'expunge', uid_set)
+
+    async def flushMessageMoves(self):
+
+        # As Remailer's: do the queued moves, one command per folder, and
+        # return the set of UIDs that were moved.
+        pending_moves = self._pending_moves
+        self._pending_moves = {}
+
+        moved_uids = set()
+
+        for destination_folder, message_uids in pending_moves.items():
+            uid_set = uidSetString(message_uids)
+
+            try:
+                with stage_seconds.time('move'):
+                    await self.moveMessageUIDSet(uid_set, destination_folder)
+                moved_uids.update(message_uids)
+                self._unfinished_uids.difference_update(message_uids)
+
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error moving messages %s to %s - skipping."
+                      % (uid_set, destination_folder))
+                errors_total.inc('move')
+
+        return moved_uids
+
+    def rewriteURLs(self, message_part_strs):
+
+        # This runs on a transform thread. The redirect lookups are handed
+        # to the event loop, and we wait here for the answers.
+        url_rewriter = self.urlRewriter()
+
+        with stage_seconds.time('url_rewrite'):
+            urls = url_rewriter.mapTargets(message_part_strs)
+            url_map = {}
+            if urls:
+                url_map = asyncio.run_coroutine_threadsafe(self.resolveRedirects(urls),
+                                                           self._loop).result()
+
+            return [url_rewriter.rewrite(message_part_str, url_map)
+                    for message_part_str in message_part_strs]
+
+    async def lookUpRedirect(self, url):
+        async with self._lookup_limit:
+            print("  Finding redirect for %s" % url)
+            async with self._http.get(url, allow_redirects = False, ssl = False) as result:
+                print("  Result code = %d" % result.status)
+                location = result.headers.get('location')
+                print("  Redirects to: %s" % location)
+                return location
+
+    async def resolveRedirects(self, urls):
+
+        # Returns a dict of url -> location for every URL we could
+        # resolve, looking them up concurrently. As with RedirectResolver,
+        # answers are cached and a failing host's URLs are left alone
+        # until it recovers.
+        if self._redirect_cache is None:
+            self._redirect_cache = RedirectCache()
+
+        url_map = {}
+        lookups = {}
+
+        for url in urls:
+            found, location = self._redirect_cache.cached(url)
+            if found:
+                if location is not None:
+                    url_map[url] = location
+                continue
+
+            host = urlsplit(url).hostname
+            if self._breaker.allow(host):
+                self._redirect_cache.recordMiss()
+                lookups[url] = host
+
+        results = await asyncio.gather(*[self.lookUpRedirect(url) for url in lookups],
+                                       return_exceptions = True)
+
+        for (url, host), location in zip(lookups.items(), results):
+            self.redirect_lookups += 1
+
+            if isinstance(location, Exception):
+                print("  Redirect lookup for %s failed: %s" % (url, location))
+                self.redirect_failures += 1
+                self._breaker.recordFailure(host)
+                location = None
+            else:
+                self._breaker.recordSuccess(host)
+
+            if location is None:
+                self._redirect_cache.recordFailure()
+            self._redirect_cache.store(url, location)
+
+            if location is not None:
+                url_map[url] = location
+
+        return url_map
+
+    async def connectSMTP(self):
+        creds = self._smtp_creds
+        client = aiosmtplib.SMTP(hostname = self._smtp_service['server_addr'],
+                                 port = self._smtp_service['port'],
+                                 local_hostname = self._smtp_service.get('local_hostname'),
+                                 start_tls = self._smtp_service.get('starttls', True),
+                                 username = creds.username if creds is not None else None,
+                                 password = creds.password if creds is not None else None)
+        with stage_seconds.time('smtp_handshake'):
+            await client.connect()
+        smtp_sessions_total.inc('opened')
+        return client
+
+    async def sendmail(self, recipients, outgoing_message):
+
+        # One transaction, over whichever SMTP connection is free. Returns
+        # {recipient: (code, message)} for each recipient the server
+        # refused, as SMTPSession.sendmail does.
+        client = await self._smtp_clients.get()
+
+        try:
+            if client is None or not client.is_connected:
+                client = await self.connectSMTP()
+
+            try:
+                with stage_seconds.time('smtp_send'):
+                    errors, response = await client.sendmail(self._mailbox.global_from_addr,
+                                                             recipients,
+                                                             outgoing_message.message_bytes)
+                errors = [(recipient, error.code, error.message)
+                          for recipient, error in errors.items()]
+
+            except aiosmtplib.SMTPRecipientsRefused as e:
+                errors = [(error.recipient, error.code, error.message)
+                          for error in e.recipients]
+
+        except Exception:
+            # Don't trust the connection after a failure.
+            if client is not None:
+                client.close()
+                client = None
+            raise
+
+        finally:
+            self._smtp_clients.put_nowait(client)
+
+        return dict((recipient, (code, message.encode('utf-8')))
+                    for recipient, code, message in errors)
+
+    # As for smtp_session.deliverToRecipients: how many more times to try
+    # recipients refused with a temporary (4xx) error, and how long to
+    # wait first.
+    smtp_retries = 2
+    smtp_retry_delay = 2
+
+    async def sendRemailMessage(self, outgoing_message, recipients):
+
+        # Send to every recipient, max_recipients_per_transaction at a
+        # time, retrying temporary refusals as deliverToRecipients does.
+        # Returns {recipient: (code, message)} for the recipients that
+        # never got it.
+        refused = {}
+        pending = list(recipients)
+
+        for attempt in range(self.smtp_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.smtp_retry_delay)
+
+            retry = []
+
+            for i in range(0, len(pending), self.max_recipients_per_transaction):
+                chunk = pending[i:i + self.max_recipients_per_transaction]
+                chunk_refused = await self.sendmail(chunk, outgoing_message)
+
+                for recipient, (code, message) in chunk_refused.items():
+                    if 400 <= code < 500 and attempt < self.smtp_retries:
+                        retry.append(recipient)
+                    else:
+                        refused[recipient] = (code, message)
+
+            pending = retry
+            if not pending:
+                break
+
+        recipients_total.inc('accepted', amount = len(recipients) - len(refused))
+        recipients_total.inc('refused', amount = len(refused))
+
+        return refused
+
+    async def archiveRemailMessage(self, outgoing_message):
+        with stage_seconds.time('append'):
+            await self.imapCommand('append', outgoing_message.message_bytes,
+                                   self._mailbox.sent_folder, None, time.time())
+
+    async def deliverRemailMessage(self, message_uid, outgoing_message, remail_addresses_set):
+        try:
+            await self.archiveRemailMessage(outgoing_message)
+
+            recipients = sorted(remail_addresses_set)
+            info("Sending message %s to %s" % (self.msgId(message_uid),
+                                                ', '.join('<%s>' % r for r in recipients)))
+
+            self.reportRefusedRecipients(await self.sendRemailMessage(outgoing_message,
+                                                                      recipients))
+
+        except Exception as e:
+            traceback.print_tb(e.__traceback__)
+            print("*** Error sending message %s - skipping." % self.msgId(message_uid))
+            errors_total.inc('send')
+
+    async def transformMessageInThread(self, message_uid, message_bytes):
+        try:
+            return await asyncio.to_thread(self.transformMessage, message_uid, message_bytes)
+
+        except Exception as e:
+            self.reportMessageError(message_uid, message_bytes, e)
+            return None
+
+    async def doThemAll(self):
+        message_uids, folder_count = await self.getNewFolderUIDs(self._mailbox.incoming_folder)
+        message_count = len(message_uids)
+        inbox_messages.set(folder_count)
+        self._inbox_message_count = folder_count
+        self._cycle_count += 1
+
+        # As in Remailer, everything is unfinished until it's been moved.
+        self._unfinished_uids.update(message_uids)
+        if message_count > 0:
+            self._unfinished_retry_at = time.monotonic() + self.unfinished_retry_interval
+
+        mc_suffix = "" if folder_count == 1 else "s"
+        info("%d message%s in %s (%d new), Uptime: %s, IMAP uptime: %s, reconnect count: %d"
+             %(folder_count, mc_suffix, self._mailbox.incoming_folder, message_count,
+               self._uptimeStr(), self._imapupStr(),
+               self._imap_reconnect_count))
+
+        if message_count > 0:
+            print('################################################################################')
+
+        deliveries = []
+
+        # As in Remailer, messages without any remail tags go straight to
+        # the no-tag folder; only the rest get downloaded.
+        tagged_uids, notag_uids = await self.classifyMessageUIDs(message_uids)
+
+        for message_uid in notag_uids:
+            info("Message %s has no remail addresses - moving to no-tag folder."
+                 % self.msgId(message_uid))
+            self.moveMessageUID(message_uid, self._mailbox.notag_folder)
+            messages_total.inc('notag')
+
+        # Each chunk's messages are transformed together, their originals
+        # are moved with one command per folder, and then their deliveries
+        # go off as tasks while we get on with the next chunk. A message is
+        # still never sent before its original has been moved.
+        async for messages in self.fetchMessageUIDsAsBytes(tagged_uids):
+            results = await asyncio.gather(*[self.transformMessageInThread(message_uid,
+                                                                          message_bytes)
+                                             for message_uid, message_bytes in messages])
+
+            outgoing = []
+            for (message_uid, message_bytes), result in zip(messages, results):
+                if result is None:
+                    continue
+
+                remail_addresses_set, outgoing_message = result
+                self.queueRemail(message_uid, remail_addresses_set, outgoing_message, outgoing)
+
+            moved_uids = await self.flushMessageMoves()
+
+            for message_uid, outgoing_message, remail_addresses_set in outgoing:
+                if message_uid not in moved_uids:
+                    print("*** Message %s was not moved - not sending."
+                          % self.msgId(message_uid))
+                    continue
+
+                deliveries.append(asyncio.ensure_future(
+                    self.deliverRemailMessage(message_uid, outgoing_message,
+                                              remail_addresses_set)))
+
+        # The no-tag moves, if there was nothing to fetch.
+        await self.flushMessageMoves()
+
+        await asyncio.gather(*deliveries)
+
+        if message_count > 0:
+            if self._redirect_cache is not None:
+                info(self._redirect_cache.statsString())
+                info("redirect lookups: %d lookups, %d failures, open hosts: %s"
+                     % (self.redirect_lookups, self.redirect_failures,
+                        ', '.join(self._breaker.openHosts()) or 'none'))
+
+            if self._url_rewriter is not None and self._url_rewriter.hits:
+                info(self._url_rewriter.statsString())
+
+            info('*** Done ***')
+
+        return message_count
+
+    async def idleUntilNewMail(self, timeout):
+        # Returns True if the server reported new mail before timeout
+        # seconds passed.
+        async with self._imap_command_lock:
+            idle = await self._imap.idle_start(timeout = timeout)
+            new_mail = False
+
+            try:
+                while not new_mail:
+                    try:
+                        push = await self._imap.wait_server_push(timeout)
+                    except asyncio.TimeoutError:
+                        break
+
+                    # aioimaplib tells us it has stopped idling this way.
+                    if push == aioimaplib.STOP_WAIT_SERVER_PUSH:
+                        break
+
+                    for line in push:
+                        debug('IDLE: %s' % line.decode('utf-8', 'replace'))
+                        if line.endswith(b' EXISTS') or line.endswith(b' RECENT'):
+                            new_mail = True
+
+                    self.noteFolderChanges(push)
+            finally:
+                self._imap.idle_done()
+                await asyncio.wait_for(idle, 10)
+
+        return new_mail
+
+    async def waitForNewMail(self, last_message_count):
+        # Wake up in time to retry any messages we couldn't finish.
+        limit = None
+        if self._unfinished_uids:
+            limit = max(self._unfinished_retry_at - time.monotonic(), 1)
+
+        if self._imap_has_idle:
+            # As in Remailer: if mail arrived after the search, idling won't
+            # tell us about it.
+            if self._selected_folder != self._mailbox.incoming_folder:
+                await self.selectFolder(self._mailbox.incoming_folder)
+            else:
+                await self.imapCommand('noop')
+
+            if self._new_mail_reported:
+                return
+
+            debug("Idling on %s" % self._mailbox.incoming_folder)
+            await self.idleUntilNewMail(self.idle_timeout if limit is None
+                                        else min(self.idle_timeout, limit))
+            return
+
+        if last_message_count > 0:
+            self._poll_interval = self.min_poll_interval
+        else:
+            self._poll_interval = min(self._poll_interval * 2,
+                                      self.max_poll_interval)
+
+        debug("Polling again in %ds" % self._poll_interval)
+        await asyncio.sleep(self._poll_interval if limit is None
+                            else min(self._poll_interval, limit))
+
+    async def testIMAPConnection(self):
+        await self.imapCommand('noop')
+
+    async def runForever(self, profiler = None, report_status = None):
+        # With a CycleProfiler, cycles are profiled when it's asked to.
+        # Transforms run in the event loop's worker threads, which are
+        # only profiled from Python 3.12. If report_status is given, it's
+        # called with status() after each cycle.
+        await self.connect()
+
+        try:
+            while True:
+                if profiler is not None:
+                    with profiler.cycle():
+                        message_count = await self.doThemAll()
+                else:
+                    message_count = await self.doThemAll()
+
+                if report_status is not None:
+                    report_status(self.status())
+
+                try:
+                    await self.waitForNewMail(message_count)
+
+                except Exception as e:
+                    print("*** Error waiting for new mail: %s" % e)
+                    errors_total.inc('idle')
+                    await asyncio.sleep(self.min_poll_interval)
+
+                try:
+                    await self.testIMAPConnection()
+
+                except Exception:
+                    print("IMAP connection failed NOOP... re-establishing connection.")
+                    await self.reconnectIMAP()
+
+        finally:
+            await self.close()
+
+def runMailbox(mailbox, report_status = None):
+    # As remailer.runMailbox, on asyncio.
+
+    # Set up logging
+    logging.basicConfig(filename = mailbox.log_file,
+                        format = '%(asctime)s:%(levelname)s:%(message)s',
+                        level = logging.DEBUG)
+
+    logging.info("-----------------------------------------------------------")
+    info("initializing %s (asyncio)..." % mailbox.name)
+
+    if mailbox.metrics_port is not None:
+        startMetricsServer(mailbox.metrics_port)
+
+    profiler = CycleProfiler(mailbox.profile_dir, mailbox.profile_control_file)
+    profiler.installSignalHandlers()
+
+    remailer = AsyncRemailer(mailbox.imap_service, mailbox.imapCreds(),
+                             mailbox.smtp_service, mailbox.smtpCreds(), mailbox)
+
+    asyncio.run(remailer.runForever(profiler, report_status))
+
+if __name__ == '__main__':
+    # python async_remailer.py [config.json [mailbox name]]
+    runMailbox(mailboxFromArgs(sys.argv[1:]))
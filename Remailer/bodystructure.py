@@ -0,0 +1,214 @@
+'''
+Created on Oct 18, 2026
+
+Just enough of an IMAP FETCH response parser to pull apart BODYSTRUCTURE
+and BODY[section] responses, so we can look at the text parts of a message
+without downloading its attachments.
+'''
+
+import re
+import base64
+from quopri import decodestring
+
+literal_prog = re.compile(rb'\{(\d+)\}$')
+token_prog = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+quoted_escape_prog = re.compile(rb'\\(.)')
+
+class Literal(bytes):
+    # A string the server sent as a {n} literal, kept apart from atoms so
+    # that it is never mistaken for NIL or a keyword.
+    pass
+
+class Quoted(bytes):
+    # Likewise for a "quoted" string.
+    pass
+
+def _tokenize(text, tokens):
+    pos = 0
+    end = len(text)
+
+    while pos < end:
+        match = token_prog.match(text, pos)
+        if match is None:
+            # Only whitespace left.
+            break
+
+        pos = match.end()
+        open_, close, quoted, atom = match.groups()
+
+        if open_ is not None:
+            tokens.append('(')
+        elif close is not None:
+            tokens.append(')')
+        elif quoted is not None:
+            tokens.append(Quoted(quoted_escape_prog.sub(rb'\1', quoted)))
+        else:
+            tokens.append(atom)
+
+def _fetchTokens(data):
+    # imaplib hands back each literal as a (text ending in {n}, literal)
+    # tuple, with plain bytes for the text in between. Stitch it all back
+    # into a single stream of tokens.
+    tokens = []
+
+    for item in data:
+        if isinstance(item, tuple):
+            text, literal = item
+            text = literal_prog.sub(b'', text.rstrip())
+            _tokenize(text, tokens)
+            tokens.append(Literal(literal))
+        elif item is not None:
+            _tokenize(item, tokens)
+
+    return tokens
+
+def _parseList(tokens, pos):
+    # Parse a parenthesized list starting just after its '('. Returns the
+    # list and the position just after its ')'.
+    result = []
+
+    while pos < len(tokens):
+        token = tokens[pos]
+
+        if token == '(':
+            sublist, pos = _parseList(tokens, pos + 1)
+            result.append(sublist)
+            continue
+
+        pos += 1
+        if token == ')':
+            return result, pos
+
+        if not isinstance(token, (Literal, Quoted)) and token.upper() == b'NIL':
+            result.append(None)
+        else:
+            result.append(token)
+
+    raise ValueError("Unbalanced parentheses in FETCH response")
+
+def parseFetchResponse(data):
+    # Parse the data from imaplib's uid('fetch', ...) into a list of
+    # {item name: value} dicts, one per message, e.g.
+    # { b'UID': b'101', b'BODY[1]': b'...' }. Item names are upper-cased.
+    tokens = _fetchTokens(data)
+    messages = []
+    pos = 0
+
+    while pos < len(tokens):
+        # Each message is a sequence number followed by a list of
+        # name/value pairs.
+        if pos + 1 >= len(tokens) or tokens[pos + 1] != '(':
+            raise ValueError("Malformed FETCH response")
+
+        items, pos = _parseList(tokens, pos + 2)
+
+        message = {}
+        for i in range(0, len(items) - 1, 2):
+            name = items[i]
+            if isinstance(name, bytes):
+                message[name.upper()] = items[i + 1]
+
+        messages.append(message)
+
+    return messages
+
+def _str(value):
+    if value is None:
+        return ''
+    return value.decode('ascii', 'replace').lower()
+
+def _params(value):
+    # Body parameters are a flat list of alternating names and values.
+    params = {}
+    if isinstance(value, list):
+        for i in range(0, len(value) - 1, 2):
+            params[_str(value[i])] = _str(value[i + 1])
+    return params
+
+def isMultipart(body):
+    # Whether a parsed BODYSTRUCTURE is of a multipart body, rather than
+    # a single-part message.
+    return isinstance(body, list) and len(body) > 0 and isinstance(body[0], list)
+
+def textSections(body, section = ''):
+    # Walk a parsed BODYSTRUCTURE and return a list of
+    # (section, subtype, charset, encoding) for each text/* part, e.g.
+    # [('1.1', 'plain', 'utf-8', 'quoted-printable'), ...].
+    #
+    # Returns None if the structure holds something we don't look inside
+    # (such as an attached message), in which case the caller should
+    # fall back to fetching the whole message.
+    if not isinstance(body, list) or not body:
+        return None
+
+    # A multipart body starts with its child bodies.
+    if isMultipart(body):
+        sections = []
+        part_number = 0
+
+        for child in body:
+            if not isinstance(child, list):
+                break
+
+            part_number += 1
+            child_section = '%s.%d' % (section, part_number) if section \
+                else str(part_number)
+
+            child_sections = textSections(child, child_section)
+            if child_sections is None:
+                return None
+
+            sections.extend(child_sections)
+
+        return sections
+
+    if len(body) < 7:
+        return None
+
+    main_type = _str(body[0])
+    sub_type = _str(body[1])
+
+    # A single-part message's body is section 1.
+    if not section:
+        section = '1'
+
+    if main_type == 'message':
+        return None
+
+    if main_type != 'text':
+        return []
+
+    charset = _params(body[2]).get('charset', 'us-ascii')
+    encoding = _str(body[5]) or '7bit'
+
+    return [(section, sub_type, charset, encoding)]
+
+def decodeSection(section_bytes, charset, encoding):
+    # Undo the Content-Transfer-Encoding and charset of a fetched section,
+    # the same way email's get_content() would.
+    if section_bytes is None:
+        return ''
+
+    if encoding == 'base64':
+        section_bytes = base64.b64decode(section_bytes)
+    elif encoding == 'quoted-printable':
+        section_bytes = decodestring(section_bytes)
+
+    try:
+        return section_bytes.decode(charset, 'replace')
+    except LookupError:
+        return section_bytes.decode('utf-8', 'replace')
+
+if __name__ == '__main__':
+    # Test code
+    test_data = [
+        (b'1 (UID 101 BODYSTRUCTURE (("TEXT" "PLAIN" ("CHARSET" "utf-8") NIL NIL '
+         b'"QUOTED-PRINTABLE" 120 4 NIL NIL NIL)("APPLICATION" "PDF" ("NAME" {9}',
+         b'brief.pdf'),
+        b') NIL NIL "BASE64" 40000 NIL NIL NIL) "MIXED" ("BOUNDARY" "xyz") NIL NIL))',
+        b'2 (UID 102 BODYSTRUCTURE ("TEXT" "HTML" NIL NIL NIL "7BIT" 10 1 NIL NIL NIL))',
+        ]
+
+    for message in parseFetchResponse(test_data):
+        print("UID <%s>: %s" % (message[b'UID'].decode(),
+                                textSections(message[b'BODYSTRUCTURE'])))
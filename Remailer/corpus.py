@@ -0,0 +1,127 @@
+'''
+Created on Oct 18, 2026
+
+Makes synthetic messages for benchmarking the remailer: plain text, or text
+with an HTML alternative, and/or with attachments, carrying any number of
+remail-to tags, with the text sent 7bit, quoted-printable or base64. The
+same seed always gives the same corpus, so runs can be compared.
+'''
+
+import random
+from email.message import EmailMessage
+from email.policy import default
+
+# How messages are turned into bytes, as a mail server would store them.
+corpus_policy = default.clone(linesep = '\r\n')
+
+words = ('the quick brown fox jumps over lazy dog remailer message inbox '
+         'newsletter offer update account please click here today free '
+         'meeting schedule report attached regards thanks').split()
+
+# Attachment kinds, as (MIME type, smallest size, largest size).
+attachment_kinds = {
+    'none':  None,
+    'small': ('application/pdf', 2000, 20000),
+    'large': ('image/jpeg', 200000, 1000000),
+}
+
+class CorpusMessage:
+    # A generated message and what the remailer should make of it.
+    def __init__(self, message_bytes, subject, recipients, description):
+        self.message_bytes = message_bytes
+        self.subject = subject
+        self.recipients = recipients
+        self.description = description
+
+def _text(rng, size, tags):
+    # Roughly size characters of words in 70-character lines, with the
+    # tags scattered through them. Now and then a line starts with a
+    # period, to exercise dot-stuffing.
+    lines = []
+    line = []
+    length = 0
+    total = 0
+
+    while total < size:
+        word = rng.choice(words)
+        if length + len(word) > 70:
+            if rng.random() < 0.02:
+                line.insert(0, '.')
+            lines.append(' '.join(line))
+            line = []
+            length = 0
+        line.append(word)
+        length += len(word) + 1
+        total += len(word) + 1
+    lines.append(' '.join(line))
+
+    for tag in tags:
+        i = rng.randrange(len(lines))
+        lines[i] = lines[i] + ' ' + tag
+
+    return '\n'.join(lines) + '\n'
+
+def makeMessage(rng, number, body_size, tag_count, encoding, attachment, html):
+    recipients = set('recipient%d.%d@example.com' % (number, i) for i in range(tag_count))
+    tags = ['${remail-to:%s}' % recipient for recipient in sorted(recipients)]
+    subject = 'Benchmark message %d' % number
+
+    message = EmailMessage()
+    message['From'] = 'sender%d@example.org' % number
+    message['To'] = 'remailer@example.com'
+    message['Subject'] = subject
+    message.set_content(_text(rng, body_size, tags), cte = encoding)
+
+    if html:
+        html_body = '<html><body><p>%s</p></body></html>\n' % _text(rng, body_size, tags)
+        message.add_alternative(html_body, subtype = 'html', cte = encoding)
+
+    kind = attachment_kinds[attachment]
+    if kind is not None:
+        mime_type, smallest, largest = kind
+        maintype, subtype = mime_type.split('/')
+        message.add_attachment(rng.randbytes(rng.randint(smallest, largest)),
+                               maintype = maintype, subtype = subtype,
+                               filename = 'attachment-%d.%s' % (number, subtype))
+
+    description = '%d tags, %s, %s attachment%s' % (tag_count, encoding, attachment,
+                                                    ', html' if html else '')
+
+    return CorpusMessage(message.as_bytes(policy = corpus_policy), subject,
+                         recipients, description)
+
+def makeCorpus(count, seed = 0, body_sizes = (500, 20000),
+               tag_counts = (0, 1, 1, 2, 5),
+               encodings = ('7bit', 'quoted-printable', 'base64'),
+               attachment_mix = (('none', 0.7), ('small', 0.2), ('large', 0.1)),
+               html_fraction = 0.3):
+    # Returns a list of count CorpusMessages. Body sizes are picked
+    # between the two body_sizes, tag counts and encodings from the lists
+    # given, and attachments by the weights in attachment_mix.
+    rng = random.Random(seed)
+    attachments = [kind for kind, weight in attachment_mix]
+    weights = [weight for kind, weight in attachment_mix]
+    corpus = []
+
+    for number in range(count):
+        attachment = rng.choices(attachments, weights)[0]
+        html = rng.random() < html_fraction
+
+        corpus.append(makeMessage(rng, number,
+                                  rng.randint(*body_sizes),
+                                  rng.choice(tag_counts),
+                                  rng.choice(encodings),
+                                  attachment, html))
+
+    return corpus
+
+if __name__ == '__main__':
+    # Test code
+    corpus = makeCorpus(10, seed = 1)
+
+    for message in corpus:
+        print('%-22s %8d bytes  %s' % (message.subject, len(message.message_bytes),
+                                       message.description))
+
+    print()
+    print(corpus[0].message_bytes[:600].decode('ascii', 'replace'))
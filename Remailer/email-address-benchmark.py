@@ -0,0 +1,101 @@
+'''
+Created on Oct 18, 2026
+
+A micro-benchmark for email_address.matchEmailAddress. Times it against
+rfc5322.email_prog on adversarial tag values of increasing length - the
+kind of thing a pattern with nested repeats can be made to backtrack over -
+and shows the time per character, which for a linear-time check stays flat
+however long the value gets. Then shows the memo cache at work on a
+campaign's worth of repeated addresses.
+
+    python email-address-benchmark.py --max-length 100000
+
+Exits with status 1 if the two ever disagree, or if the new scanner's time
+per character grows more than --max-growth times from the shortest value
+to the longest.
+'''
+import sys
+import timeit
+import argparse
+
+from rfc5322 import email_prog
+from email_address import matchEmailAddress
+from email_address import remailAddress
+
+# Each makes a value of about n characters that almost, but not quite,
+# holds an address, so both checks have to look at all of it.
+adversaries = [
+    ('local part',       lambda n: 'a' * n),
+    ('dotted local',     lambda n: 'a.' * (n // 2) + '.@'),
+    ('dotted domain',    lambda n: 'a@' + 'a.' * (n // 2) + '-'),
+    ('hyphened label',   lambda n: 'a@' + 'a-' * (n // 2)),
+    ('hyphens, dot',     lambda n: 'a@a' + '-' * n + '.'),
+    ('general literal',  lambda n: 'a@[1.2.3.a:' + ']b' * (n // 2)),
+    ('unclosed literal', lambda n: 'a@[1.2.3.a:' + 'b' * n),
+    ('quoted local',     lambda n: '"' + '\\a' * (n // 2)),
+    ]
+
+def matchOld(value):
+    match = email_prog.match(value)
+    return match.group(0) if match is not None else None
+
+def bestTime(func, arg, repeat):
+    return min(timeit.repeat(lambda: func(arg), number = 1, repeat = repeat))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Time the email address check.')
+    parser.add_argument('--max-length', type = int, default = 100000,
+                        help = 'longest adversarial value to try')
+    parser.add_argument('--max-growth', type = float, default = 4.0,
+                        help = 'allowed growth in time per character')
+    args = parser.parse_args()
+
+    lengths = []
+    length = 100
+    while length <= args.max_length:
+        lengths.append(length)
+        length *= 10
+
+    failed = False
+
+    print("%-17s %8s %12s %12s %12s %12s" % ("value", "chars", "regex (s)", "scanner (s)",
+                                             "regex ns/ch", "scan ns/ch"))
+
+    for name, make in adversaries:
+        per_char = []
+
+        for length in lengths:
+            value = make(length)
+
+            # The quoted local part is where the two are meant to differ.
+            if name != 'quoted local' and matchOld(value) != matchEmailAddress(value):
+                print("*** Disagreement on %s of %d characters" % (name, length))
+                failed = True
+
+            old_time = bestTime(matchOld, value, 3)
+            new_time = bestTime(matchEmailAddress, value, 5)
+            per_char.append(new_time / len(value))
+
+            print("%-17s %8d %12.6f %12.6f %12.1f %12.1f" % (name, len(value), old_time, new_time,
+                                                              1e9 * old_time / len(value),
+                                                              1e9 * new_time / len(value)))
+
+        if per_char[-1] > args.max_growth * per_char[0]:
+            print("*** Scanner time per character grew %.1fx on %s"
+                  % (per_char[-1] / per_char[0], name))
+            failed = True
+
+    # A campaign: the same few hundred addresses, in tags over and over.
+    values = [ 'person%d@Example.COM' % (i % 300) for i in range(100000) ]
+    remailAddress.cache_clear()
+
+    cached_time = bestTime(lambda values: [ remailAddress(value) for value in values ], values, 1)
+    uncached_time = bestTime(lambda values: [ matchEmailAddress(value) for value in values ],
+                             values, 1)
+
+    print()
+    print("%d tags, %d addresses: %.4fs uncached, %.4fs cached"
+          % (len(values), len(set(values)), uncached_time, cached_time))
+    print(remailAddress.cache_info())
+
+    sys.exit(1 if failed else 0)
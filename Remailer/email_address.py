@@ -0,0 +1,176 @@
+'''
+Created on Oct 18, 2026
+
+Validation of the addresses in remail-to tags, in place of the regular
+expression in rfc5322.py. It accepts the same addresses as
+email_prog.match did, using only patterns that can match just one way and
+plain string handling for domain names, where the old pattern's nested
+repeats could go back over the same characters again and again. However
+long or hostile a tag's value is, checking it takes time in proportion to
+its length.
+
+The grammar, as the old pattern had it:
+
+    address  = (dot-atom | quoted) "@" (domain | literal)
+    dot-atom = 1*atext *("." 1*atext)
+    quoted   = DQUOTE *(qtext | "\\" quoted-char) DQUOTE
+    domain   = 1*(label ".") label       ; labels start and end alphanumeric
+    literal  = "[" 3*(octet ".") (octet | tag ":" 1*ltext) "]"
+
+As with email_prog.match, the address is taken from the start of the value
+and anything after it is ignored ("a@example.com>" gives a@example.com).
+There are two differences. Only ASCII letters count as letters; the old
+pattern, being case-insensitive over Unicode, also let through the odd
+character (the Kelvin sign, say) that folds to one. And quoted local parts
+("jim@home"@example.com) are accepted as the pattern meant them to
+be: it was written as an ordinary string, so its \x5d turned into a ']'
+that ended the character class early, and the only quoted local part it
+would take was "".
+
+Addresses come back with their domain in lower case, and are cached, since
+the same few turn up again and again over a campaign.
+'''
+
+import re
+from functools import lru_cache
+
+# None of these can match a string more than one way - each repeat is of
+# something that can't start with what follows it - so when one fails,
+# there's nothing for the regular expression engine to go back and try
+# again, and it runs in time proportional to the length of the string.
+atext = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+qtext = r'[\x01-\x08\x0b\x0c\x0e-\x1f\x21\x23-\x5b\x5d-\x7f]'
+quoted_char = r'[\x01-\x09\x0b\x0c\x0e-\x7f]'
+local_part_prog = re.compile(atext + r'(?:\.' + atext + r')*|"(?:' + qtext +
+                             r'|\\' + quoted_char + r')*"')
+label_run_prog = re.compile(r'[A-Za-z0-9.-]*')
+label_prog = re.compile(r'[A-Za-z0-9-]+')
+digits_prog = re.compile(r'[0-9]+')
+ltext_prog = re.compile(r'[\x01-\x08\x0b\x0c\x0e-\x1f\x21-\x7f]+')
+
+def _localPartEnd(str_):
+    # The end of the local part at the start of str_, or None.
+    match = local_part_prog.match(str_)
+    return match.end() if match is not None else None
+
+def _domainEnd(str_, pos):
+    # The end of the domain name at pos, which needs at least two labels,
+    # each of alphanumerics and hyphens, starting and ending with an
+    # alphanumeric. Where the last one is followed by a dot, the dot isn't
+    # part of it.
+    pieces = label_run_prog.match(str_, pos).group(0).split('.')
+    label_ends = []
+
+    for piece in pieces[:-1]:
+        if not piece or piece[0] == '-' or piece[-1] == '-':
+            break
+        pos += len(piece)
+        label_ends.append(pos)
+        pos += 1
+    else:
+        piece = pieces[-1]
+
+    if not label_ends:
+        return None
+
+    # The labels so far were each followed by a dot; this last one
+    # needn't be whole (any hyphens it ends with are left off), but it
+    # can't be left off altogether. If there's nothing after the last
+    # dot, the name ends before it.
+    if piece and piece[0] != '-':
+        return pos + len(piece.rstrip('-'))
+    return label_ends[-1] if len(label_ends) > 1 else None
+
+def _isOctet(digits):
+    # 0 to 255, with no leading zeros.
+    return len(digits) <= 3 and (digits == '0' or digits[0] != '0') and int(digits) <= 255
+
+def _literalEnd(str_, pos):
+    # The end of the address literal starting with '[' at pos, or None.
+    pos += 1
+
+    for i in range(3):
+        match = digits_prog.match(str_, pos)
+        if match is None or not _isOctet(match.group(0)) or \
+                not str_.startswith('.', match.end()):
+            return None
+        pos = match.end() + 1
+
+    match = digits_prog.match(str_, pos)
+    if match is not None and _isOctet(match.group(0)) and str_.startswith(']', match.end()):
+        return match.end() + 1
+
+    # Otherwise a tag (which may start with a hyphen but not end with
+    # one), a colon, and then as much as possible up to the last ']'.
+    match = label_prog.match(str_, pos)
+    if match is None or str_[match.end() - 1] == '-' or not str_.startswith(':', match.end()):
+        return None
+
+    pos = match.end() + 1
+    match = ltext_prog.match(str_, pos)
+    if match is None:
+        return None
+
+    close = str_.rfind(']', pos + 1, match.end())
+    return close + 1 if close != -1 else None
+
+def matchEmailAddress(str_):
+    # Returns the email address at the start of str_, as it's written
+    # there, or None; the same as email_prog.match(str_).group(0).
+    local_end = _localPartEnd(str_)
+    if local_end is None or not str_.startswith('@', local_end):
+        return None
+
+    if str_.startswith('[', local_end + 1):
+        end = _literalEnd(str_, local_end + 1)
+    else:
+        end = _domainEnd(str_, local_end + 1)
+
+    return str_[:end] if end is not None else None
+
+def normaliseEmailAddress(address):
+    # Lower-case the domain, which is case-insensitive, leaving the local
+    # part alone.
+    local_part, at, domain = address.rpartition('@')
+    if address.startswith('"') or domain.startswith('['):
+        # The local part may hold an '@' of its own, and so may a
+        # literal, so find the split the long way.
+        local_part_end = _localPartEnd(address)
+        local_part, domain = address[:local_part_end], address[local_part_end + 1:]
+    return local_part + '@' + domain.lower()
+
+@lru_cache(maxsize = 4096)
+def remailAddress(value):
+    # The normalised address at the start of a remail-to tag's value, or
+    # None.
+    address = matchEmailAddress(value)
+    return normaliseEmailAddress(address) if address is not None else None
+
+def addAddresses(addresses, more_addresses):
+    # Add more_addresses to the set addresses, leaving out any that are
+    # already there in a different case.
+    seen = set(address.lower() for address in addresses)
+
+    for address in sorted(more_addresses):
+        if address.lower() not in seen:
+            seen.add(address.lower())
+            addresses.add(address)
+
+    return addresses
+
+if __name__ == '__main__':
+    # Test code
+    test_strings = [ "Scott.Schmidt@L3Harris.com",
+                     "jtoftx@gmail.com",
+                     "Jim Thompson <jtoftx@gmail.com>",
+                     "jtoftx+test1@gmail.com>",
+                     'jtoftx+test_2@gmail.com "Jim Thompson"',
+                     '"jim@home"@Example.COM',
+                     'postmaster@[192.168.1.1]',
+                     'someone@example.',
+                     "jt of tx at gmail dot com" ]
+
+    for test_string in test_strings:
+        print('%-40s %s' % (test_string, remailAddress(test_string)))
+
+    print(remailAddress.cache_info())
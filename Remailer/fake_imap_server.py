@@ -0,0 +1,513 @@
+'''
+Created on Oct 18, 2026
+
+A stand-in IMAP server for benchmarks and tests, run in-process on a
+background thread. It understands enough IMAP4rev1 for the remailer:
+LOGIN, CAPABILITY, SELECT, STATUS, UID SEARCH/FETCH/COPY/MOVE/STORE/EXPUNGE,
+EXPUNGE, APPEND, IDLE, NOOP, CLOSE and LOGOUT, with keywords, MODSEQ and
+STORE's UNCHANGEDSINCE. Whether it offers MOVE, UIDPLUS, CONDSTORE and so
+on is up to the capabilities it's given, and every command can be made to
+take a little while, as a real server's would.
+
+    server = FakeIMAPServer(['INBOX', 'INBOX/remailer-sent'],
+                            capabilities = 'IMAP4rev1 UIDPLUS IDLE',
+                            latency = 0.02).start()
+    server.deliver('INBOX', message_bytes)
+    imap_cxn = imaplib.IMAP4('127.0.0.1', server.port())
+'''
+
+import re
+import time
+import select
+import threading
+import socketserver
+from functools import lru_cache
+from email.parser import BytesParser
+from email.policy import default
+
+class FakeMailbox:
+    def __init__(self):
+        # uid -> [message bytes, set of flags, modseq]
+        self.messages = {}
+        self.uidnext = 1
+        self.uidvalidity = 1
+        self.modseq = 1
+
+    def add(self, message_bytes, flags = ()):
+        uid = self.uidnext
+        self.uidnext += 1
+        self.modseq += 1
+        self.messages[uid] = [bytes(message_bytes), set(flags), self.modseq]
+        return uid
+
+def _quoted(str_):
+    return '"' + str_.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _bodyStructure(message):
+    # Enough of a BODYSTRUCTURE for bodystructure.textSections.
+    if message.is_multipart():
+        children = ''.join(_bodyStructure(part) for part in message.get_payload())
+        return '(%s %s)' % (children, _quoted(message.get_content_subtype().upper()))
+
+    charset = message.get_content_charset()
+    params = '("CHARSET" %s)' % _quoted(charset) if charset else 'NIL'
+    encoding = message.get('Content-Transfer-Encoding', '7bit').upper()
+    payload = message.get_payload()
+    size = len(payload) if isinstance(payload, str) else 0
+
+    fields = '%s %s %s NIL NIL %s %d' % (_quoted(message.get_content_maintype().upper()),
+                                        _quoted(message.get_content_subtype().upper()),
+                                        params, _quoted(encoding), size)
+    if message.get_content_maintype() == 'text':
+        fields += ' %d' % payload.count('\n')
+
+    return '(%s NIL NIL NIL)' % fields
+
+# The server shares the benchmark's process, so parse each message once
+# rather than every time it's asked about, to keep its own work out of the
+# numbers as far as possible.
+@lru_cache(maxsize = 4096)
+def _parsed(message_bytes):
+    return BytesParser(policy = default).parsebytes(message_bytes)
+
+@lru_cache(maxsize = 4096)
+def _bodyStructureString(message_bytes):
+    return _bodyStructure(_parsed(message_bytes))
+
+@lru_cache(maxsize = 4096)
+def _sectionBytes(message_bytes, section):
+    # The undecoded body of a numbered part, e.g. '1.2'.
+    message = _parsed(message_bytes)
+    for number in section.split('.'):
+        if message.is_multipart():
+            message = message.get_payload()[int(number) - 1]
+
+    payload = message.get_payload()
+    if isinstance(payload, str):
+        return payload.encode('utf-8', 'surrogateescape')
+    return b''
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    # One of these per client connection. Commands are handled by the
+    # do_<COMMAND> methods (do_UID_FETCH for UID FETCH, etc.).
+
+    literal_prog = re.compile(rb'\{(\d+)(\+?)\}\r\n$')
+
+    def setup(self):
+        super().setup()
+        self.selected = None
+
+        # The UIDNEXT of the selected folder when we last told the client
+        # how many messages it holds.
+        self.reported_uidnext = None
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def mailbox(self):
+        return self.server.folders[self.selected]
+
+    def reportNewMail(self):
+        # Tell the client with an EXISTS if messages have arrived in the
+        # selected folder since it last heard, as a real server does.
+        # Call with the server's lock held.
+        mailbox = self.mailbox()
+        if mailbox.uidnext != self.reported_uidnext:
+            self.send('* %d EXISTS\r\n' % len(mailbox.messages))
+            self.reported_uidnext = mailbox.uidnext
+
+    def matchingUIDs(self, uid_set):
+        existing = sorted(self.mailbox().messages)
+        uids = set()
+
+        # * is the highest UID in the mailbox.
+        def bound(value):
+            if value == '*':
+                return existing[-1] if existing else 0
+            return int(value)
+
+        for part in uid_set.split(','):
+            lo, _, hi = part.partition(':')
+            lo = bound(lo)
+            hi = bound(hi) if hi else lo
+            lo, hi = min(lo, hi), max(lo, hi)
+            uids.update(uid for uid in existing if lo <= uid <= hi)
+
+        return sorted(uids)
+
+    def sequenceNumber(self, uid):
+        return sorted(self.mailbox().messages).index(uid) + 1
+
+    def folderArgument(self, args):
+        args = args.strip()
+        if args.startswith('"'):
+            return args[1:args.index('"', 1)]
+        return args.split(' ')[0]
+
+    def readCommand(self):
+        # Returns (tag, command, args, literal), or None at end of input.
+        line = self.rfile.readline()
+        if not line:
+            return None
+
+        literal = None
+        match = self.literal_prog.search(line)
+        if match is not None:
+            if not match.group(2):
+                self.send('+ Ready\r\n')
+            literal = self.rfile.read(int(match.group(1)))
+            line = line[:match.start()] + self.rfile.readline()
+
+        parts = line.decode('utf-8', 'replace').rstrip('\r\n').split(' ', 2)
+        while len(parts) < 3:
+            parts.append('')
+        tag, command, args = parts
+        command = command.upper()
+
+        if command == 'UID':
+            sub_command, _, args = args.partition(' ')
+            command = 'UID_' + sub_command.upper()
+
+        return tag, command, args, literal
+
+    def handle(self):
+        self.send('* OK [CAPABILITY %s] Fake IMAP server ready\r\n' % self.server.capabilities)
+
+        while True:
+            command = self.readCommand()
+            if command is None:
+                return
+
+            tag, name, args, literal = command
+            self.server.countCommand(name)
+
+            if self.server.latency:
+                time.sleep(self.server.latency)
+
+            method = getattr(self, 'do_' + name, None)
+            if method is None:
+                self.send('%s BAD Unknown command\r\n' % tag)
+                continue
+
+            try:
+                if method(tag, args, literal) is False:
+                    return
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                self.send('%s BAD %s\r\n' % (tag, str(e).replace('\r\n', ' ')))
+
+    def do_CAPABILITY(self, tag, args, literal):
+        self.send('* CAPABILITY %s\r\n%s OK done\r\n' % (self.server.capabilities, tag))
+
+    def do_LOGIN(self, tag, args, literal):
+        self.send('%s OK [CAPABILITY %s] Logged in\r\n' % (tag, self.server.capabilities))
+
+    def do_NOOP(self, tag, args, literal):
+        if self.selected is not None:
+            with self.server.lock:
+                self.reportNewMail()
+
+        self.send('%s OK done\r\n' % tag)
+
+    def do_LOGOUT(self, tag, args, literal):
+        self.send('* BYE\r\n%s OK done\r\n' % tag)
+        return False
+
+    def do_CLOSE(self, tag, args, literal):
+        with self.server.lock:
+            self.expunge(None, report = False)
+        self.selected = None
+        self.send('%s OK done\r\n' % tag)
+
+    def do_SELECT(self, tag, args, literal):
+        folder = self.folderArgument(args)
+
+        with self.server.lock:
+            if folder not in self.server.folders:
+                self.send('%s NO No such folder\r\n' % tag)
+                return
+
+            self.selected = folder
+            mailbox = self.mailbox()
+            self.reported_uidnext = mailbox.uidnext
+            modseq = ''
+            if 'CONDSTORE' in self.server.capabilities.split():
+                modseq = '* OK [HIGHESTMODSEQ %d] ok\r\n' % mailbox.modseq
+
+            self.send('* %d EXISTS\r\n* 0 RECENT\r\n'
+                      '* OK [UIDVALIDITY %d] ok\r\n* OK [UIDNEXT %d] ok\r\n%s'
+                      '%s OK [READ-WRITE] done\r\n'
+                      % (len(mailbox.messages), mailbox.uidvalidity, mailbox.uidnext,
+                         modseq, tag))
+
+    do_EXAMINE = do_SELECT
+
+    def do_STATUS(self, tag, args, literal):
+        folder = self.folderArgument(args)
+
+        with self.server.lock:
+            if folder not in self.server.folders:
+                self.send('%s NO No such folder\r\n' % tag)
+                return
+
+            mailbox = self.server.folders[folder]
+            values = { 'MESSAGES': len(mailbox.messages), 'UIDNEXT': mailbox.uidnext,
+                       'UIDVALIDITY': mailbox.uidvalidity, 'HIGHESTMODSEQ': mailbox.modseq,
+                       'RECENT': 0, 'UNSEEN': 0 }
+            items = re.findall(r'[A-Z]+', args[args.index('('):].upper())
+
+            self.send('* STATUS %s (%s)\r\n%s OK done\r\n'
+                      % (_quoted(folder), ' '.join('%s %d' % (item, values[item])
+                                                   for item in items),
+                         tag))
+
+    def do_UID_SEARCH(self, tag, args, literal):
+        words = args.split()
+        upper_words = [word.upper() for word in words]
+
+        with self.server.lock:
+            mailbox = self.mailbox()
+            uids = sorted(mailbox.messages)
+
+            if 'UNDELETED' in upper_words:
+                uids = [uid for uid in uids if '\\Deleted' not in mailbox.messages[uid][1]]
+            if 'UID' in upper_words:
+                wanted = set(self.matchingUIDs(words[upper_words.index('UID') + 1]))
+                uids = [uid for uid in uids if uid in wanted]
+
+            self.send('* SEARCH %s\r\n%s OK done\r\n'
+                      % (' '.join(str(uid) for uid in uids), tag))
+
+    def do_UID_FETCH(self, tag, args, literal):
+        uid_set, items = args.split(' ', 1)
+        upper_items = items.upper()
+
+        with self.server.lock:
+            mailbox = self.mailbox()
+
+            for uid in self.matchingUIDs(uid_set):
+                message_bytes, flags, modseq = mailbox.messages[uid]
+                response = [b'* %d FETCH (UID %d' % (self.sequenceNumber(uid), uid)]
+
+                if 'FLAGS' in upper_items:
+                    response.append(b' FLAGS (%s)' % ' '.join(sorted(flags)).encode())
+
+                if 'MODSEQ' in upper_items:
+                    response.append(b' MODSEQ (%d)' % modseq)
+
+                if 'BODYSTRUCTURE' in upper_items:
+                    response.append(b' BODYSTRUCTURE ' +
+                                    _bodyStructureString(message_bytes).encode())
+
+                if 'BODY.PEEK[]' in upper_items or 'BODY[]' in upper_items:
+                    response.append(b' BODY[] {%d}\r\n' % len(message_bytes) + message_bytes)
+                elif re.search(r'\bRFC822\b', upper_items):
+                    response.append(b' RFC822 {%d}\r\n' % len(message_bytes) + message_bytes)
+
+                for section in re.findall(r'BODY(?:\.PEEK)?\[([\d.]+)\]', upper_items):
+                    data = _sectionBytes(message_bytes, section)
+                    response.append(b' BODY[%s] {%d}\r\n' % (section.encode(), len(data)) + data)
+
+                response.append(b')\r\n')
+                self.send(b''.join(response))
+
+        self.send('%s OK done\r\n' % tag)
+
+    def copy(self, uid_set, folder):
+        source = self.mailbox()
+        destination = self.server.folders[folder]
+        for uid in self.matchingUIDs(uid_set):
+            destination.add(source.messages[uid][0], source.messages[uid][1])
+
+    def do_UID_COPY(self, tag, args, literal):
+        uid_set, folder = args.split(' ', 1)
+
+        with self.server.lock:
+            self.copy(uid_set, self.folderArgument(folder))
+
+        self.send('%s OK done\r\n' % tag)
+
+    def do_UID_MOVE(self, tag, args, literal):
+        if 'MOVE' not in self.server.capabilities.split():
+            self.send('%s BAD No MOVE here\r\n' % tag)
+            return
+
+        uid_set, folder = args.split(' ', 1)
+
+        with self.server.lock:
+            self.copy(uid_set, self.folderArgument(folder))
+
+            mailbox = self.mailbox()
+            for uid in reversed(self.matchingUIDs(uid_set)):
+                self.send('* %d EXPUNGE\r\n' % self.sequenceNumber(uid))
+                del mailbox.messages[uid]
+            mailbox.modseq += 1
+
+        self.send('%s OK done\r\n' % tag)
+
+    unchanged_since_prog = re.compile(r'\(UNCHANGEDSINCE (\d+)\) ', re.IGNORECASE)
+
+    def do_UID_STORE(self, tag, args, literal):
+        uid_set, args = args.split(' ', 1)
+
+        # Messages changed since UNCHANGEDSINCE are left alone, and
+        # reported as MODIFIED.
+        unchanged_since = None
+        match = self.unchanged_since_prog.match(args)
+        if match is not None:
+            unchanged_since = int(match.group(1))
+            args = args[match.end():]
+
+        mode, flags = args.split(' ', 1)
+        flags = set(flags.strip('()').split())
+        mode = mode.upper()
+        modified = []
+
+        with self.server.lock:
+            mailbox = self.mailbox()
+
+            for uid in self.matchingUIDs(uid_set):
+                if unchanged_since is not None and mailbox.messages[uid][2] > unchanged_since:
+                    modified.append(uid)
+                    continue
+
+                current = mailbox.messages[uid][1]
+                if mode.startswith('+'):
+                    current |= flags
+                elif mode.startswith('-'):
+                    current -= flags
+                else:
+                    current.clear()
+                    current |= flags
+
+                mailbox.modseq += 1
+                mailbox.messages[uid][2] = mailbox.modseq
+
+                if not mode.endswith('.SILENT'):
+                    self.send('* %d FETCH (UID %d FLAGS (%s))\r\n'
+                              % (self.sequenceNumber(uid), uid, ' '.join(sorted(current))))
+
+        if modified:
+            self.send('%s OK [MODIFIED %s] Conditional STORE failed\r\n'
+                      % (tag, ','.join(str(uid) for uid in modified)))
+        else:
+            self.send('%s OK done\r\n' % tag)
+
+    def expunge(self, uid_set, report = True):
+        mailbox = self.mailbox()
+        uids = self.matchingUIDs(uid_set) if uid_set else sorted(mailbox.messages)
+
+        for uid in reversed(uids):
+            if '\\Deleted' in mailbox.messages[uid][1]:
+                if report:
+                    self.send('* %d EXPUNGE\r\n' % self.sequenceNumber(uid))
+                del mailbox.messages[uid]
+        mailbox.modseq += 1
+
+    def do_UID_EXPUNGE(self, tag, args, literal):
+        if 'UIDPLUS' not in self.server.capabilities.split():
+            self.send('%s BAD No UIDPLUS here\r\n' % tag)
+            return
+
+        with self.server.lock:
+            self.expunge(args.strip())
+
+        self.send('%s OK done\r\n' % tag)
+
+    def do_EXPUNGE(self, tag, args, literal):
+        with self.server.lock:
+            self.expunge(None)
+
+        self.send('%s OK done\r\n' % tag)
+
+    def do_APPEND(self, tag, args, literal):
+        self.server.deliver(self.folderArgument(args), literal)
+        self.send('%s OK APPEND done\r\n' % tag)
+
+    def do_IDLE(self, tag, args, literal):
+        # Report new mail until the client says DONE.
+        self.send('+ idling\r\n')
+
+        while True:
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                if not self.rfile.readline():
+                    return False
+                break
+
+            with self.server.lock:
+                self.reportNewMail()
+
+        self.send('%s OK IDLE terminated\r\n' % tag)
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, folders, capabilities = 'IMAP4rev1 MOVE UIDPLUS IDLE',
+                 latency = 0, port = 0):
+        # latency is how long, in seconds, every command takes. A port of
+        # 0 means any free port; see port().
+        super().__init__(('127.0.0.1', port), _IMAPHandler)
+
+        self.folders = dict((folder, FakeMailbox()) for folder in folders)
+        self.capabilities = capabilities
+        self.latency = latency
+
+        self.lock = threading.RLock()
+        self.command_counts = {}
+
+    def port(self):
+        return self.server_address[1]
+
+    def countCommand(self, name):
+        with self.lock:
+            self.command_counts[name] = self.command_counts.get(name, 0) + 1
+
+    def deliver(self, folder, message_bytes):
+        # Put a message in a folder, as if it had just arrived. Returns its
+        # UID.
+        with self.lock:
+            return self.folders[folder].add(message_bytes)
+
+    def messageCount(self, folder):
+        with self.lock:
+            return len(self.folders[folder].messages)
+
+    def start(self):
+        threading.Thread(target = self.serve_forever, name = 'fake-imap',
+                         daemon = True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == '__main__':
+    # Test code
+    import imaplib
+
+    server = FakeIMAPServer(['INBOX', 'Archive'], capabilities = 'IMAP4rev1 UIDPLUS').start()
+    server.deliver('INBOX', b'Subject: one\r\n\r\nFirst.\r\n')
+    server.deliver('INBOX', b'Subject: two\r\n\r\nSecond.\r\n')
+
+    imap_cxn = imaplib.IMAP4('127.0.0.1', server.port())
+    imap_cxn.login('user', 'password')
+    print(imap_cxn.status('INBOX', '(MESSAGES UIDNEXT UIDVALIDITY)'))
+    print(imap_cxn.select('INBOX'))
+    print(imap_cxn.uid('search', None, 'UNDELETED'))
+    print(imap_cxn.uid('fetch', '1:*', '(BODY.PEEK[])'))
+    print(imap_cxn.uid('copy', '1', 'Archive'))
+    print(imap_cxn.uid('store', '1', '+FLAGS.SILENT', r'(\Deleted)'))
+    print(imap_cxn.uid('expunge', '1'))
+    print(imap_cxn.status('Archive', '(MESSAGES)'))
+    server.deliver('INBOX', b'Subject: three\r\n\r\nThird.\r\n')
+    print(imap_cxn.noop(), imap_cxn.response('EXISTS'))
+    imap_cxn.logout()
+
+    print(server.command_counts)
+    server.stop()
@@ -0,0 +1,161 @@
+'''
+Created on Oct 18, 2026
+
+A stand-in SMTP server for benchmarks and tests, run in-process on a
+background thread. It accepts everything (no TLS, no login) apart from
+recipients matching refuse_pattern, and those matching defer_pattern the
+first time they're tried (with a temporary 451), and can be made to take a while over
+each message, as a real server does. What it receives is kept in
+messages, as (time received, from_addr, recipients, message bytes).
+
+    server = FakeSMTPServer(latency = 0.05).start()
+    smtp_service = { 'server_addr': '127.0.0.1', 'port': server.port(),
+                     'starttls': False }
+'''
+
+import re
+import time
+import threading
+import socketserver
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def send(self, str_):
+        self.wfile.write(str_.encode('ascii') + b'\r\n')
+        self.wfile.flush()
+
+    def readData(self):
+        # Read the message up to the lone period, undoing the doubling of
+        # leading periods.
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line == b'.\r\n':
+                break
+            if line.startswith(b'.'):
+                line = line[1:]
+            lines.append(line)
+        return b''.join(lines)
+
+    def handle(self):
+        server = self.server
+        self.send('220 fake.smtp ESMTP ready')
+
+        from_addr = None
+        recipients = []
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            command = line.decode('ascii', 'replace').strip()
+            verb = command[:4].upper()
+
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b'250-fake.smtp\r\n250-PIPELINING\r\n250 8BITMIME\r\n')
+                self.wfile.flush()
+
+            elif verb == 'MAIL':
+                from_addr = command[command.index(':') + 1:].strip().strip('<>')
+                recipients = []
+                self.send('250 OK')
+
+            elif verb == 'RCPT':
+                recipient = command[command.index(':') + 1:].strip().strip('<>')
+                if server.refuse_prog is not None and server.refuse_prog.search(recipient):
+                    self.send('550 No such user')
+                elif server.defer(recipient):
+                    self.send('451 Try again later')
+                else:
+                    recipients.append(recipient)
+                    self.send('250 OK')
+
+            elif verb == 'DATA':
+                self.send('354 Go ahead')
+                message_bytes = self.readData()
+
+                if server.latency:
+                    time.sleep(server.latency)
+
+                server.received(from_addr, recipients, message_bytes)
+                self.send('250 OK')
+
+            elif verb == 'RSET':
+                from_addr = None
+                recipients = []
+                self.send('250 OK')
+
+            elif verb == 'NOOP':
+                self.send('250 OK')
+
+            elif verb == 'QUIT':
+                self.send('221 Bye')
+                return
+
+            else:
+                self.send('502 Not implemented')
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # A pool may connect many times at once.
+    request_queue_size = 64
+
+    def __init__(self, latency = 0, refuse_pattern = None, port = 0, defer_pattern = None):
+        # latency is how long, in seconds, the server takes to accept each
+        # message. A port of 0 means any free port; see port().
+        super().__init__(('127.0.0.1', port), _SMTPHandler)
+
+        self.latency = latency
+        self.refuse_prog = re.compile(refuse_pattern) if refuse_pattern else None
+        self.defer_prog = re.compile(defer_pattern) if defer_pattern else None
+        self.deferred = set()
+
+        self.lock = threading.Lock()
+        self.messages = []
+
+    def port(self):
+        return self.server_address[1]
+
+    def defer(self, recipient):
+        # Whether to put recipient off this time: only the first time it
+        # matches defer_pattern.
+        if self.defer_prog is None or not self.defer_prog.search(recipient):
+            return False
+
+        with self.lock:
+            if recipient in self.deferred:
+                return False
+            self.deferred.add(recipient)
+            return True
+
+    def received(self, from_addr, recipients, message_bytes):
+        with self.lock:
+            self.messages.append((time.monotonic(), from_addr, list(recipients),
+                                  message_bytes))
+
+    def start(self):
+        threading.Thread(target = self.serve_forever, name = 'fake-smtp',
+                         daemon = True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == '__main__':
+    # Test code
+    import smtplib
+
+    server = FakeSMTPServer(refuse_pattern = '^nobody@').start()
+
+    client = smtplib.SMTP('127.0.0.1', server.port())
+    print(client.sendmail('from@example.com', [ 'to@example.com', 'nobody@example.com' ],
+                          b'Subject: test\r\n\r\n.A line starting with a period.\r\n'))
+    client.quit()
+
+    for received_at, from_addr, recipients, message_bytes in server.messages:
+        print(from_addr, recipients, message_bytes)
+
+    server.stop()
@@ -0,0 +1,150 @@
+'''
+Created on Oct 18, 2026
+
+IMAP IDLE (RFC 2177) on an imaplib connection. imaplib has no IDLE of its
+own, so this drives the exchange by hand and leans on some of imaplib's
+private internals to do it:
+
+    _new_tag()       to get a tag in imaplib's sequence, which also adds it
+                     to tagged_commands; we take it out again when done.
+    file             the buffered reader imaplib reads responses through,
+                     which we peek at for data that select() can't see.
+    _append_untagged()
+                     to file the untagged responses we read, such as
+                     '* 5 EXISTS', with the rest, as imaplib would have,
+                     so that they're there for Remailer.pollSelectedFolder.
+
+plus the documented send(), readline(), socket() and shutdown(). Nothing
+else in the remailer touches imaplib below the level of its commands.
+
+If the exchange goes wrong partway through we can't tell how much of the
+server's side of it is still to come, so rather than leave the rest to
+turn up as the reply to some later command, the connection is shut down.
+The caller's next command then fails outright, and runMailbox's NOOP
+check reconnects.
+'''
+
+import ssl
+import time
+import select
+import logging
+import imaplib
+
+class IdleError(Exception):
+    # The server turned the IDLE down, or ended it with something other
+    # than OK. The connection is still in step and usable.
+    pass
+
+def _untagged(imap_cxn, line):
+    # File a response like '* 5 EXISTS' with imaplib's untagged responses.
+    # Returns True if it says new mail has arrived.
+    match = imaplib.Untagged_status.match(line.rstrip(b'\r\n'))
+    if match is None:
+        return False
+
+    typ = match.group('type').decode('ascii')
+    data = match.group('data')
+    if match.group('data2'):
+        data += b' ' + match.group('data2')
+    imap_cxn._append_untagged(typ, data)
+
+    return typ in ('EXISTS', 'RECENT')
+
+def _bufferedData(imap_cxn):
+    # Whatever is ready to read from the connection without waiting: what
+    # imaplib's buffered file has already taken from the socket, or failing
+    # that whatever the socket has. A response that arrived along with the
+    # last one we read sits in the buffer, where select() can't see it.
+    # Peeking at an empty buffer reads from the socket, so the socket is
+    # made non-blocking while we do.
+    sock = imap_cxn.socket()
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+
+    try:
+        return imap_cxn.file.peek()
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return b''
+    finally:
+        sock.settimeout(timeout)
+
+def _readline(imap_cxn, what):
+    line = imap_cxn.readline()
+    if not line:
+        raise RuntimeError('IMAP connection closed %s' % what)
+    logging.debug('Remailer: IDLE: %s' % line.rstrip().decode('utf-8', 'replace'))
+    return line
+
+def _idle(imap_cxn, tag, timeout):
+    imap_cxn.send(tag + b' IDLE\r\n')
+    new_mail = False
+
+    # The server must answer with a continuation before idling, though it
+    # may send untagged responses first.
+    while True:
+        line = _readline(imap_cxn, 'starting IDLE')
+        if line.startswith(b'+'):
+            break
+        if line.startswith(tag + b' '):
+            raise IdleError(line)
+        if _untagged(imap_cxn, line):
+            new_mail = True
+
+    sock = imap_cxn.socket()
+    deadline = time.monotonic() + timeout
+
+    while not new_mail:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        # Wait on the socket rather than setting a socket timeout, which
+        # would leave imaplib's buffered file unusable; but only once
+        # there's nothing already to hand.
+        if not _bufferedData(imap_cxn):
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if not readable:
+                break
+
+        line = _readline(imap_cxn, 'during IDLE')
+        if _untagged(imap_cxn, line):
+            new_mail = True
+
+    # End the IDLE and consume everything up to its tagged completion
+    # response. Mail may have come in as we stopped.
+    imap_cxn.send(b'DONE\r\n')
+
+    while True:
+        line = _readline(imap_cxn, 'ending IDLE')
+        if line.startswith(tag + b' '):
+            break
+        if _untagged(imap_cxn, line):
+            new_mail = True
+
+    if not line.startswith(tag + b' OK'):
+        raise IdleError(line)
+
+    return new_mail
+
+def idleUntilNewMail(imap_cxn, timeout):
+    # Issue an IDLE on the selected folder and block until the server
+    # reports EXISTS or RECENT, or until timeout seconds pass. Returns True
+    # if new mail was reported.
+    tag = imap_cxn._new_tag()
+
+    try:
+        return _idle(imap_cxn, tag, timeout)
+
+    except IdleError:
+        raise
+
+    except Exception:
+        # Out of step with the server; see above.
+        try:
+            imap_cxn.shutdown()
+        except Exception:
+            pass
+        raise
+
+    finally:
+        imap_cxn.tagged_commands.pop(tag, None)
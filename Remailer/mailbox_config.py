@@ -0,0 +1,213 @@
+'''
+Created on Oct 18, 2026
+
+The settings for one mailbox the remailer serves: which account it logs in
+as, the folders it files messages into, the address remailed messages come
+from, and where it keeps its spool, profiles and the like. The defaults are
+the ones the remailer has always run with.
+
+Several mailboxes can be listed in a JSON config file for the supervisor
+(see supervisor.py), which runs each one in a process of its own:
+
+    {
+        "defaults": { "imap_service": { "server_addr": "imap.gmail.com",
+                                        "port": 993 },
+                      "spool_path": "spool/{name}.sqlite",
+                      "profile_dir": "profiles/{name}",
+                      "profile_control_file": "{name}-profile",
+                      "slow_message_dir": "slow-messages/{name}",
+                      "log_file": "{name}.log",
+                      "metrics_port": null },
+        "mailboxes": [ { "name": "da",
+                         "global_from_addr": "da@delligattiassociates.com" },
+                       { "name": "spring-campaign",
+                         "imap_creds": "SpringCampaignCreds",
+                         "incoming_folder": "Spring",
+                         "global_from_addr": "spring@example.com" } ],
+        "supervisor": { "metrics_port": 9464 }
+    }
+
+Each mailbox's settings are the defaults with its own laid over them.
+"{name}" in a setting stands for the mailbox's name. imap_creds and
+smtp_creds name classes in the creds module, so no passwords go in the
+file.
+'''
+
+import json
+
+class MailboxConfig:
+    name = 'remailer'
+
+    # Names of the five folders used by the Remailer
+    # The inbox is where messages to us are delivered
+    incoming_folder = 'INBOX'
+
+    # Incoming (original) messages are filtered into one
+    # if these two folders.
+    original_folder = 'INBOX/remailer-original'
+    notag_folder = 'INBOX/remailer-original-notag'
+
+    exception_folder = 'INBOX/remailer-exception'
+    sent_folder = 'INBOX/remailer-sent'
+
+    global_from_addr = 'da@delligattiassociates.com'
+
+    # The servers we read mail from and send it through, and the classes
+    # in the creds module that log in to them. With smtp_creds None, we
+    # send without logging in.
+    imap_service = { "server_addr": "imap.gmail.com",
+                     "port": 993 }
+
+    smtp_service = { "server_addr": "smtp.domain.com",
+                     "port": 587,
+                     'local_hostname': 'delligattiassociates.com' }
+
+    imap_creds = 'RemailerBotCreds'
+    smtp_creds = 'SMTPCreds'
+
+    # The SMTP connection is kept open between cycles, until it has been
+    # idle for smtp_max_idle seconds or has sent smtp_max_messages
+    # messages.
+    smtp_max_idle = 240
+    smtp_max_messages = 100
+
+    # How many SMTP connections to send over in parallel (see
+    # smtp_pool.py), e.g. 4. With 0, the default, sends go one at a time
+    # over a single connection. async_remailer.py uses it for its own
+    # connections in the same way.
+    smtp_pool_size = 0
+
+    # Where to spool outgoing messages for delivery in the background
+    # (see spool.py), e.g. 'remailer-spool.sqlite'. Sends then happen
+    # after the inbox cycle, and any that were under way when we stopped
+    # are reported rather than sent again (see spool-admin.py). With None,
+    # the default, messages are sent during the inbox cycle.
+    spool_path = None
+
+    # Serve metrics at http://localhost:<metrics_port>/metrics, e.g. on
+    # 9464. With None, the default, they aren't served.
+    metrics_port = None
+
+    # Send the remailer SIGUSR1 (CPU) or SIGUSR2 (memory), or create
+    # profile_control_file, to profile the next few cycles (see
+    # profiling.py). The profiles are saved in profile_dir.
+    profile_dir = 'remailer-profiles'
+    profile_control_file = 'remailer-profile'
+
+    # Where messages that take longer than Remailer.slow_message_seconds to
+    # transform are saved, for replay-slow-messages.py. They're saved in
+    # full, attachments and all, so this is off (None) unless asked for,
+    # e.g. with 'remailer-slow-messages'.
+    slow_message_dir = None
+
+    log_file = 'remailer.log'
+
+    # Workers sharing one incoming folder, on this machine or others, each
+    # need a worker_id of their own (letters, digits, '.', '_' and '-');
+    # they then only handle the messages they've claimed (see
+    # Remailer.claimMessageUIDs). With None, we take everything in the
+    # folder.
+    worker_id = None
+
+    @classmethod
+    def settingNames(cls):
+        return [ key for key, value in vars(MailboxConfig).items()
+                 if not key.startswith('_') and isinstance(value, (str, int, dict, type(None))) ]
+
+    def __init__(self, **settings):
+        names = self.settingNames()
+
+        for key, value in settings.items():
+            if key not in names:
+                raise ValueError("Unknown mailbox setting %r" % key)
+            setattr(self, key, value)
+
+        for key in names:
+            value = getattr(self, key)
+            if isinstance(value, str):
+                setattr(self, key, value.replace('{name}', self.name))
+
+    def folders(self):
+        return [ self.incoming_folder, self.sent_folder, self.exception_folder,
+                 self.original_folder, self.notag_folder ]
+
+    def imapCreds(self):
+        import creds
+        return getattr(creds, self.imap_creds)()
+
+    def smtpCreds(self):
+        if self.smtp_creds is None:
+            return None
+
+        import creds
+        return getattr(creds, self.smtp_creds)()
+
+    def __repr__(self):
+        return 'MailboxConfig(%r)' % self.name
+
+def checkMailboxes(mailboxes, supervisor_metrics_port = None):
+    # Mailboxes that run side by side mustn't share a name, an inbox
+    # (unless as workers with different worker_ids), or any of the files
+    # and ports they keep to themselves, nor a metrics port with the
+    # supervisor. Raises ValueError if any do.
+    for mailbox in mailboxes:
+        if mailbox.metrics_port is not None and mailbox.metrics_port == supervisor_metrics_port:
+            raise ValueError("Mailbox %s has the supervisor's metrics_port (%s)"
+                             % (mailbox.name, mailbox.metrics_port))
+
+    for key in ('name', 'spool_path', 'metrics_port', 'profile_dir', 'profile_control_file',
+                'slow_message_dir'):
+        seen = {}
+        for mailbox in mailboxes:
+            value = getattr(mailbox, key)
+            if value is None:
+                continue
+            if value in seen:
+                raise ValueError("Mailboxes %s and %s have the same %s (%s)"
+                                 % (seen[value], mailbox.name, key, value))
+            seen[value] = mailbox.name
+
+    readers = {}
+    for mailbox in mailboxes:
+        inbox = (mailbox.imap_service['server_addr'], mailbox.imap_service['port'],
+                 mailbox.imap_creds, mailbox.incoming_folder)
+        for other in readers.setdefault(inbox, []):
+            if mailbox.worker_id is None or other.worker_id in (None, mailbox.worker_id):
+                raise ValueError("Mailboxes %s and %s read the same folder (%s)"
+                                 % (other.name, mailbox.name, mailbox.incoming_folder))
+        readers[inbox].append(mailbox)
+
+def loadConfig(path):
+    # Load a config file as above. Returns (list of MailboxConfig,
+    # supervisor settings dict).
+    with open(path) as f:
+        config = json.load(f)
+
+    defaults = config.get('defaults', {})
+    mailboxes = []
+
+    for entry in config['mailboxes']:
+        settings = dict(defaults)
+        settings.update(entry)
+        mailboxes.append(MailboxConfig(**settings))
+
+    supervisor_settings = config.get('supervisor', {})
+    checkMailboxes(mailboxes, supervisor_settings.get('metrics_port'))
+
+    return mailboxes, supervisor_settings
+
+if __name__ == '__main__':
+    # Test code
+    import sys
+
+    if len(sys.argv) > 1:
+        mailboxes, supervisor_settings = loadConfig(sys.argv[1])
+    else:
+        mailboxes, supervisor_settings = [ MailboxConfig() ], {}
+
+    for mailbox in mailboxes:
+        print(mailbox)
+        for key in MailboxConfig.settingNames():
+            print('    %-22s %r' % (key, getattr(mailbox, key)))
+
+    print('supervisor', supervisor_settings)
@@ -4,25 +4,164 @@ Created on Feb 4, 2021
 @author: jct
 '''
 
+import os
 import re
 
 from quopri import decodestring
 from email.parser import BytesParser
 from email.policy import default
 
-from rfc5322 import email_prog
+from email_address import remailAddress
+from email_address import addAddresses
 from centraltime import centraltime_str
 from tagscan import scan_for_tags
 
-def messageBytesAsObject(message_bytes):
+# Non-text parts with bodies at least this big are set aside by
+# messageBytesAsObject(..., raw_attachments = True).
+raw_attachment_threshold = 2048
+
+def _attachmentSpans(message_bytes, start, end, in_multipart, spans):
+    # Find the bodies of the attachments in the entity (headers and body)
+    # at message_bytes[start:end], going by the MIME boundaries, and add
+    # their (start, end) to spans. Only large non-text parts of a
+    # multipart are included. Anything that doesn't look right is left
+    # for the parser to make sense of.
+    if message_bytes.startswith(b'\r\n', start):
+        # No headers at all, so plain text.
+        return
+    
+    header_end = message_bytes.find(b'\r\n\r\n', start, end)
+    if header_end == -1:
+        return
+    body_start = header_end + 4
+    
+    headers = BytesParser(policy = default).parsebytes(message_bytes[start:body_start],
+                                                       headersonly = True)
+    main_type = headers.get_content_maintype()
+    
+    if main_type != 'multipart':
+        if in_multipart and main_type not in ('text', 'message') and \
+                end - body_start >= raw_attachment_threshold:
+            spans.append((body_start, end))
+        return
+    
+    boundary = headers.get_boundary()
+    if not boundary:
+        return
+    try:
+        delimiter = b'\r\n--' + boundary.encode('ascii')
+    except UnicodeEncodeError:
+        return
+    
+    # The CRLF before each delimiter is part of it, so start looking just
+    # before the body in case it begins with one.
+    child_spans = []
+    part_start = None
+    pos = body_start - 2
+    
+    while True:
+        pos = message_bytes.find(delimiter, pos, end)
+        if pos == -1:
+            # No closing delimiter; leave this one alone.
+            return
+        
+        after = pos + len(delimiter)
+        line_end = message_bytes.find(b'\r\n', after, end)
+        rest = message_bytes[after:line_end if line_end != -1 else end]
+        
+        # Something like --boundary-2 isn't this boundary.
+        closing = rest.startswith(b'--')
+        if rest[2 if closing else 0:].strip(b' \t') != b'':
+            pos = after
+            continue
+        
+        if part_start is not None:
+            _attachmentSpans(message_bytes, part_start, pos, True, child_spans)
+            
+        if closing:
+            spans.extend(child_spans)
+            return
+        
+        if line_end == -1:
+            return
+        part_start = line_end + 2
+        pos = line_end
+    
+def messageBytesAsObject(message_bytes, raw_attachments = False):
     # Parse the message string into a message object for easier
     # handling. 
-    message_obj = BytesParser(policy = default).parsebytes(message_bytes)
+    #
+    # With raw_attachments, the bodies of any large attachments are left
+    # out of the parse, which would otherwise go through them line by
+    # line, with a placeholder in their place, and kept as they are (in
+    # raw_bodies on the message object) to be put back by
+    # messageObjectAsBytes. They mustn't be looked at in between.
+    spans = []
+    
+    # The boundaries are looked for with CRLF line endings, as IMAP
+    # servers give us, so anything else is parsed as usual.
+    if raw_attachments and message_bytes.count(b'\n') == message_bytes.count(b'\r\n'):
+        _attachmentSpans(message_bytes, 0, len(message_bytes), False, spans)
+    
+    if not spans:
+        return BytesParser(policy = default).parsebytes(message_bytes)
+    
+    nonce = os.urandom(8).hex()
+    message_view = memoryview(message_bytes)
+    raw_bodies = {}
+    segments = []
+    pos = 0
+    
+    for number, (start, end) in enumerate(spans):
+        placeholder = ('remailer-raw-body-%s-%d' % (nonce, number)).encode('ascii')
+        raw_bodies[placeholder] = message_view[start:end]
+        segments.append(message_view[pos:start])
+        segments.append(placeholder)
+        pos = end
+    segments.append(message_view[pos:])
+    
+    message_obj = BytesParser(policy = default).parsebytes(b''.join(segments))
+    message_obj.raw_bodies = raw_bodies
  
     return message_obj
 
-def showMessageSubject(message_bytes):
-    message_obj = messageBytesAsObject(message_bytes)
+def messageObjectAsBytes(message_obj, policy):
+    # Generate the message, putting back any attachment bodies that
+    # messageBytesAsObject set aside.
+    message_bytes = message_obj.as_bytes(policy = policy)
+    
+    raw_bodies = getattr(message_obj, 'raw_bodies', None)
+    if not raw_bodies:
+        return message_bytes
+    
+    segments = []
+    pos = 0
+    
+    # The placeholders come out in the order they went in, less any
+    # whose parts have been deleted.
+    for placeholder, raw_body in raw_bodies.items():
+        index = message_bytes.find(placeholder, pos)
+        if index == -1:
+            continue
+        segments.append(message_bytes[pos:index])
+        segments.append(raw_body)
+        pos = index + len(placeholder)
+    segments.append(message_bytes[pos:])
+    
+    return b''.join(segments)
+
+def messageBytesAsHeaders(message_bytes):
+    # Parse just the headers of the message, leaving the body as an
+    # unparsed payload. Much cheaper than a full parse for big messages,
+    # for when all we need is a header or two.
+    message_obj = BytesParser(policy = default).parsebytes(message_bytes,
+                                                           headersonly = True)
+    
+    return message_obj
+
+def showMessageSubject(message_obj):
+    # Takes an already-parsed message object (a headers-only one will do),
+    # so the message doesn't get parsed again just for this.
     print("Subject:", message_obj["Subject"])
 
 def maybeQuotedPrintableToBytestring(bytes_):
@@ -61,18 +200,34 @@ def scanPartForRemailTags(message_str):
         if tag == 'remail-to':
             
             # Test the value of the tag to see if it looks like an email
-            # address.
-            match = email_prog.match(value)
+            # address, and normalise it if so.
+            address = remailAddress(value)
             
-            if match is not None:
+            if address is not None:
                 
                 # We have a remail-to tag with a valid email address. Now
-                # we simply append the email address to the list of
-                # remail addresses.
-                remail_addresses_set.add(match.group(0))
+                # we simply add the email address to the set of remail
+                # addresses, unless it's there already in another case.
+                addAddresses(remail_addresses_set, (address,))
                 
     return message_str, remail_addresses_set
 
+def leafParts(message_obj):
+    # Yields (container, part) for each part of the message that isn't
+    # itself a container, where container is the multipart (or attached
+    # message) holding it, or None for a single-part message. Unlike
+    # walk(), a part can be removed from its container's payload as we go
+    # without any being skipped.
+    if not message_obj.is_multipart():
+        yield None, message_obj
+        return
+    
+    for part in list(message_obj.get_payload()):
+        if part.is_multipart():
+            yield from leafParts(part)
+        else:
+            yield message_obj, part
+
 def dumpHeaders(message_obj):
     print("  -------------------------------------------------------------")
     headers = message_obj.items()
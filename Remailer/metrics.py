@@ -0,0 +1,324 @@
+'''
+Created on Oct 18, 2026
+
+Counters, gauges and latency histograms for the remailer, served over HTTP
+at /metrics in the Prometheus text format, so we can see which stage is
+the bottleneck under load without digging through remailer.log.
+
+Each metric may have labels; their values are passed positionally, in the
+order the labels were declared, e.g.
+
+    stage_seconds.observe(0.25, 'fetch')
+
+    with stage_seconds.time('append'):
+        ...
+
+    messages_total.inc('remailed')
+'''
+
+import math
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from timer import Timer
+
+def _labelString(label_names, label_values, extra = ()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs) + '}'
+
+def _valueString(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return '%d' % value
+    return repr(float(value))
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, help_, labels = ()):
+        self.name = name
+        self.help = help_
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.label_names):
+            raise ValueError("%s needs labels %s" % (self.name, self.label_names))
+        return tuple(str(value) for value in label_values)
+
+    def samples(self):
+        # Returns [(suffix, label_values, extra_labels, value), ...].
+        raise NotImplementedError
+
+    def exposition(self):
+        lines = [ '# HELP %s %s' % (self.name, self.help),
+                  '# TYPE %s %s' % (self.name, self.type_name) ]
+
+        for suffix, label_values, extra, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix,
+                                        _labelString(self.label_names, label_values, extra),
+                                        _valueString(value)))
+        return lines
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, name, help_, labels = ()):
+        super().__init__(name, help_, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount = 1):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(self._key(label_values), 0)
+
+    def values(self):
+        # Returns {label values: value} for every set of labels counted.
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+
+        # An unlabelled counter is there from the start, at zero.
+        if not self.label_names and not values:
+            values[()] = 0
+
+        return [('', key, (), value) for key, value in sorted(values.items())]
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def __init__(self, name, help_, labels = ()):
+        super().__init__(name, help_, labels)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, *label_values):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = value
+
+    def setFunction(self, function, *label_values):
+        # Have the value read from function() whenever it's asked for,
+        # e.g. the length of a queue.
+        key = self._key(label_values)
+        with self._lock:
+            self._functions[key] = function
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                # Whatever it measures may have gone away.
+                values.pop(key, None)
+
+        return [('', key, (), value) for key, value in sorted(values.items())]
+
+# Seconds, from a millisecond to a minute.
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+
+class _Timing:
+    # What Histogram.time returns: times the with block and records it.
+    def __init__(self, histogram, label_values):
+        self._histogram = histogram
+        self._label_values = label_values
+
+    def __enter__(self):
+        self._timer = Timer()
+        return self._timer
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._histogram.observe(self._timer.elapsedTime(), *self._label_values)
+        return False
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_, labels = (), buckets = default_buckets):
+        super().__init__(name, help_, labels)
+        self._buckets = tuple(sorted(buckets)) + (math.inf,)
+
+        # label values -> [bucket counts, sum, count]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        key = self._key(label_values)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [ [0] * len(self._buckets), 0.0, 0 ]
+
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, *label_values):
+        # For timing a with block.
+        self._key(label_values)
+        return _Timing(self, label_values)
+
+    def samples(self):
+        samples = []
+
+        with self._lock:
+            for key, (counts, sum_, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self._buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(('_bucket', key, (('le', _valueString(bound)),), cumulative))
+                samples.append(('_sum', key, (), sum_))
+                samples.append(('_count', key, (), count))
+
+        return samples
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_, labels = ()):
+        return self._register(Counter(name, help_, labels))
+
+    def gauge(self, name, help_, labels = ()):
+        return self._register(Gauge(name, help_, labels))
+
+    def histogram(self, name, help_, labels = (), buckets = default_buckets):
+        return self._register(Histogram(name, help_, labels, buckets))
+
+    def exposition(self):
+        # All the metrics in the Prometheus text format.
+        with self._lock:
+            metrics = list(self._metrics)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.exposition())
+        return '\n'.join(lines) + '\n'
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes aren't worth logging.
+        pass
+
+def startMetricsServer(port, host = '127.0.0.1', metrics_registry = None):
+    # Serve metrics_registry (the remailer's, by default) at
+    # http://host:port/metrics from a background thread. Returns the
+    # server; call its shutdown() to stop it.
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = metrics_registry if metrics_registry is not None else registry
+
+    thread = threading.Thread(target = server.serve_forever, name = 'metrics',
+                              daemon = True)
+    thread.start()
+    return server
+
+# The remailer's metrics.
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    'remailer_stage_seconds',
+    'Time spent in each stage of handling messages',
+    labels = ('stage',))
+
+messages_total = registry.counter(
+    'remailer_messages_total',
+    'Messages taken from the inbox, by what became of them',
+    labels = ('outcome',))
+
+recipients_total = registry.counter(
+    'remailer_recipients_total',
+    'Recipients of remailed messages, by whether the SMTP server took them',
+    labels = ('outcome',))
+
+errors_total = registry.counter(
+    'remailer_errors_total',
+    'Errors, by where they happened',
+    labels = ('stage',))
+
+imap_reconnects_total = registry.counter(
+    'remailer_imap_reconnects_total',
+    'Times the IMAP connection has been re-established')
+
+smtp_sessions_total = registry.counter(
+    'remailer_smtp_sessions_total',
+    'SMTP connections, by what happened to them: opened, reused after being idle, '
+    'found stale, dropped by the server, or retired',
+    labels = ('event',))
+
+claims_total = registry.counter(
+    'remailer_claims_total',
+    'Messages in a shared incoming folder, by what came of claiming them',
+    labels = ('outcome',))
+
+inbox_messages = registry.gauge(
+    'remailer_inbox_messages',
+    'Messages in the incoming folder when it was last checked')
+
+queue_length = registry.gauge(
+    'remailer_queue_length',
+    'Messages waiting in each queue',
+    labels = ('queue',))
+
+if __name__ == '__main__':
+    # Test code. Records some made-up timings and reads them back over
+    # HTTP.
+    import random
+    from urllib.request import urlopen
+
+    for i in range(100):
+        stage_seconds.observe(random.expovariate(10), 'fetch')
+        with stage_seconds.time('parse'):
+            sum(range(10000))
+
+    messages_total.inc('remailed', amount = 3)
+    messages_total.inc('notag')
+    inbox_messages.set(12)
+    queue_length.setFunction(lambda: 7, 'smtp_pool')
+
+    server = startMetricsServer(0)
+    port = server.server_address[1]
+
+    print(urlopen('http://127.0.0.1:%d/metrics' % port).read().decode('utf-8'))
+
+    server.shutdown()
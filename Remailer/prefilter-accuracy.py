@@ -0,0 +1,173 @@
+'''
+Created on Oct 18, 2026
+
+Checks the raw-byte prefilter (prefilter.py) against the real thing -
+parsing each message and running performSubstitutionOnMessageParts over
+it - on the benchmark corpus plus a set of awkward messages: tags hidden
+by quoted-printable (=24{, soft line breaks in the middle of a tag) and
+base64, text in UTF-16 and UTF-7, tags in attachments, headers and HTML,
+things that look like tags but aren't. The prefilter must never say "no
+tags" of a message that has them; how often it says "maybe" of one that
+hasn't is the price of being quick.
+
+    python prefilter-accuracy.py --messages 2000
+
+Exits with status 1 if there are any false negatives.
+'''
+
+import io
+import sys
+import random
+import argparse
+from contextlib import redirect_stdout
+from email.message import EmailMessage
+
+from remailer import Remailer
+from message import messageBytesAsObject
+from prefilter import mayHaveRemailTags
+from corpus import makeCorpus
+from corpus import corpus_policy
+from corpus import words
+from timer import Timer
+
+charsets = ('us-ascii', 'utf-8', 'iso-8859-1', 'utf-16', 'utf-7', 'shift_jis')
+encodings = ('7bit', '8bit', 'quoted-printable', 'base64')
+
+# Things that look a bit like tags but that scanPartForRemailTags doesn't
+# take as remail-to tags with an address.
+decoys = ('${other-tag:value}', '$ {remail-to:a@example.com}', 'remail-to:a@example.com',
+          '${Remail-To:a@example.com}', '${remail-to:not an address}', '${remail-to',
+          '=24{', '${', '$', '{remail-to:a@example.com}')
+
+def longLine(rng, length):
+    # One long line, so quoted-printable has to break it, wherever it
+    # likes, tags included.
+    return ' '.join(rng.choice(words) for _ in range(length // 6))
+
+def awkwardMessage(rng, number):
+    # Returns (message bytes, description).
+    tagged = rng.random() < 0.5
+    charset = rng.choice(charsets)
+    encoding = rng.choice(encodings)
+    where = rng.choice(('text', 'text', 'html', 'attachment', 'text-attachment',
+                        'header', 'after-end', 'inner-message'))
+
+    tag = '${remail-to:person%d@example.com}' % number
+    text = longLine(rng, rng.randint(50, 400)) + ' ' + rng.choice(decoys) + ' ' + \
+           longLine(rng, rng.randint(50, 400)) + '\n'
+
+    message = EmailMessage()
+    message['From'] = 'sender@example.org'
+    message['To'] = 'remailer@example.com'
+    message['Subject'] = 'Awkward message %d' % number
+
+    if tagged and where == 'header':
+        message['X-Note'] = tag
+
+    body = text
+    if tagged and where in ('text', 'html'):
+        split = rng.randrange(len(text))
+        body = text[:split] + tag + text[split:]
+    elif tagged and where == 'after-end':
+        body = text + '${message-ends}' + tag
+
+    # UTF-7 and UTF-16 can't go 7bit or 8bit.
+    text_encoding = encoding
+    if charset in ('utf-16', 'utf-7') and encoding in ('7bit', '8bit'):
+        text_encoding = 'base64'
+    if charset == 'us-ascii' and encoding == '8bit':
+        text_encoding = '7bit'
+
+    message.set_content(text if where == 'html' else body,
+                        charset = charset, cte = text_encoding)
+
+    if where == 'html':
+        message.add_alternative('<p>%s</p>' % body, subtype = 'html',
+                                charset = charset, cte = text_encoding)
+
+    if where == 'attachment':
+        message.add_attachment((tag if tagged else 'nothing').encode() + rng.randbytes(3000),
+                               maintype = 'application', subtype = 'octet-stream',
+                               filename = 'data.bin')
+
+    if where == 'text-attachment':
+        message.add_attachment((tag if tagged else text) + '\n', subtype = 'plain',
+                               charset = charset, cte = text_encoding,
+                               filename = 'notes.txt')
+
+    if where == 'inner-message':
+        inner = EmailMessage()
+        inner['Subject'] = 'Forwarded'
+        inner.set_content((body if tagged else text), charset = charset, cte = text_encoding)
+        message.add_attachment(inner)
+
+    description = '%s tag in %s, %s, %s' % ('with' if tagged else 'no', where, charset,
+                                            text_encoding)
+
+    return message.as_bytes(policy = corpus_policy), description
+
+def hasRemailTags(remailer, message_bytes):
+    # What the remailer itself makes of the message.
+    message_obj = messageBytesAsObject(message_bytes, raw_attachments = True)
+    with redirect_stdout(io.StringIO()):
+        return len(remailer.performSubstitutionOnMessageParts(message_obj)) > 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Check the prefilter against a full scan.')
+    parser.add_argument('--messages', type = int, default = 1000,
+                        help = 'how many awkward messages to make')
+    parser.add_argument('--corpus', type = int, default = 500,
+                        help = 'how many benchmark corpus messages to add')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = [ awkwardMessage(rng, number) for number in range(args.messages) ]
+    messages.extend((message.message_bytes, message.description)
+                    for message in makeCorpus(args.corpus, seed = args.seed))
+
+    remailer = Remailer(None, None)
+
+    tagged = 0
+    errors = 0
+    false_negatives = []
+    false_positives = 0
+    prefilter_time = 0
+    scan_time = 0
+
+    for message_bytes, description in messages:
+        timer = Timer()
+        maybe = mayHaveRemailTags(message_bytes)
+        prefilter_time += timer.elapsedTime()
+
+        timer = Timer()
+        try:
+            has_tags = hasRemailTags(remailer, message_bytes)
+        except Exception:
+            # The remailer would leave it where it is, so the prefilter
+            # mustn't have sent it on its way either.
+            errors += 1
+            has_tags = True
+        scan_time += timer.elapsedTime()
+
+        if has_tags:
+            tagged += 1
+            if not maybe:
+                false_negatives.append(description)
+        elif maybe:
+            false_positives += 1
+
+    untagged = len(messages) - tagged
+
+    print("Messages:          %d (%d with tags, %d failing to parse)"
+          % (len(messages), tagged, errors))
+    print("False negatives:   %d" % len(false_negatives))
+    print("False positives:   %d of %d without tags (%.1f%%)"
+          % (false_positives, untagged, 100.0 * false_positives / untagged if untagged else 0))
+    print("Prefilter:         %.3f ms per message" % (1000 * prefilter_time / len(messages)))
+    print("Parse and scan:    %.3f ms per message" % (1000 * scan_time / len(messages)))
+
+    for description in false_negatives:
+        print("*** Missed: %s" % description)
+
+    sys.exit(1 if false_negatives else 0)
@@ -0,0 +1,175 @@
+'''
+Created on Oct 18, 2026
+
+A quick look at a message's raw bytes, before any MIME parsing, to see
+whether it could possibly hold a remail-to tag. Most mail doesn't, and
+saying so from the bytes is far cheaper than parsing the message and
+decoding every part to scan it.
+
+The answer is only ever "definitely not" (False) or "maybe" (True): a
+message that scanPartForRemailTags would find a tag in must never get
+False. So where a tag could be hidden, we look through what hides it:
+
+    - quoted-printable, including =24{ for ${ and soft line breaks in the
+      middle of a tag, by decoding everything as quoted-printable;
+    - base64-encoded text parts, by decoding them;
+    - charsets that don't write ${remail-to: as its ASCII bytes (UTF-16,
+      UTF-7 and so on) and transfer encodings we don't know, by giving up
+      and answering "maybe".
+
+Anything else odd - a tag in a header, in an HTML part that will be
+thrown away, or after a ${message-ends} - just means a "maybe" that turns
+out to be a "no" once the message is parsed.
+'''
+
+import re
+import codecs
+import binascii
+
+# What a remail-to tag starts with once decoded. The tag name is matched
+# exactly (see scanPartForRemailTags), so this is case-sensitive.
+tag_start = '${remail-to:'
+tag_start_bytes = tag_start.encode('ascii')
+
+# Transfer encodings that leave the tag as is, or that we know how to
+# see through.
+plain_encodings = { b'7bit', b'8bit', b'binary' }
+known_encodings = plain_encodings | { b'quoted-printable', b'base64' }
+
+# These run over the message lowercased.
+encoding_prog = re.compile(rb'content-transfer-encoding:[ \t]*(?:\r?\n[ \t]+)?([^\s;(]*)')
+charset_prog = re.compile(rb'charset\*?[ \t]*=[ \t]*"?([a-z0-9_.:+-]*)')
+content_type_prog = re.compile(rb'content-type:\s*([a-z0-9_.+-]*)')
+
+_charset_ok = {}
+
+def charsetKeepsTagBytes(charset):
+    # Whether text in charset holds a tag as the same bytes as ASCII
+    # does. A charset Python doesn't know is decoded as UTF-8, as
+    # get_content does, so that's fine too.
+    if charset not in _charset_ok:
+        try:
+            codec = codecs.lookup(charset)
+            _charset_ok[charset] = tag_start.encode(codec.name) == tag_start_bytes and \
+                                   '}'.encode(codec.name) == b'}'
+        except LookupError:
+            _charset_ok[charset] = True
+        except Exception:
+            _charset_ok[charset] = False
+    return _charset_ok[charset]
+
+def _headerBlockStart(lowered, pos):
+    # Where the header block holding pos starts: just after the boundary
+    # line before it, or the start of the message.
+    boundary_line = lowered.rfind(b'\n--', 0, pos)
+    return 0 if boundary_line == -1 else boundary_line + 1
+
+def _headerBlockEnd(lowered, pos):
+    # Where the body after the header block holding pos starts, or -1.
+    ends = [ index + length for index, length in ((lowered.find(b'\n\r\n', pos), 3),
+                                                  (lowered.find(b'\n\n', pos), 2))
+             if index != -1 ]
+    return min(ends) if ends else -1
+
+def _base64TextMayHaveTags(message_bytes, lowered, encoding_pos):
+    # Decode the base64 body of the part whose Content-Transfer-Encoding
+    # header is at encoding_pos, if it's text, and look for a tag in it.
+    body_start = _headerBlockEnd(lowered, encoding_pos)
+    if body_start == -1:
+        return False
+
+    # No Content-Type means text/plain.
+    content_type = content_type_prog.search(lowered, _headerBlockStart(lowered, encoding_pos),
+                                            body_start)
+    if content_type is not None and content_type.group(1) != b'text':
+        return False
+
+    # A base64 body runs until the next boundary; base64 has no '-', so
+    # a line starting with -- can only be one.
+    body_end = lowered.find(b'\n--', body_start)
+    if body_end == -1:
+        body_end = len(lowered)
+
+    try:
+        text_bytes = binascii.a2b_base64(message_bytes[body_start:body_end])
+    except binascii.Error:
+        # get_content would still make what it could of it.
+        return True
+
+    return tag_start_bytes in text_bytes
+
+def mayHaveRemailTags(message_bytes):
+    # False if message_bytes (a whole message) certainly has no remail-to
+    # tags in it, True if it may have.
+    if tag_start_bytes in message_bytes:
+        return True
+
+    lowered = message_bytes.lower()
+
+    for match in charset_prog.finditer(lowered):
+        if not charsetKeepsTagBytes(match.group(1).decode('ascii')):
+            return True
+
+    has_qp = False
+    base64_positions = []
+
+    for match in encoding_prog.finditer(lowered):
+        encoding = match.group(1)
+        if encoding not in known_encodings:
+            return True
+        if encoding == b'quoted-printable':
+            has_qp = True
+        elif encoding == b'base64':
+            base64_positions.append(match.start())
+
+    # Decoding the lot as quoted-printable does no harm to the parts that
+    # aren't, as far as finding tags goes.
+    if has_qp and tag_start_bytes in binascii.a2b_qp(message_bytes):
+        return True
+
+    for encoding_pos in base64_positions:
+        if _base64TextMayHaveTags(message_bytes, lowered, encoding_pos):
+            return True
+
+    return False
+
+def sectionMayHaveRemailTags(section_bytes, charset, encoding):
+    # The same for a single text part, fetched on its own, given its
+    # charset and transfer encoding as reported by BODYSTRUCTURE.
+    if section_bytes is None:
+        return False
+    if charset and not charsetKeepsTagBytes(charset):
+        return True
+
+    encoding = (encoding or '7bit').lower().encode('ascii', 'replace')
+
+    if encoding in plain_encodings:
+        return tag_start_bytes in section_bytes
+    if encoding == b'quoted-printable':
+        return tag_start_bytes in binascii.a2b_qp(section_bytes)
+    if encoding == b'base64':
+        try:
+            return tag_start_bytes in binascii.a2b_base64(section_bytes)
+        except binascii.Error:
+            return True
+
+    return True
+
+if __name__ == '__main__':
+    # Test code
+    test_messages = [
+        b'Subject: plain\r\n\r\nNo tags here, just ${other:tags}.\r\n',
+        b'Subject: plain\r\n\r\nHello ${remail-to:a@example.com}\r\n',
+        b'Subject: qp\r\nContent-Transfer-Encoding: quoted-printable\r\n\r\n'
+        b'Hello =24{remail-to:a@example.com}\r\n',
+        b'Subject: soft break\r\nContent-Transfer-Encoding: quoted-printable\r\n\r\n'
+        b'Hello ${remail-=\r\nto:a@example.com}\r\n',
+        b'Subject: base64\r\nContent-Type: text/plain\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+        b'SGVsbG8gJHtyZW1haWwtdG86YUBleGFtcGxlLmNvbX0K\r\n',
+        b'Subject: utf-16\r\nContent-Type: text/plain; charset=utf-16\r\n\r\n\xff\xfe$\x00{\x00',
+        b'Subject: uuencode\r\nContent-Transfer-Encoding: x-uuencode\r\n\r\nbegin 644 x\r\n',
+        ]
+
+    for message_bytes in test_messages:
+        subject = message_bytes.split(b'\r\n')[0].decode()
+        print('%-25s %s' % (subject, mayHaveRemailTags(message_bytes)))
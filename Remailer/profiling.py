@@ -0,0 +1,274 @@
+'''
+Created on Oct 18, 2026
+
+On-demand profiling for a running remailer, so that a slow inbox cycle can
+be looked into without restarting anything.
+
+Send the remailer SIGUSR1 and the next few cycles run under cProfile;
+SIGUSR2 does the same with tracemalloc. Sending the same signal again
+while that's going on turns it off. Alternatively, create the control file
+with the words cpu and/or memory in it, and optionally cycles=N:
+
+    echo "cpu memory cycles=5" > remailer-profile
+
+It's removed once it's been read. Each profiled cycle leaves a .pstats
+file and/or a .tracemalloc snapshot in the output directory, for looking
+at with pstats or tracemalloc.Snapshot.load, and prints a short summary.
+
+Separately, captureSlowMessage saves the raw bytes of a message that took
+too long to transform, along with how long each stage took, so that it can
+be replayed offline with replay-slow-messages.py.
+'''
+
+import io
+import os
+import sys
+import json
+import time
+import signal
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+class CycleProfiler:
+    # How many cycles a signal profiles, and how many frames of each
+    # allocation tracemalloc records.
+    default_cycles = 3
+    traceback_frames = 10
+
+    # How many lines of each summary to print.
+    summary_lines = 15
+
+    def __init__(self, output_dir, control_file = None):
+        self.output_dir = output_dir
+        self.control_file = control_file
+
+        # Cycles still to be profiled each way.
+        self._cpu_cycles = 0
+        self._memory_cycles = 0
+
+        self._cycle_number = 0
+
+        self._profile = None
+        self._thread_profiles = []
+        self._thread_profiles_lock = threading.Lock()
+
+    def installSignalHandlers(self):
+        # Signals are only delivered to the main thread, so call this from
+        # there. Not every platform has SIGUSR1 and SIGUSR2.
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self._toggleCPU)
+        if hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2, self._toggleMemory)
+
+    def _toggleCPU(self, signum, frame):
+        self._cpu_cycles = 0 if self._cpu_cycles else self.default_cycles
+
+    def _toggleMemory(self, signum, frame):
+        self._memory_cycles = 0 if self._memory_cycles else self.default_cycles
+
+    def request(self, cycles = None, cpu = False, memory = False):
+        # Profile the next cycles cycles (default_cycles if None).
+        if cycles is None:
+            cycles = self.default_cycles
+        if cpu:
+            self._cpu_cycles = cycles
+        if memory:
+            self._memory_cycles = cycles
+
+    def _readControlFile(self):
+        if self.control_file is None or not os.path.exists(self.control_file):
+            return
+
+        try:
+            with open(self.control_file) as f:
+                words = f.read().split()
+            os.remove(self.control_file)
+
+        except OSError as e:
+            print("*** Error reading %s: %s" % (self.control_file, e))
+            return
+
+        cycles = None
+        for word in words:
+            if word.startswith('cycles='):
+                try:
+                    cycles = int(word[len('cycles='):])
+                except ValueError:
+                    print("*** Bad cycle count in %s: %s" % (self.control_file, word))
+
+        # An empty file means CPU profiling.
+        self.request(cycles, cpu = 'cpu' in words or not words,
+                     memory = 'memory' in words)
+
+    def active(self):
+        return self._cpu_cycles > 0 or self._memory_cycles > 0
+
+    def _startThreadProfile(self, frame, event, arg):
+        # Set with threading.setprofile, so that it's the first thing each
+        # new thread (the pipeline's, say) runs; it replaces itself with a
+        # profiler of that thread's own. Threads that were already running,
+        # like the delivery pool's, aren't profiled.
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # From Python 3.12 one profiler sees every thread, and there
+            # can't be a second.
+            sys.setprofile(None)
+            return
+
+        with self._thread_profiles_lock:
+            self._thread_profiles.append(profile)
+
+    def _startCPUProfile(self):
+        self._thread_profiles = []
+        threading.setprofile(self._startThreadProfile)
+
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def _finishCPUProfile(self, path):
+        self._profile.disable()
+        threading.setprofile(None)
+
+        summary = io.StringIO()
+        stats = pstats.Stats(self._profile, stream = summary)
+        with self._thread_profiles_lock:
+            for profile in self._thread_profiles:
+                stats.add(profile)
+            self._thread_profiles = []
+        self._profile = None
+
+        stats.dump_stats(path)
+
+        print("Profiling: CPU profile saved to %s" % path)
+        stats.sort_stats('cumulative').print_stats(self.summary_lines)
+        print(summary.getvalue())
+
+    def _startMemoryProfile(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start(self.traceback_frames)
+
+    def _finishMemoryProfile(self, path):
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        snapshot.dump(path)
+
+        # Keep tracing if there are more cycles to come, as it slows
+        # everything down.
+        if self._memory_cycles == 0:
+            tracemalloc.stop()
+
+        print("Profiling: memory snapshot saved to %s (%.1f MB allocated, %.1f MB peak)"
+              % (path, current / 1e6, peak / 1e6))
+        for stat in snapshot.statistics('lineno')[:self.summary_lines]:
+            print("  %s" % stat)
+
+    @contextmanager
+    def cycle(self):
+        # Wrap an inbox cycle in this; it's profiled if that's been asked
+        # for.
+        self._readControlFile()
+
+        cpu = self._cpu_cycles > 0
+        memory = self._memory_cycles > 0
+
+        if not (cpu or memory):
+            yield
+            return
+
+        self._cycle_number += 1
+        os.makedirs(self.output_dir, exist_ok = True)
+        stem = os.path.join(self.output_dir, 'cycle-%s-%d' % (time.strftime('%Y%m%d-%H%M%S'),
+                                                              self._cycle_number))
+
+        if memory:
+            self._startMemoryProfile()
+        if cpu:
+            self._startCPUProfile()
+
+        try:
+            yield
+
+        finally:
+            # A signal may have turned profiling off in the meantime.
+            if cpu:
+                self._cpu_cycles = max(self._cpu_cycles - 1, 0)
+                self._finishCPUProfile(stem + '.pstats')
+            if memory:
+                self._memory_cycles = max(self._memory_cycles - 1, 0)
+                self._finishMemoryProfile(stem + '.tracemalloc')
+
+# Stop saving slow messages once the directory holds this many, so that a
+# run of them can't fill the disk.
+max_slow_messages = 200
+
+def captureSlowMessage(directory, message_id, message_bytes, timings):
+    # Save message_bytes as <directory>/<time>-<message_id>.eml, and
+    # timings, a dict of stage name -> seconds, next to it as .json.
+    # Returns the path of the .eml file, or None if it wasn't saved.
+    os.makedirs(directory, exist_ok = True)
+
+    if sum(1 for name in os.listdir(directory) if name.endswith('.eml')) >= max_slow_messages:
+        return None
+
+    stem = os.path.join(directory, '%s-%s' % (time.strftime('%Y%m%d-%H%M%S'), message_id))
+
+    with open(stem + '.eml', 'wb') as f:
+        f.write(message_bytes)
+
+    with open(stem + '.json', 'w') as f:
+        json.dump({ 'message_id': message_id,
+                    'captured_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'size': len(message_bytes),
+                    'timings': timings }, f, indent = 2)
+
+    return stem + '.eml'
+
+def loadSlowMessage(eml_path):
+    # Returns (message bytes, timings) as saved by captureSlowMessage.
+    with open(eml_path, 'rb') as f:
+        message_bytes = f.read()
+
+    timings = {}
+    json_path = os.path.splitext(eml_path)[0] + '.json'
+    if os.path.exists(json_path):
+        with open(json_path) as f:
+            timings = json.load(f)['timings']
+
+    return message_bytes, timings
+
+if __name__ == '__main__':
+    # Test code. Profiles a couple of made-up cycles, one of them with a
+    # thread doing some of the work, and captures a "slow" message.
+    import tempfile
+
+    output_dir = tempfile.mkdtemp()
+    control_file = os.path.join(output_dir, 'control')
+
+    profiler = CycleProfiler(output_dir, control_file)
+    profiler.installSignalHandlers()
+
+    with open(control_file, 'w') as f:
+        f.write('cpu memory cycles=2\n')
+
+    def work():
+        return sorted(str(i) for i in range(200000))
+
+    for i in range(3):
+        with profiler.cycle():
+            thread = threading.Thread(target = work)
+            thread.start()
+            work()
+            thread.join()
+
+    print(sorted(os.listdir(output_dir)))
+
+    path = captureSlowMessage(os.path.join(output_dir, 'slow'), '1234',
+                              b'Subject: slow\r\n\r\nbody\r\n', { 'parse': 0.5 })
+    print(path, loadSlowMessage(path))
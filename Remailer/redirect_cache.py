@@ -0,0 +1,160 @@
+'''
+Created on Oct 18, 2026
+
+A cache in front of url_redirect.get_redirect_for. Campaign mails reuse the
+same few click URLs over and over, so we keep recently used redirects in
+memory, keep everything we've looked up in a small SQLite database so it
+survives restarts, and only go out to the network for URLs we haven't seen
+(or haven't seen in a while).
+'''
+
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from url_redirect import get_redirect_for
+from url_mappings import infusionlink_url_mappings
+
+class RedirectCache:
+    def __init__(self, db_path = 'redirect-cache.sqlite',
+                 max_entries = 1024,
+                 ttl = 7 * 86400,
+                 negative_ttl = 3600,
+                 resolver = get_redirect_for,
+                 seed_mappings = infusionlink_url_mappings):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._resolver = resolver
+
+        # url -> (location, expiry time), least recently used first. A
+        # location of None records a lookup that failed.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.failures = 0
+
+        self._db = sqlite3.connect(db_path, check_same_thread = False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS redirects '
+                         '(url TEXT PRIMARY KEY, location TEXT, expires REAL)')
+        self._db.commit()
+
+        if seed_mappings:
+            self.seed(seed_mappings)
+
+    def seed(self, mappings):
+        # Warm start from a dict of known url -> location mappings. Entries
+        # already in the database are left as they are.
+        expires = time.time() + self._ttl
+
+        with self._lock:
+            self._db.executemany('INSERT OR IGNORE INTO redirects VALUES (?, ?, ?)',
+                                 [(url, location, expires)
+                                  for url, location in mappings.items()])
+            self._db.commit()
+
+            for url, location in mappings.items():
+                self._remember(url, location, expires)
+
+    def _remember(self, url, location, expires):
+        self._entries[url] = (location, expires)
+        self._entries.move_to_end(url)
+
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last = False)
+
+    def _lookup(self, url, now):
+        # Returns (found, location) from memory or disk.
+        entry = self._entries.get(url)
+        if entry is not None and entry[1] > now:
+            self._entries.move_to_end(url)
+            self.memory_hits += 1
+            return True, entry[0]
+
+        row = self._db.execute('SELECT location, expires FROM redirects WHERE url = ?',
+                               (url,)).fetchone()
+        if row is not None and row[1] > now:
+            self._remember(url, row[0], row[1])
+            self.disk_hits += 1
+            return True, row[0]
+
+        return False, None
+
+    def store(self, url, location):
+        # Record a lookup result. None means the lookup failed, which we
+        # remember for a shorter time so that it gets retried.
+        ttl = self._ttl if location is not None else self._negative_ttl
+        expires = time.time() + ttl
+
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO redirects VALUES (?, ?, ?)',
+                             (url, location, expires))
+            self._db.commit()
+            self._remember(url, location, expires)
+
+    def cached(self, url):
+        # Returns (found, location) without going to the network.
+        with self._lock:
+            return self._lookup(url, time.time())
+
+    def recordMiss(self):
+        # For callers that do their own lookups after cached() comes up
+        # empty: count one going out to the network.
+        with self._lock:
+            self.misses += 1
+
+    def recordFailure(self):
+        # And count one that didn't find out where the URL goes.
+        with self._lock:
+            self.failures += 1
+
+    def get(self, url):
+        # Returns where url redirects to, or None if we can't find out.
+        found, location = self.cached(url)
+        if found:
+            return location
+
+        self.recordMiss()
+
+        try:
+            location = self._resolver(url)
+        except Exception as e:
+            print("  Redirect lookup for %s failed: %s" % (url, e))
+            location = None
+
+        if location is None:
+            self.recordFailure()
+
+        self.store(url, location)
+
+        return location
+
+    def statsString(self):
+        return "redirect cache: %d memory hits, %d disk hits, %d misses, %d failures" \
+            % (self.memory_hits, self.disk_hits, self.misses, self.failures)
+
+    def close(self):
+        self._db.close()
+
+if __name__ == '__main__':
+    # Test code. Uses a throwaway in-memory database and a fake resolver so
+    # it doesn't touch the network.
+    def fake_resolver(url):
+        if url.endswith('/bad'):
+            raise RuntimeError("connection refused")
+        return url.replace('click', 'landing')
+
+    cache = RedirectCache(db_path = ':memory:', max_entries = 2,
+                          resolver = fake_resolver)
+
+    for url in [ 'https://example.com/click/1', 'https://example.com/click/1',
+                 'https://example.com/click/2', 'https://example.com/click/3',
+                 'https://example.com/click/1', 'https://example.com/bad',
+                 'https://example.com/bad' ]:
+        print("%s -> %s" % (url, cache.get(url)))
+
+    print(cache.statsString())
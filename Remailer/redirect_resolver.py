@@ -0,0 +1,183 @@
+'''
+Created on Oct 18, 2026
+
+Resolves a batch of redirect URLs concurrently. Lookups run on a bounded
+thread pool sharing one keep-alive session, with connect/read timeouts, and
+a per-host circuit breaker stops us waiting on a tracker host that has
+been failing: its URLs are simply left unmapped until it recovers.
+'''
+
+import time
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from url_redirect import make_session
+from url_redirect import get_redirect_for
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold = 3, reset_timeout = 60):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+
+        # host -> consecutive failures, and host -> time the breaker opened.
+        self._failures = {}
+        self._opened_at = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        # A closed breaker lets everything through. An open one lets
+        # nothing through until reset_timeout has passed, then lets a
+        # trial request through to see if the host has recovered.
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return True
+
+            if time.monotonic() - opened_at >= self._reset_timeout:
+                # Half open: one trial, and re-open until we hear back.
+                self._opened_at[host] = time.monotonic()
+                return True
+
+            return False
+
+    def recordSuccess(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+
+    def recordFailure(self, host):
+        with self._lock:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+
+            if failures >= self._failure_threshold:
+                self._opened_at[host] = time.monotonic()
+
+    def openHosts(self):
+        with self._lock:
+            return sorted(self._opened_at)
+
+class RedirectResolver:
+    def __init__(self, cache = None, max_workers = 8,
+                 failure_threshold = 3, reset_timeout = 60):
+        self._cache = cache
+        self._session = make_session(max_workers)
+        self._pool = ThreadPoolExecutor(max_workers = max_workers,
+                                        thread_name_prefix = 'redirect')
+        self._breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.lookups = 0
+        self.failures = 0
+        self.skipped = 0
+
+    def _lookup(self, url):
+        # Runs on a pool thread. Exceptions are left for the caller.
+        return get_redirect_for(url, self._session)
+
+    def resolveAll(self, urls):
+        # Returns a dict of url -> location for every URL we could resolve.
+        # URLs that failed, or whose host's breaker is open, are left out.
+        url_map = {}
+        futures = {}
+
+        for url in set(urls):
+            if self._cache is not None:
+                found, location = self._cache.cached(url)
+                if found:
+                    if location is not None:
+                        url_map[url] = location
+                    continue
+
+            host = urlsplit(url).hostname
+            if not self._breaker.allow(host):
+                self.skipped += 1
+                continue
+
+            if self._cache is not None:
+                self._cache.recordMiss()
+
+            futures[url] = (host, self._pool.submit(self._lookup, url))
+
+        for url, (host, future) in futures.items():
+            self.lookups += 1
+
+            try:
+                location = future.result()
+
+            except Exception as e:
+                print("  Redirect lookup for %s failed: %s" % (url, e))
+                self.failures += 1
+                self._breaker.recordFailure(host)
+                location = None
+
+            else:
+                self._breaker.recordSuccess(host)
+
+            if self._cache is not None:
+                if location is None:
+                    self._cache.recordFailure()
+                self._cache.store(url, location)
+
+            if location is not None:
+                url_map[url] = location
+
+        return url_map
+
+    def statsString(self):
+        return "redirect resolver: %d lookups, %d failures, %d skipped, open hosts: %s" \
+            % (self.lookups, self.failures, self.skipped,
+               ', '.join(self._breaker.openHosts()) or 'none')
+
+    def shutdown(self):
+        self._pool.shutdown(wait = False)
+        self._session.close()
+
+if __name__ == '__main__':
+    # Test code. Stands up a local HTTP server in place of the tracker:
+    # /click/N redirects after a short delay, /slow/N takes longer than
+    # the read timeout.
+    import url_redirect
+    from http.server import BaseHTTPRequestHandler
+    from http.server import ThreadingHTTPServer
+
+    latency = 0.5
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/slow/'):
+                time.sleep(url_redirect.read_timeout + 1)
+            else:
+                time.sleep(latency)
+
+            self.send_response(302)
+            self.send_header('Location', 'https://example.com/landing' + self.path)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    base = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    url_redirect.read_timeout = 1
+    resolver = RedirectResolver(max_workers = 8, failure_threshold = 2)
+
+    urls = [ base + '/click/%d' % i for i in range(8) ]
+    start = time.monotonic()
+    url_map = resolver.resolveAll(urls)
+    print("Resolved %d of %d URLs with %.1fs latency each in %.2fs"
+          % (len(url_map), len(urls), latency, time.monotonic() - start))
+
+    # Two timeouts open the breaker; after that the host is skipped.
+    for i in range(3):
+        start = time.monotonic()
+        url_map = resolver.resolveAll([ base + '/slow/%d' % i ])
+        print("Slow host round %d: %d resolved in %.2fs"
+              % (i, len(url_map), time.monotonic() - start))
+
+    print(resolver.statsString())
+
+    resolver.shutdown()
+    server.shutdown()
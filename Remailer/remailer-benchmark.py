@@ -0,0 +1,265 @@
+'''
+Created on Oct 18, 2026
+
+End-to-end benchmark of the remailer against in-process stand-ins for the
+IMAP and SMTP servers. A synthetic corpus is put in the inbox, one
+doThemAll cycle deals with it, and the results - messages per second,
+per-message latencies, time spent in each stage, peak memory - are printed
+as JSON and, with --output, appended as a line to a file so that runs can
+be compared from version to version.
+
+    python remailer-benchmark.py --messages 500 --imap-latency 0.01 \\
+        --smtp-latency 0.05 --pool-size 4 --output benchmarks.jsonl
+
+With --workers, that many remailers share the inbox as cooperating
+workers (see Remailer.claimMessageUIDs), each on its own thread with its
+own connections, cycling until the inbox is empty.
+
+Everything runs in this one process, so peak RSS includes the stand-in
+servers and the corpus.
+'''
+
+import os
+import sys
+import json
+import time
+import threading
+import imaplib
+import argparse
+import resource
+import platform
+import subprocess
+from contextlib import redirect_stdout
+
+import remailer
+from remailer import Remailer
+from mailbox_config import MailboxConfig
+from smtp_session import SMTPSession
+from smtp_pool import SMTPDeliveryPool
+from corpus import makeCorpus
+from fake_imap_server import FakeIMAPServer
+from fake_smtp_server import FakeSMTPServer
+from metrics import stage_seconds
+from metrics import smtp_sessions_total
+from timer import Timer
+
+def percentiles(values):
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    def at(fraction):
+        return values[min(int(fraction * len(values)), len(values) - 1)]
+
+    return { 'p50': at(0.50), 'p90': at(0.90), 'p99': at(0.99),
+             'max': values[-1], 'mean': sum(values) / len(values) }
+
+def stageTotals():
+    # {stage: {'count': n, 'mean': seconds}} from the stage histogram.
+    sums = {}
+    counts = {}
+
+    for suffix, (stage,), extra, value in stage_seconds.samples():
+        if suffix == '_sum':
+            sums[stage] = value
+        elif suffix == '_count':
+            counts[stage] = value
+
+    return dict((stage, { 'count': counts[stage],
+                          'mean': sums[stage] / counts[stage] if counts[stage] else 0 })
+                for stage in sorted(counts))
+
+def peakRSSKilobytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives kilobytes, macOS bytes.
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr = subprocess.DEVNULL,
+                                       cwd = os.path.dirname(os.path.abspath(__file__))
+                                       ).decode().strip()
+    except Exception:
+        return None
+
+class TimedRemailer(Remailer):
+    # Records how long each message takes to transform.
+    transform_latencies = []
+
+    def transformMessage(self, message_uid, message_bytes):
+        timer = Timer()
+        try:
+            return super().transformMessage(message_uid, message_bytes)
+        finally:
+            self.transform_latencies.append(timer.elapsedTime())
+
+def runBenchmark(args):
+    mailbox = MailboxConfig()
+    folders = mailbox.folders()
+
+    capabilities = ['IMAP4rev1', 'IDLE']
+    if not args.no_move:
+        capabilities.append('MOVE')
+    if not args.no_uidplus:
+        capabilities.append('UIDPLUS')
+    if args.workers > 0:
+        capabilities.append('CONDSTORE')
+
+    imap_server = FakeIMAPServer(folders, ' '.join(capabilities),
+                                 latency = args.imap_latency).start()
+    smtp_server = FakeSMTPServer(latency = args.smtp_latency).start()
+
+    corpus = makeCorpus(args.messages, seed = args.seed)
+    for message in corpus:
+        imap_server.deliver(mailbox.incoming_folder, message.message_bytes)
+
+    smtp_service = { 'server_addr': '127.0.0.1', 'port': smtp_server.port(),
+                     'starttls': False }
+
+    TimedRemailer.pipeline_transform_workers = args.pipeline_workers
+
+    # One remailer, or one per worker, each as if on a machine of its own.
+    imap_cxns = []
+    delivery_pools = []
+    smtp_sessions = []
+    benchmark_remailers = []
+
+    for i in range(max(args.workers, 1)):
+        imap_cxn = imaplib.IMAP4('127.0.0.1', imap_server.port())
+        imap_cxn.login('benchmark', 'benchmark')
+        imap_cxns.append(imap_cxn)
+
+        delivery_pool = None
+        if args.pool_size > 0:
+            delivery_pool = SMTPDeliveryPool(lambda: SMTPSession(smtp_service, None),
+                                             size = args.pool_size)
+            delivery_pools.append(delivery_pool)
+
+        worker_mailbox = mailbox
+        if args.workers > 0:
+            worker_mailbox = MailboxConfig(worker_id = 'benchmark%d' % i)
+
+        smtp_session = SMTPSession(smtp_service, None)
+        smtp_sessions.append(smtp_session)
+
+        benchmark_remailers.append(TimedRemailer(imap_cxn, smtp_session, delivery_pool,
+                                                 mailbox = worker_mailbox))
+
+    def runWorker(worker_remailer):
+        # Cycle until the inbox is empty, or it looks as though it never
+        # will be.
+        for cycle in range(args.max_cycles):
+            if worker_remailer.doThemAll() == 0:
+                if imap_server.messageCount(mailbox.incoming_folder) == 0:
+                    break
+                time.sleep(0.05)
+
+    start = time.monotonic()
+
+    # The remailer's running commentary would only slow it down here.
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        if args.workers > 0:
+            threads = [ threading.Thread(target = runWorker, args = (worker_remailer,))
+                        for worker_remailer in benchmark_remailers ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            benchmark_remailers[0].doThemAll()
+
+    elapsed = time.monotonic() - start
+
+    for delivery_pool in delivery_pools:
+        delivery_pool.shutdown()
+    for imap_cxn in imap_cxns:
+        imap_cxn.logout()
+    for smtp_session in smtp_sessions:
+        smtp_session.terminateService()
+
+    # Check what arrived against what the corpus says should have, and
+    # that nothing arrived twice.
+    received = {}
+    deliveries = {}
+    delivery_latencies = []
+    for received_at, from_addr, recipients, message_bytes in smtp_server.messages:
+        subject = remailer.messageBytesAsHeaders(message_bytes)['Subject']
+        received.setdefault(subject, set()).update(recipients)
+        deliveries[subject] = deliveries.get(subject, 0) + len(recipients)
+        delivery_latencies.append(received_at - start)
+
+    tagged = [message for message in corpus if message.recipients]
+    delivered = [message for message in tagged
+                 if received.get(message.subject) == message.recipients]
+    duplicated = [message for message in tagged
+                  if deliveries.get(message.subject, 0) > len(message.recipients)]
+
+    imap_server.stop()
+    smtp_server.stop()
+
+    return {
+        'label': args.label,
+        'revision': gitRevision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'config': { 'messages': args.messages, 'seed': args.seed,
+                    'imap_capabilities': capabilities,
+                    'imap_latency': args.imap_latency,
+                    'smtp_latency': args.smtp_latency,
+                    'pool_size': args.pool_size,
+                    'pipeline_workers': args.pipeline_workers,
+                    'workers': args.workers },
+        'corpus_bytes': sum(len(message.message_bytes) for message in corpus),
+        'elapsed_seconds': elapsed,
+        'messages_per_second': args.messages / elapsed if elapsed > 0 else None,
+        'tagged_messages': len(tagged),
+        'delivered_messages': len(delivered),
+        'duplicated_messages': len(duplicated),
+        'left_in_inbox': imap_server.messageCount(mailbox.incoming_folder),
+        'transform_latency': percentiles(TimedRemailer.transform_latencies),
+        'delivery_latency': percentiles(delivery_latencies),
+        'stages': stageTotals(),
+        'imap_commands': imap_server.command_counts,
+        'smtp_sessions': dict((event, count)
+                              for (event,), count in smtp_sessions_total.values().items()),
+        'peak_rss_kb': peakRSSKilobytes(),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the remailer end to end.')
+    parser.add_argument('--messages', type = int, default = 200)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--imap-latency', type = float, default = 0,
+                        help = 'seconds each IMAP command takes')
+    parser.add_argument('--smtp-latency', type = float, default = 0,
+                        help = 'seconds the SMTP server takes over each message')
+    parser.add_argument('--no-move', action = 'store_true',
+                        help = 'leave MOVE out of the IMAP capabilities')
+    parser.add_argument('--no-uidplus', action = 'store_true',
+                        help = 'leave UIDPLUS out of the IMAP capabilities')
+    parser.add_argument('--pool-size', type = int, default = 0,
+                        help = 'SMTP connections to send over (0 to send serially)')
+    parser.add_argument('--pipeline-workers', type = int, default = 0,
+                        help = 'transform threads for pipelined mode (0 for serial)')
+    parser.add_argument('--workers', type = int, default = 0,
+                        help = 'remailers sharing the inbox by claiming messages (0 for one '
+                               'remailer on its own)')
+    parser.add_argument('--max-cycles', type = int, default = 1000,
+                        help = 'give up on a worker after this many cycles')
+    parser.add_argument('--label', default = None,
+                        help = 'a name for this run, kept with the results')
+    parser.add_argument('--output', default = None,
+                        help = 'append the results to this file as a line of JSON')
+    args = parser.parse_args()
+
+    results = runBenchmark(args)
+
+    print(json.dumps(results, indent = 2))
+
+    if args.output is not None:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(results) + '\n')
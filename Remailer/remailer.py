@@ -7,55 +7,69 @@ Created on Jan 31, 2021
 # System and language imports
 import sys
 import traceback
+import threading
+import queue
 
 # Standard library imports
 import logging
 import time
+import random
 from time import sleep
 import re
-from quopri import decodestring
 from imaplib import Time2Internaldate
 
-# Imports from local libraries elsewhere on the PYTHONPATH
-from creds import RemailerBotCreds
-from creds import SMTPCreds
-
 # Imports from the Enroller project
-from macros import macro_substitute
-
 from imap import IMAPInterface
-from smtp import SMTPInterface
-
-from centraltime import centraltime_str
-from macros import macro_substitute
 
 # Imports from elsewhere in this project 
-from message import dumpHeaders
 from message import mutateHeaders
 from message import scanPartForTruncateTags
 from message import scanPartForRemailTags
 from message import messageBytesAsObject
+from message import messageBytesAsHeaders
 from message import showMessageSubject
+from message import leafParts
 
-from timer import Timer
+from bodystructure import parseFetchResponse
+from bodystructure import textSections
+from bodystructure import isMultipart
+from bodystructure import decodeSection
 
-# Unused local imports
-# from url_mappings import infusionlink_url_mappings
-# from url_redirect import get_redirect_for
+from imap_idle import idleUntilNewMail
 
-# Names of the five folders used by the Remailer
-# The inbox is where messages to us are delivered
-incoming_folder = 'INBOX'
+from prefilter import mayHaveRemailTags
+from prefilter import sectionMayHaveRemailTags
 
-# Incoming (original) messages are filtered into one
-# if these two folders. 
-original_folder = 'INBOX/remailer-original'
-notag_folder = 'INBOX/remailer-original-notag'
+from email_address import addAddresses
+
+from smtp_session import SMTPSession
+from smtp_session import deliverToRecipients
+from smtp_session import outgoingMessage
+from smtp_pool import SMTPDeliveryPool
+from spool import DeliverySpool
+from spool import DeliveryWorker
+
+from timer import Timer
 
-exception_folder = 'INBOX/remailer-exception'
-sent_folder = 'INBOX/remailer-sent'
+from profiling import CycleProfiler
+from profiling import captureSlowMessage
 
-global_from_addr = 'da@delligattiassociates.com'
+from metrics import startMetricsServer
+from metrics import stage_seconds
+from metrics import messages_total
+from metrics import errors_total
+from metrics import imap_reconnects_total
+from metrics import claims_total
+from metrics import inbox_messages
+from metrics import queue_length
+
+from url_rewrite import URLRewriter
+from url_rewrite import loadRules
+from url_rewrite import infusion_links_rule
+from url_rewrite import tracking_pixel_rule
+
+from mailbox_config import MailboxConfig
+from mailbox_config import loadConfig
 
 def info(str_):
     logging.info("Remailer: " + str_)
@@ -64,26 +78,109 @@ def info(str_):
 def debug(str_):
     logging.debug("Remailer: " + str_)
 
-class Remailer:
-    def __init__(self, imap_connection, smtp_service):
-        self._imap_cxn = imap_connection
-        self._smtp_service = smtp_service
+def uidSetString(message_uids):
+    # Turn a list of UIDs (as bytestrings) into a compact IMAP UID set,
+    # collapsing runs, e.g. [101, 102, ..., 140, 152] -> '101:140,152'.
+    uids = sorted(set(int(uid) for uid in message_uids))
+    ranges = []
+    
+    for uid in uids:
+        if ranges and ranges[-1][1] == uid - 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+            
+    return ','.join(str(lo) if lo == hi else '%d:%d' % (lo, hi)
+                    for lo, hi in ranges)
+
+class RemailerBase:
+    # What's done to messages, however we talk to the servers: Remailer
+    # does its IMAP and SMTP with imaplib and threads, AsyncRemailer (see
+    # async_remailer.py) on asyncio. Nothing here does IMAP or SMTP itself.
+    def __init__(self, mailbox = None):
         
-        # Check the connection capabilities to see if it supports
-        # the MOVE command
-        typ, capabilities_str = self._imap_cxn.capability()
-        capabilities = capabilities_str[0].split()
+        # The folders, from address and so on of the mailbox we serve.
+        self._mailbox = mailbox if mailbox is not None else MailboxConfig()
+        
+        # Transform threads may all want the redirect resolver or URL
+        # rewriter at once; only one of them should build it.
+        self._setup_lock = threading.Lock()
         
+        self._initState()
+        
+    def _noteIMAPCapabilities(self, capabilities):
+        # capabilities is a list of the server's capabilities as
+        # bytestrings.
         if b'MOVE' in capabilities:
             self._imap_has_move = True
         else:
             self._imap_has_move = False
             
+        # Likewise, check whether it supports IDLE (RFC 2177), which
+        # lets the server tell us about new mail instead of us polling.
+        if b'IDLE' in capabilities:
+            self._imap_has_idle = True
+        else:
+            self._imap_has_idle = False
+            
+        # UIDPLUS (RFC 4315) gives us UID EXPUNGE, for when there's no MOVE.
+        if b'UIDPLUS' in capabilities:
+            self._imap_has_uidplus = True
+        else:
+            self._imap_has_uidplus = False
+            
+        # CONDSTORE (RFC 7162) adds HIGHESTMODSEQ to STATUS.
+        if b'CONDSTORE' in capabilities:
+            self._imap_has_condstore = True
+        else:
+            self._imap_has_condstore = False
+            
+    def _initState(self):
+        self._pending_moves = {}
+        
+        self._redirect_cache = None
+        self._redirect_resolver = None
+        self._url_rewriter = None
+        self._poll_interval = self.min_poll_interval
+        
+        # What each folder looked like when we last searched it, as
+        # returned by folderStatus, so we can tell when nothing has changed.
+        # For the selected folder, MESSAGES is kept up to date from the
+        # server's EXISTS and EXPUNGE responses, and _new_mail_reported
+        # says whether it has sent an EXISTS since we last searched.
+        self._folder_sync = {}
+        self._new_mail_reported = False
+        
+        # Incoming messages we've seen but not yet moved out of the folder,
+        # because something went wrong with them. They're tried again
+        # along with the next new mail, or after unfinished_retry_interval
+        # if none comes.
+        self._unfinished_uids = set()
+        self._unfinished_retry_at = 0
+        
+        self._selected_folder = None
+            
         self._uptime_timer = Timer()
         self._imap_timer = Timer()
 
         self._imap_reconnect_count = 0
         
+        self._cycle_count = 0
+        self._inbox_message_count = None
+        
+    def status(self):
+        # How we're doing, as a dict that can be pickled and sent to the
+        # supervisor.
+        return { 'name': self._mailbox.name,
+                 'uptime': self._uptime_timer.elapsedTime(),
+                 'cycles': self._cycle_count,
+                 'inbox_messages': self._inbox_message_count,
+                 'imap_reconnects': self._imap_reconnect_count,
+                 'messages': dict((outcome, count) for (outcome,), count
+                                  in messages_total.values().items()),
+                 'errors': dict((stage, count) for (stage,), count
+                                in errors_total.values().items()) }
+        
     def resetIMAPTimer(self):
         self._imap_timer = Timer()
         
@@ -93,28 +190,542 @@ class Remailer:
     def _imapupStr(self):
         return self._imap_timer.simpleElapsedTimeString()
     
+    status_item_prog = re.compile(rb'([A-Z]+) (\d+)')
+    
+    # How many messages to ask for in a single UID FETCH.
+    fetch_chunk_size = 50
+    
+    fetch_uid_prog = re.compile(rb'\bUID (\d+)')
+    
+    def _textSectionsHaveRemailTags(self, text_sections, in_multipart, message):
+        
+        for section, sub_type, charset, encoding in text_sections:
+            
+            # performSubstitutionOnMessageParts throws these away without
+            # looking at them, so their tags don't count.
+            if self.isDeletedHTMLPart(sub_type, in_multipart):
+                continue
+            
+            # Most text has no tags in it at all, which we can usually
+            # tell without decoding it.
+            section_bytes = message.get(b'BODY[%s]' % section.encode())
+            if not sectionMayHaveRemailTags(section_bytes, charset, encoding):
+                continue
+            
+            section_str = decodeSection(section_bytes, charset, encoding)
+            section_str = scanPartForTruncateTags(section_str)
+            section_str, remail_addresses_set = scanPartForRemailTags(section_str)
+            
+            if len(remail_addresses_set) > 0:
+                return True
+            
+        return False
+    
+    def groupByTextSections(self, chunk, structures):
+        
+        # Group the messages in chunk by which sections of them we need to
+        # scan, given their BODYSTRUCTUREs as parsed by parseFetchResponse,
+        # so that each group takes one FETCH. Returns (sections_by_uid,
+        # uids_by_sections, multipart_uids); a message whose structure we
+        # can't make sense of is in none of them.
+        sections_by_uid = {}
+        uids_by_sections = {}
+        multipart_uids = set()
+        
+        for structure in structures:
+            message_uid = structure.get(b'UID')
+            if message_uid is None or message_uid not in chunk:
+                continue
+            
+            body = structure.get(b'BODYSTRUCTURE')
+            text_sections = textSections(body)
+            if text_sections is None:
+                continue
+            
+            if isMultipart(body):
+                multipart_uids.add(message_uid)
+            
+            sections_by_uid[message_uid] = text_sections
+            section_names = tuple(section for section, _, _, _ in text_sections)
+            uids_by_sections.setdefault(section_names, []).append(message_uid)
+            
+        return sections_by_uid, uids_by_sections, multipart_uids
+    
+    def sortTextSections(self, group_uids, sections_by_uid, multipart_uids, messages,
+                         tagged_uids, notag_uids):
+        
+        # Add each of a group's messages to tagged_uids or notag_uids
+        # according to the sections fetched for it, messages being
+        # {uid: parsed FETCH response}.
+        for message_uid in group_uids:
+            try:
+                if message_uid not in messages or \
+                        self._textSectionsHaveRemailTags(sections_by_uid[message_uid],
+                                                         message_uid in multipart_uids,
+                                                         messages[message_uid]):
+                    tagged_uids.append(message_uid)
+                else:
+                    notag_uids.append(message_uid)
+                    
+            except Exception:
+                tagged_uids.append(message_uid)
+                
+    def inInboxOrder(self, message_uids, tagged_uids, notag_uids):
+        # Keep both lists in the order of message_uids.
+        tagged_uids = set(tagged_uids)
+        notag_uids = set(notag_uids)
+        
+        return [uid for uid in message_uids if uid in tagged_uids], \
+               [uid for uid in message_uids if uid in notag_uids]
+    
+    def checkIMAPResponse(self, code, response):
+        if code != 'OK':
+            raise RuntimeError(response)
+        
+    def msgId(self, message_uid):
+        message_id = 'ID(' + message_uid.decode('utf-8') + ')'
+        return message_id
+    
+    def moveMessageUID(self, message_uid, destination_folder):
+        
+        message_id = self.msgId(message_uid)
+        debug('Queueing move of message %s to %s' % (message_id, destination_folder))
+        
+        # Moves are batched up per destination folder and done with one
+        # command per folder by flushMessageMoves.
+        self._pending_moves.setdefault(destination_folder, []).append(message_uid)
+        
+    def redirectResolver(self):
+        # The resolver and its cache are only set up the first time we
+        # need them, so there's no database file or thread pool unless URL
+        # remapping is turned on, nor do we need requests, which they use.
+        with self._setup_lock:
+            if self._redirect_resolver is None:
+                from redirect_cache import RedirectCache
+                from redirect_resolver import RedirectResolver
+                
+                self._redirect_cache = RedirectCache()
+                self._redirect_resolver = RedirectResolver(self._redirect_cache)
+            return self._redirect_resolver
+    
+    def urlRewriter(self):
+        # Build the URL rewriter from the rule table, if one is configured,
+        # or else from the built-in rules that are switched on.
+        with self._setup_lock:
+            if self._url_rewriter is None:
+                if self.url_rewrite_rules_file is not None:
+                    rules = loadRules(self.url_rewrite_rules_file)
+                else:
+                    rules = []
+                    if self.remap_urls:
+                        rules.append(infusion_links_rule)
+                    if self.suppress_tracking_pixels:
+                        rules.append(tracking_pixel_rule)
+                        
+                self._url_rewriter = URLRewriter(rules)
+                
+            return self._url_rewriter
+    
+    def rewriteURLs(self, message_part_strs):
+        
+        # Apply the URL rewrite rules to all the given strings, first
+        # looking up (all at once) any URLs that map rules need resolved.
+        url_rewriter = self.urlRewriter()
+        
+        with stage_seconds.time('url_rewrite'):
+            urls = url_rewriter.mapTargets(message_part_strs)
+            url_map = self.redirectResolver().resolveAll(urls) if urls else {}
+            
+            return [url_rewriter.rewrite(message_part_str, url_map)
+                    for message_part_str in message_part_strs]
+    
+    delete_html_parts = True
+    
+    def isDeletedHTMLPart(self, sub_type, in_multipart):
+        # Optional configuration: just delete all HTML parts because
+        # something in them is causing emails to get filed as SPAM.
+        # (Unless the HTML is all there is.)
+        return self.delete_html_parts and sub_type == "html" and in_multipart
+    
+    # Optional configuration: replace infusion-link URLs with the URLs they
+    # redirect to, and delete tracking pixel URLs.
+    remap_urls = False
+    suppress_tracking_pixels = False
+    
+    # Optional configuration: a JSON table of URL rewrite rules (see
+    # url_rewrite.py) to use instead of the two settings above.
+    url_rewrite_rules_file = None
+    
+    # If timings (a dict) is given, how long the tag scan and URL rewriting
+    # took is added to it.
+    def performSubstitutionOnMessageParts(self, obj, timings = None):
+        
+        remail_addresses_set = set()
+        
+        # The parts we've scanned, as (part, original content, content so
+        # far, subtype, charset, disposition), to be finished off once
+        # we've seen them all.
+        scanned_parts = []
+        
+        scan_timer = Timer()
+        
+        # Loop over all the message parts, apart from the multipart ones,
+        # which are basically containers.
+        for container, part in leafParts(obj):
+            
+            # Only text parts can hold tags. Everything else (PDFs, images
+            # and so on) is left just as it is, still encoded, so it isn't
+            # decoded here or re-encoded when the message is sent.
+            main_type, _, sub_type = part.get_content_type().partition('/')
+            
+            if main_type != "text":
+                debug("Passing over %s/%s part" % (main_type, sub_type))
+                continue
+            
+            if self.isDeletedHTMLPart(sub_type, container is not None):
+                container.get_payload().remove(part)
+                
+                # This part has been deleted - no further processing
+                # needed for this part.
+                continue
+            
+            content_charset = part.get_content_charset()
+            content_disposition = part.get_content_disposition()
+            
+            debug("Scanning text/%s part, charset %s, disposition %s"
+                  % (sub_type, content_charset, content_disposition))
+            
+            # Get the message_part_str of this part of the message.
+            # If this part of the message was encoded in (possibly)
+            # MIME quoted-printable, it will be decoded into a string
+            # in (proabably) UTF-8 unicode. (Which is good, because
+            # it's easier to deal with in this form.)
+            message_part_str = part.get_content()
+            
+            # Now some real processing...
+            
+            maybe_modified_content_str = scanPartForTruncateTags(message_part_str)
+            
+            # Scan the part for remail-to: tags, replace them,
+            # and accumulate the recipient addresses.
+            maybe_modified_content_str, more_remail_addresses_set = \
+                scanPartForRemailTags(maybe_modified_content_str)
+                
+            # Get the union of the two sets.
+            addAddresses(remail_addresses_set, more_remail_addresses_set)
+            
+            scanned_parts.append((part, message_part_str, maybe_modified_content_str,
+                                  sub_type, content_charset, content_disposition))
+            
+        scan_time = scan_timer.elapsedTime()
+        stage_seconds.observe(scan_time, 'tag_scan')
+        
+        # Rewrite the URLs in all the parts together, so that any redirect
+        # lookups happen concurrently, and each part is only scanned once
+        # whatever the number of rules.
+        rewrite_timer = Timer()
+        content_strs = [scanned_part[2] for scanned_part in scanned_parts]
+        content_strs = self.rewriteURLs(content_strs)
+        
+        if timings is not None:
+            timings['tag_scan'] = scan_time
+            timings['url_rewrite'] = rewrite_timer.elapsedTime()
+            
+        for (part, message_part_str, _, sub_type, content_charset, content_disposition), \
+                maybe_modified_content_str in zip(scanned_parts, content_strs):
+            
+            # If any of these steps have modified the content of this
+            # part of the message, then replace that part of the
+            # message object.                
+            if maybe_modified_content_str != message_part_str:
+                
+                part.set_content(maybe_modified_content_str, subtype = sub_type,
+                                    charset = content_charset,
+                                    disposition = content_disposition)
+
+        # Return any remail-to addresses we found. (It's not
+        # to return the message object. It's passed by reference,
+        # and the caller's reference will retain any changes
+        # we've made here.)
+        return remail_addresses_set
+    
+    # The most recipients we'll give the SMTP server in one transaction.
+    max_recipients_per_transaction = 50
+ 
+    def reportRefusedRecipients(self, refused):
+        for recipient_address, (code, response) in refused.items():
+            print("*** <%s> refused: %d %s" % (recipient_address, code,
+                                              response.decode('utf-8', 'replace')))
+    
+    # Messages that take longer than this many seconds to transform are
+    # saved in the mailbox's slow_message_dir.
+    slow_message_seconds = 5
+    
+    def transformMessage(self, message_uid, message_bytes):
+        
+        # How long each stage takes for this message, in case it turns out
+        # to be a slow one.
+        timings = {}
+        timer = Timer()
+        
+        try:
+            return self._transformMessage(message_uid, message_bytes, timings)
+        
+        finally:
+            timings['total'] = timer.elapsedTime()
+            if self._mailbox.slow_message_dir is not None and \
+                    timings['total'] > self.slow_message_seconds:
+                self.captureSlowMessage(message_uid, message_bytes, timings)
+                
+    def captureSlowMessage(self, message_uid, message_bytes, timings):
+        try:
+            path = captureSlowMessage(self._mailbox.slow_message_dir,
+                                      'uid' + message_uid.decode('utf-8'),
+                                      message_bytes, timings)
+            if path is not None:
+                info("Message %s took %.2fs - saved as %s"
+                     % (self.msgId(message_uid), timings['total'], path))
+                
+        except Exception as e:
+            print("*** Error saving slow message %s: %s" % (self.msgId(message_uid), e))
+            errors_total.inc('capture')
+                
+    def _transformMessage(self, message_uid, message_bytes, timings):
+        
+        # Most messages have no tags at all, and we can usually tell that
+        # from the raw bytes without parsing them.
+        with stage_seconds.time('prefilter') as prefilter_timer:
+            may_have_tags = mayHaveRemailTags(message_bytes)
+        timings['prefilter'] = prefilter_timer.elapsedTime()
+        
+        if not may_have_tags:
+            print()
+            info("Message %s has no remail tags." % self.msgId(message_uid))
+            return set(), None
+        
+        # Parse the message once; everything below works from
+        # this object.
+        with stage_seconds.time('parse') as parse_timer:
+            message_obj = messageBytesAsObject(message_bytes, raw_attachments = True)
+        timings['parse'] = parse_timer.elapsedTime()
+        
+        # Emit some messages to show progress.
+        print()
+        info("Message %s" % self.msgId(message_uid))
+        showMessageSubject(message_obj)
+        
+        remail_addresses_set = self.performSubstitutionOnMessageParts(message_obj, timings)
+        
+        remail_count = len(remail_addresses_set)
+        if remail_count == 0:
+            return remail_addresses_set, None
+        
+        rm_suffix = "" if remail_count == 1 else "es"
+        info("Found %d remail address%s" % (remail_count, rm_suffix))
+        
+        # The message in message_bytes has already had its body
+        # modified (remail-to tags removed, infusionlinks URLs
+        # replaced, tracking pixel URLs deleted). Now we modify
+        # the headers to make the message look like a brand new
+        # message, not something that's been bounced around the
+        # Internet already.
+        mutateHeaders(message_obj, self._mailbox.global_from_addr)
+        
+        # Construct a single To: header with all of the email
+        # addresses in it.
+        to_header_str = ', '.join(remail_addresses_set)
+        message_obj.add_header("To", to_header_str)
+        
+        # debug("Base message headers:")
+        # dumpHeaders(message_obj)
+        
+        # Turn the base message into its wire format, once. The same
+        # bytes are archived and then used for every send.
+        serialize_timer = Timer()
+        outgoing_message = outgoingMessage(message_obj)
+        timings['serialize'] = serialize_timer.elapsedTime()
+        
+        return remail_addresses_set, outgoing_message
+    
+    def queueRemail(self, message_uid, remail_addresses_set, outgoing_message, outgoing):
+        
+        if outgoing_message is not None:
+            # We found at least one valid remail-to tag, so the original
+            # message should be move to the originals folder. The
+            # message is sent once that move has been done.
+            self.moveMessageUID(message_uid, self._mailbox.original_folder)
+            outgoing.append((message_uid, outgoing_message, remail_addresses_set))
+            messages_total.inc('remailed')
+        
+        else:
+            # No addresses to remail to - move the original message to the
+            # original-notag folder
+            debug("No remail addresses! Moving to no-tag folder.")
+            self.moveMessageUID(message_uid, self._mailbox.notag_folder)
+            messages_total.inc('notag')
+            
+    def reportMessageError(self, message_uid, message_bytes, e):
+        traceback.print_tb(e.__traceback__)
+        print("*** Error processing message %s - skipping."
+              % self.msgId(message_uid))
+        messages_total.inc('error')
+        errors_total.inc('process')
+        
+        # We may not have got as far as parsing the message, so
+        # show which one it was from its headers alone.
+        try:
+            showMessageSubject(messageBytesAsHeaders(message_bytes))
+        except Exception:
+            pass
+    
+    # Servers may drop an IDLE after 30 minutes (Gmail after 29), so we
+    # break out and re-issue it a bit before that.
+    idle_timeout = 28 * 60
+    
+    # Bounds for the adaptive polling used when the server has no IDLE.
+    min_poll_interval = 5
+    max_poll_interval = 60
+    
+    # How long to leave messages we couldn't finish before trying them
+    # again, if no new mail comes in the meantime.
+    unfinished_retry_interval = 60
+    
+
+class Remailer(RemailerBase):
+    def __init__(self, imap_connection, smtp_service, delivery_pool = None,
+                 spool = None, mailbox = None):
+        super().__init__(mailbox)
+        
+        self._imap_cxn = imap_connection
+        self._smtp_service = smtp_service
+        
+        # If we're given a pool of SMTP connections, sends go through it
+        # in parallel rather than through smtp_service one at a time.
+        self._delivery_pool = delivery_pool
+        
+        # If we're given a spool, messages are left there for its delivery
+        # worker to send, and we don't send anything ourselves.
+        self._spool = spool
+        
+        # Check the connection capabilities to see if it supports
+        # the MOVE command. Without a connection we can still transform
+        # messages, e.g. to replay them offline.
+        if self._imap_cxn is not None:
+            typ, capabilities_str = self._imap_cxn.capability()
+            self._noteIMAPCapabilities(capabilities_str[0].split())
+        else:
+            self._noteIMAPCapabilities([])
+        
+        # Sharing the incoming folder with other workers, we only handle
+        # the messages we've claimed with this keyword.
+        self._claim_keyword = None
+        if self._mailbox.worker_id is not None:
+            if not self.worker_id_prog.fullmatch(self._mailbox.worker_id):
+                raise ValueError("Bad worker_id %r" % self._mailbox.worker_id)
+            if self._imap_cxn is not None and not self._imap_has_condstore:
+                raise RuntimeError("Sharing an incoming folder between workers needs "
+                                   "an IMAP server with CONDSTORE")
+            self._claim_keyword = self.claim_keyword_prefix + self._mailbox.worker_id
+        
+        # imaplib isn't safe to use from more than one thread at once, and
+        # in pipelined mode the fetch thread shares the connection.
+        self._imap_lock = threading.RLock()
+        
+    def _initState(self):
+        super()._initState()
+        
+        # Sharing the incoming folder, messages nobody has claimed that
+        # we've yet to claim ourselves, and those others have claimed,
+        # as {uid: (modseq, claim keywords, when we first saw them so)}.
+        self._claim_backlog = set()
+        self._claim_watch = {}
+        
     def setIMAPConnction(self, imap_cxn):
         self._imap_cxn = imap_cxn
         self._imap_reconnect_count += 1
+        imap_reconnects_total.inc()
+        self._selected_folder = None
         
     def _validateFolder(self, folder_name):
-        typ, [response] = self._imap_cxn.select(folder_name)
-        if typ != 'OK':
-            raise RuntimeError(response)
+        # STATUS tells us the folder is there without selecting it.
+        self.folderStatus(folder_name)
     
     def validateFolderStructure(self):
-        self._validateFolder(incoming_folder)
-        self._validateFolder(sent_folder)
-        self._validateFolder(exception_folder)
-        self._validateFolder(original_folder)
-        self._validateFolder(notag_folder)
+        self._validateFolder(self._mailbox.incoming_folder)
+        self._validateFolder(self._mailbox.sent_folder)
+        self._validateFolder(self._mailbox.exception_folder)
+        self._validateFolder(self._mailbox.original_folder)
+        self._validateFolder(self._mailbox.notag_folder)
         
-    def getAllFolderUIDs(self, folder):
+    def folderStatus(self, folder):
+        # Ask about a folder without selecting it. Returns a dict of the
+        # STATUS items, e.g. {'UIDVALIDITY': 1, 'UIDNEXT': 52, 'MESSAGES': 3}.
+        items = 'UIDVALIDITY UIDNEXT MESSAGES'
+        if self._imap_has_condstore:
+            items += ' HIGHESTMODSEQ'
+            
+        typ, data = self._imap_cxn.status(folder, '(%s)' % items)
+        self.checkIMAPResponse(typ, data)
+        
+        # The response looks like b'"INBOX" (MESSAGES 3 UIDNEXT 52 ...)'.
+        response = data[0]
+        items = response[response.rindex(b'('):]
+        
+        return dict((name.decode(), int(value))
+                    for name, value in self.status_item_prog.findall(items))
+    
+    def selectFolder(self, folder):
         typ, [response] = self._imap_cxn.select(folder)
         if typ != 'OK':
             raise RuntimeError(response)
         
-        typ, response = self._imap_cxn.uid('search', None, 'ALL')
+        self._selected_folder = folder
+        
+        # The server tells us how many messages there are with an EXISTS,
+        # and UIDNEXT along with it; if that's moved on since we last
+        # searched, there's new mail. imaplib leaves both among its
+        # untagged responses, where pollSelectedFolder would take the
+        # EXISTS for news of more mail.
+        typ, exists = self._imap_cxn.response('EXISTS')
+        typ, uidnext = self._imap_cxn.response('UIDNEXT')
+        known = self._folder_sync.get(folder)
+        
+        if known is not None:
+            known['MESSAGES'] = int(exists[-1])
+            self._new_mail_reported = uidnext[-1] is None or \
+                int(uidnext[-1]) != known['UIDNEXT']
+        
+    def pollSelectedFolder(self):
+        # Check the selected folder for changes. RFC 3501 says not to use
+        # STATUS on it; instead a NOOP gives the server a chance to tell
+        # us what's changed, in untagged responses that imaplib keeps.
+        typ, data = self._imap_cxn.noop()
+        self.checkIMAPResponse(typ, data)
+        
+        # EXISTS, sent when messages arrive, gives the new message count.
+        # Each EXPUNGE means one message fewer. If both have come in we
+        # can't tell their order, so take it that the EXPUNGEs came first,
+        # as they usually do; the count is only for reporting.
+        known = self._folder_sync[self._selected_folder]
+        typ, exists = self._imap_cxn.response('EXISTS')
+        typ, expunged = self._imap_cxn.response('EXPUNGE')
+        
+        if exists[0] is not None:
+            known['MESSAGES'] = int(exists[-1])
+            self._new_mail_reported = True
+        elif expunged[0] is not None:
+            known['MESSAGES'] -= len(expunged)
+        
+        # Flag changes come as FETCH responses, which imaplib would
+        # otherwise hand back along with our own next FETCH.
+        self._imap_cxn.response('FETCH')
+        
+    def getAllFolderUIDs(self, folder):
+        self.selectFolder(folder)
+        
+        # Messages we've moved away on a server without MOVE or UIDPLUS
+        # linger, marked deleted, until the expunge at shutdown.
+        typ, response = self._imap_cxn.uid('search', None, 'UNDELETED')
         
         if typ != 'OK':
             raise RuntimeError(response)
@@ -123,334 +734,894 @@ class Remailer:
         
         return message_uids
     
-    def fetchMessageUIDAsBytes(self, message_uid):
+    def getNewFolderUIDs(self, folder):
         
-        # Fetch the contents of the message
-        typ, data = self._imap_cxn.uid('fetch', message_uid, '(RFC822)')
-
-        if typ != 'OK':
-            raise RuntimeError(data)
-
-        # The message date comes in as a bytestring. Resist the temptation
-        # to decode it into a UTF-8 string.
-        message_bytes = data[0][1]
+        # Returns (message_uids, message_count): the UIDs of the messages
+        # in the folder that we've yet to deal with, and how many messages
+        # it holds in all. Rather than selecting and searching the whole
+        # folder every time, we find out whether there's new mail since
+        # last time: if the folder is selected, from what the server tells
+        # us in answer to a NOOP, and otherwise by asking for its STATUS
+        # and seeing whether UIDNEXT has moved. If there's none there's
+        # nothing more to do; if there is, only UIDs from the last UIDNEXT
+        # on need searching. Only a change of UIDVALIDITY, which means our
+        # UIDs are no good any more, calls for the whole folder to be
+        # searched. (The UIDVALIDITY of the selected folder can't change
+        # without the server dropping the connection.)
+        known = self._folder_sync.get(folder)
         
-        return message_bytes
+        if known is not None and self._selected_folder == folder:
+            self.pollSelectedFolder()
+            status = dict(known)
+            new_mail = self._new_mail_reported
+        else:
+            status = self.folderStatus(folder)
+            new_mail = known is not None and known['UIDNEXT'] != status['UIDNEXT']
+        
+        if known is None or known['UIDVALIDITY'] != status['UIDVALIDITY']:
+            debug("Searching all of %s" % folder)
+            message_uids = self.getAllFolderUIDs(folder)
+            self._new_mail_reported = False
+            self._unfinished_uids = set()
+            self._claim_backlog = set()
+            self._claim_watch = {}
+            
+        elif not new_mail:
+            if status.get('HIGHESTMODSEQ') != known.get('HIGHESTMODSEQ'):
+                debug("Flags changed in %s, but no new mail" % folder)
+            
+            # No new mail, but it's time to have another go at whatever
+            # we couldn't finish.
+            if self._unfinished_uids and time.monotonic() >= self._unfinished_retry_at:
+                if self._selected_folder != folder:
+                    self.selectFolder(folder)
+                
+                # Forget any that have gone from the folder in the meantime.
+                typ, response = self._imap_cxn.uid('search', None, 'UID',
+                                                   uidSetString(self._unfinished_uids),
+                                                   'UNDELETED')
+                self.checkIMAPResponse(typ, response)
+                self._unfinished_uids &= set(response[0].split())
+                
+                debug("Retrying %d unfinished messages" % len(self._unfinished_uids))
+                message_uids = sorted(self._unfinished_uids, key = int)
+            else:
+                message_uids = []
+            
+        else:
+            if self._selected_folder != folder:
+                self.selectFolder(folder)
+            
+            # Anything reported from here on is looked for next time.
+            self._new_mail_reported = False
+            
+            # A UID set ending in * always matches the last message, even
+            # if it's older than the start of the range, so check.
+            typ, response = self._imap_cxn.uid('search', None, 'UID',
+                                               '%d:*' % known['UIDNEXT'],
+                                               'UNDELETED')
+            self.checkIMAPResponse(typ, response)
+            
+            message_uids = [uid for uid in response[0].split()
+                            if int(uid) >= known['UIDNEXT']]
+            
+            # Without a STATUS we don't have the new UIDNEXT, but it's at
+            # least one past the last UID we found.
+            if message_uids:
+                status['UIDNEXT'] = max(status['UIDNEXT'], int(message_uids[-1]) + 1)
+            
+            # Have another go at whatever we couldn't finish last time.
+            message_uids = sorted(self._unfinished_uids | set(message_uids), key = int)
+            
+        # With STATUS, take the UIDNEXT from before the search, so that
+        # anything that arrived during it is looked for again next time
+        # rather than missed.
+        self._folder_sync[folder] = status
+        
+        return message_uids, status['MESSAGES']
     
-    def checkIMAPResponse(self, code, response):
-        if code != 'OK':
-            raise RuntimeError(response)
+    # Workers sharing an incoming folder claim each message before
+    # handling it by giving it a keyword of their own, <prefix><worker_id>,
+    # with UNCHANGEDSINCE (RFC 7162) so that only one of them can: the
+    # second to try finds the message changed and its STORE does nothing.
+    # A claim that sits unchanged on a message still in the folder for
+    # claim_lease_seconds is taken to belong to a worker that died, and is
+    # removed so the message can be claimed again. Each cycle claims at
+    # most claim_batch_size new messages, leaving the rest for the other
+    # workers. The keyword goes with the message when it's moved, as a
+    # record of who handled it.
+    claim_keyword_prefix = '$RemailerClaim-'
+    claim_lease_seconds = 15 * 60
+    claim_batch_size = 50
+    
+    worker_id_prog = re.compile(r'[A-Za-z0-9._-]+')
+    
+    def fetchClaims(self, message_uids):
+        # Returns {uid: (modseq, frozenset of claim keywords)} for those of
+        # message_uids that are still in the selected folder.
+        claims = {}
+        prefix = self.claim_keyword_prefix.encode('ascii')
         
-    def msgId(self, message_uid):
-        message_id = 'ID(' + message_uid.decode('utf-8') + ')'
-        return message_id
+        for i in range(0, len(message_uids), self.fetch_chunk_size):
+            chunk = message_uids[i:i + self.fetch_chunk_size]
+            
+            with stage_seconds.time('claim'):
+                typ, data = self._imap_cxn.uid('fetch', uidSetString(chunk), '(MODSEQ FLAGS)')
+            self.checkIMAPResponse(typ, data)
+            
+            for message in parseFetchResponse(data):
+                message_uid = message.get(b'UID')
+                if message_uid is None or message_uid not in chunk:
+                    continue
+                
+                keywords = frozenset(flag.decode('ascii') for flag in message.get(b'FLAGS') or []
+                                     if flag.startswith(prefix))
+                claims[message_uid] = (int(message[b'MODSEQ'][0]), keywords)
+                
+        return claims
     
-    def moveMessageUID(self, message_uid, destination_folder):
+    def storeIfUnchanged(self, message_uids, modseq, action, keywords):
+        # STORE action (e.g. '+FLAGS') keywords on those of message_uids
+        # that haven't changed since modseq.
+        with stage_seconds.time('claim'):
+            typ, data = self._imap_cxn.uid('store', uidSetString(message_uids),
+                                           '(UNCHANGEDSINCE %d) %s' % (modseq, action),
+                                           '(%s)' % ' '.join(sorted(keywords)))
+        self.checkIMAPResponse(typ, data)
+    
+    def claimMessageUIDs(self, message_uids):
+        # Returns those of message_uids, and of the messages we're keeping
+        # an eye on from earlier cycles, that are ours to handle now: the
+        # ones we claimed before and still hold, and whichever others we
+        # manage to claim.
+        candidates = sorted(set(message_uids) | self._claim_backlog | set(self._claim_watch),
+                            key = int)
+        if not candidates:
+            return []
         
-        message_id = self.msgId(message_uid)
-        debug('Moving message %s to %s' % (message_id, destination_folder))
+        if self._selected_folder != self._mailbox.incoming_folder:
+            self.selectFolder(self._mailbox.incoming_folder)
+            
+        claims = self.fetchClaims(candidates)
+        now = time.monotonic()
+        
+        mine = []
+        unclaimed = []
+        watch = {}
+        
+        for message_uid in candidates:
+            if message_uid not in claims:
+                # Gone, so someone has dealt with it.
+                continue
+            
+            modseq, keywords = claims[message_uid]
+            if not keywords:
+                unclaimed.append(message_uid)
+            elif self._claim_keyword in keywords:
+                mine.append(message_uid)
+            else:
+                seen = self._claim_watch.get(message_uid)
+                if seen is not None and seen[:2] == (modseq, keywords):
+                    watch[message_uid] = seen
+                else:
+                    watch[message_uid] = (modseq, keywords, now)
+                    
+        backlog = set()
+        
+        # Release claims that have lapsed; they can be claimed next cycle,
+        # by us or by someone quicker.
+        for message_uid, (modseq, keywords, first_seen) in list(watch.items()):
+            if now - first_seen >= self.claim_lease_seconds:
+                info("Claim on message %s by %s has lapsed - releasing it."
+                     % (self.msgId(message_uid), ', '.join(sorted(keywords))))
+                self.storeIfUnchanged([message_uid], modseq, '-FLAGS', keywords)
+                claims_total.inc('released')
+                del watch[message_uid]
+                backlog.add(message_uid)
+        
+        # Go for the unclaimed messages in a different order from the other
+        # workers, so we mostly don't get in each other's way.
+        random.shuffle(unclaimed)
+        attempts = unclaimed[:self.claim_batch_size]
+        backlog.update(unclaimed[self.claim_batch_size:])
+        
+        by_modseq = {}
+        for message_uid in attempts:
+            by_modseq.setdefault(claims[message_uid][0], []).append(message_uid)
+            
+        for modseq, group_uids in by_modseq.items():
+            self.storeIfUnchanged(group_uids, modseq, '+FLAGS', [self._claim_keyword])
+            
+        # Those that weren't changed by anyone else in the meantime now
+        # have our keyword; the rest we look at again next cycle.
+        claimed = []
+        if attempts:
+            after = self.fetchClaims(sorted(attempts, key = int))
+            for message_uid, (modseq, keywords) in after.items():
+                if self._claim_keyword in keywords:
+                    claimed.append(message_uid)
+                    claims_total.inc('claimed')
+                else:
+                    backlog.add(message_uid)
+                    claims_total.inc('lost')
+                    
+        self._claim_backlog = backlog
+        self._claim_watch = watch
+        
+        # Anything we were going to try again but no longer hold is
+        # someone else's now.
+        ours = set(mine) | set(claimed)
+        self._unfinished_uids -= set(candidates) - ours
+        
+        debug("Claims: %d held, %d claimed, %d left unclaimed, %d held by others"
+              % (len(mine), len(claimed), len(backlog), len(watch)))
+        
+        return sorted(ours, key = int)
+    
+    def _claimWaitLimit(self):
+        # How long we can wait for new mail before there's claiming to do:
+        # not at all if unclaimed messages are left over, otherwise until
+        # the first of the claims we're watching would lapse. None if
+        # there's nothing to wait for.
+        if self._claim_backlog:
+            return 0
+        if self._claim_watch:
+            first_seen = min(seen for _, _, seen in self._claim_watch.values())
+            return max(first_seen + self.claim_lease_seconds - time.monotonic(), 1)
+        return None
+    
+    def fetchMessageUIDsAsBytes(self, message_uids):
+        
+        # Fetch the messages a chunk at a time, one command per chunk, and
+        # hand each one back as (uid, bytes) as we pull it out of the
+        # response. BODY.PEEK[] gets the same bytes as RFC822 but doesn't
+        # set \Seen, so messages we fail on are left as we found them.
+        for i in range(0, len(message_uids), self.fetch_chunk_size):
+            chunk = message_uids[i:i + self.fetch_chunk_size]
+            uid_set = uidSetString(chunk)
+            
+            try:
+                with self._imap_lock, stage_seconds.time('fetch'):
+                    typ, data = self._imap_cxn.uid('fetch', uid_set, '(BODY.PEEK[])')
+                self.checkIMAPResponse(typ, data)
+                
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error fetching messages %s - skipping." % uid_set)
+                errors_total.inc('fetch')
+                continue
+            
+            # Each message comes back as a (envelope, literal) tuple,
+            # followed by a closing b')'. The server may answer in any
+            # order, so take the UID from the envelope rather than
+            # assuming it matches the order we asked in.
+            for item in data:
+                if not isinstance(item, tuple):
+                    continue
+                
+                envelope, message_bytes = item
+                match = self.fetch_uid_prog.search(envelope)
+                if match is None:
+                    continue
+                
+                yield match.group(1), message_bytes
+    
+    def classifyMessageUIDs(self, message_uids):
+        
+        # Sort messages into those that might need remailing, which have to
+        # be fetched in full, and those that certainly don't, which can be
+        # moved to the no-tag folder without ever being downloaded. We look
+        # at the BODYSTRUCTURE first, then fetch and scan only the text
+        # parts. Anything we can't make sense of is treated as possibly
+        # tagged, so the worst we do is fetch a message we didn't need to.
+        # Returns (tagged_uids, notag_uids).
+        tagged_uids = []
+        notag_uids = []
+        
+        for i in range(0, len(message_uids), self.fetch_chunk_size):
+            chunk = message_uids[i:i + self.fetch_chunk_size]
+            
+            try:
+                with stage_seconds.time('classify'):
+                    typ, data = self._imap_cxn.uid('fetch', uidSetString(chunk),
+                                                   '(BODYSTRUCTURE)')
+                self.checkIMAPResponse(typ, data)
+                structures = parseFetchResponse(data)
+                
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error fetching message structure - fetching messages in full.")
+                errors_total.inc('classify')
+                tagged_uids.extend(chunk)
+                continue
+            
+            sections_by_uid, uids_by_sections, multipart_uids = \
+                self.groupByTextSections(chunk, structures)
+                
+            for message_uid in chunk:
+                if message_uid not in sections_by_uid:
+                    tagged_uids.append(message_uid)
+                
+            for section_names, group_uids in uids_by_sections.items():
+                
+                # No text at all means nothing to scan.
+                if len(section_names) == 0:
+                    notag_uids.extend(group_uids)
+                    continue
+                
+                items = ' '.join('BODY.PEEK[%s]' % section for section in section_names)
+                
+                try:
+                    with stage_seconds.time('classify'):
+                        typ, data = self._imap_cxn.uid('fetch', uidSetString(group_uids),
+                                                       '(%s)' % items)
+                    self.checkIMAPResponse(typ, data)
+                    
+                    messages = {}
+                    for message in parseFetchResponse(data):
+                        messages[message.get(b'UID')] = message
+                    
+                except Exception as e:
+                    traceback.print_tb(e.__traceback__)
+                    print("*** Error fetching message text - fetching messages in full.")
+                    errors_total.inc('classify')
+                    tagged_uids.extend(group_uids)
+                    continue
+                
+                self.sortTextSections(group_uids, sections_by_uid, multipart_uids,
+                                      messages, tagged_uids, notag_uids)
+                
+        return self.inInboxOrder(message_uids, tagged_uids, notag_uids)
+    
+    def moveMessageUIDSet(self, uid_set, destination_folder):
+        
+        debug('Moving messages %s to %s' % (uid_set, destination_folder))
     
         # If our IMAP server supports the MOVE command, then we simply
         # call it directly. If not, we do it the hard way.
         if self._imap_has_move:
-            typ, [response] = self._imap_cxn.uid('move', message_uid, destination_folder)
+            typ, [response] = self._imap_cxn.uid('move', uid_set, destination_folder)
+            self.checkIMAPResponse(typ, response)
 
         else:
-            # Here's the hard way: copy the message to the folder...
-            typ, [response] = self._imap_cxn.uid('copy', message_uid, destination_folder)
+            # Here's the hard way: copy the messages to the folder...
+            typ, [response] = self._imap_cxn.uid('copy', uid_set, destination_folder)
             self.checkIMAPResponse(typ, response)
              
-            # ...then delete the original.
-            typ, [response] = self._imap_cxn.uid('store', message_uid, '+FLAGS', r'(\Deleted)')
+            # ...then delete the originals.
+            typ, [response] = self._imap_cxn.uid('store', uid_set, '+FLAGS.SILENT', r'(\Deleted)')
             self.checkIMAPResponse(typ, response)
             
-    
-    http_url_regex = 'https://ei194.infusion-links.com/[a-zA-Z0-9/]+'
-    http_url_prog = re.compile(http_url_regex)
+            # With UIDPLUS we can expunge just these messages right away.
+            # Without it they wait for the expunge at shutdown;
+            # getAllFolderUIDs skips them in the meantime.
+            if self._imap_has_uidplus:
+                typ, [response] = self._imap_cxn.uid('expunge', uid_set)
+                self.checkIMAPResponse(typ, response)
                 
-    def remapURLs(self, message_part_str):
+    def flushMessageMoves(self):
         
-        # See if there is an infusionlinks URL
-        match = self.http_url_prog.search(message_part_str)
+        # Do all the queued moves and return the set of UIDs that were
+        # moved. A folder whose move fails is reported, and its messages
+        # are left in the inbox to be tried again with the next new mail
+        # or after unfinished_retry_interval.
+        moved_uids = set()
         
-        while match is not None:
-            matched_url = match.group(0)
-            # print()
-            # print("  Found infusionlinks url <%s>" % matched_url)
-            
-            mapped_url = get_redirect_for(matched_url)
+        for destination_folder, message_uids in self._pending_moves.items():
+            uid_set = uidSetString(message_uids)
             
-            message_part_str = macro_substitute(message_part_str, match, mapped_url)
+            try:
+                with self._imap_lock, stage_seconds.time('move'):
+                    self.moveMessageUIDSet(uid_set, destination_folder)
+                moved_uids.update(message_uids)
+                self._unfinished_uids.difference_update(message_uids)
+                
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error moving messages %s to %s - skipping."
+                      % (uid_set, destination_folder))
+                errors_total.inc('move')
+                
+        self._pending_moves = {}
         
-            # Find the next infusionlinks URL
-            match = self.http_url_prog.search(message_part_str)
-            
-        return message_part_str
+        return moved_uids
     
-    tracking_pixel_url_regex = "https://is-tracking-pixel-api-prod.appspot.com/[a-zA-Z0-9/]+"
-    tracking_pixel_url_prog = re.compile(tracking_pixel_url_regex)
+    def archiveRemailMessage(self, outgoing_message):
+        
+        # Save the base message to IMAP so it can easily be resent
+        # later.
+        now = Time2Internaldate(time.time())
+        
+        with self._imap_lock, stage_seconds.time('append'):
+            typ, data = self._imap_cxn.append(self._mailbox.sent_folder, '', now,
+                                              outgoing_message.message_bytes)
     
-    def suppressTrackingPixels(self, message_part_str):
+    def sendRemailMessage(self, outgoing_message, recipients):
         
-        # See if there is an infusionlinks URL
-        match = self.tracking_pixel_url_prog.search(message_part_str)
+        # outgoing_message now contains the base message, which we
+        # send to all of the recipients at once.
+
+        # We're about to send an email. If it's the first email
+        # for this iteration, then we need to get the SMTP server
+        # ready, which reuses the connection from last time if it's
+        # still good.
+        if self._first_send_this_iteration:
+            debug("Readying SMTP service.")
+            self._smtp_service.readyService()
+            self._first_send_this_iteration = False
         
-        while match is not None:
-            matched_url = match.group(0)
-            # print()
-            # print("  Found tracking pixel url <%s>" % matched_url)
-            
-            # Delete the URL.
-            message_part_str = macro_substitute(message_part_str, match, "")
+        # Send the email to all its recipients in as few transactions as
+        # the server's recipient limit allows.
+        refused = deliverToRecipients(self._smtp_service, self._mailbox.global_from_addr,
+                                      recipients, outgoing_message,
+                                      self.max_recipients_per_transaction)
         
-            # Find the next tracking pixel URL
-            match = self.tracking_pixel_url_prog.search(message_part_str)
-            
-        return message_part_str
+        self.reportRefusedRecipients(refused)
     
-    mime_pattern = "([a-z]+)/([a-z]+)"
-    mime_prog = re.compile(mime_pattern)
+    def spoolSource(self, message_uid):
+        # Where a spooled message came from, in the form of the path of an
+        # IMAP URL (RFC 5092), so that it can be found again after a
+        # restart.
+        folder = self._mailbox.incoming_folder
+        return '%s;UIDVALIDITY=%d/;UID=%s' % (folder,
+                                              self._folder_sync[folder]['UIDVALIDITY'],
+                                              message_uid.decode())
     
-    def typeAndSubtype(self, mime_type_str):
-        match = self.mime_prog.match(mime_type_str)
-        if match is not None:
-            main_type = match.group(1)
-            sub_type = match.group(2)
-            return main_type, sub_type
-        return "", mim_type_str
+    spool_source_prog = re.compile(r'(.*);UIDVALIDITY=(\d+)/;UID=(\d+)$')
     
-    delete_html_parts = True
+    def spoolPendingMessages(self, outgoing):
+        # Once its original has been moved out of the inbox, the spool is
+        # all there is to say a message still has to be sent, so it goes
+        # in first, held until the move is done. Returns {uid: spool
+        # message id}. A message we couldn't spool is taken off the move
+        # list, leaving it in the inbox to be tried again.
+        held = {}
+        
+        for message_uid, outgoing_message, remail_addresses_set in outgoing:
+            try:
+                held[message_uid] = self._spool.enqueue(self._mailbox.global_from_addr,
+                                                        sorted(remail_addresses_set),
+                                                        outgoing_message.message_bytes,
+                                                        self.spoolSource(message_uid),
+                                                        held = True)
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error spooling message %s - leaving it in the inbox."
+                      % self.msgId(message_uid))
+                errors_total.inc('spool')
+                self._pending_moves[self._mailbox.original_folder].remove(message_uid)
+                
+        return held
     
-    def performSubstitutionOnMessageParts(self, obj):
+    def recoverHeldMessages(self):
+        # Call at startup, to sort out messages left held in the spool by
+        # a cycle that stopped between spooling them and moving their
+        # originals. One whose original has gone from the inbox was moved,
+        # and is let go; one whose original is still there will be handled
+        # again, so is dropped. If we can't tell, because the inbox's
+        # UIDVALIDITY has changed, its recipients are marked uncertain.
+        held = self._spool.held()
+        if not held:
+            return
         
-        remail_addresses_set = set()
+        folder = self._mailbox.incoming_folder
+        uidvalidity = self.folderStatus(folder)['UIDVALIDITY']
+        held_uids = {}
+        unknown = []
         
-        # Loop over all the message parts.
-        for part in obj.walk():
-            
-            content_type = part.get_content_type()
-            content_charset = part.get_content_charset()
-            content_disposition = part.get_content_disposition()
+        for message_id, source in held:
+            match = self.spool_source_prog.match(source or '')
+            if match is not None and match.group(1) == folder and \
+                    int(match.group(2)) == uidvalidity:
+                held_uids[message_id] = match.group(3).encode()
+            else:
+                unknown.append(message_id)
+        
+        present = set()
+        if held_uids:
+            self.selectFolder(folder)
+            typ, response = self._imap_cxn.uid('search', None, 'UID',
+                                               uidSetString(held_uids.values()),
+                                               'UNDELETED')
+            self.checkIMAPResponse(typ, response)
+            present = set(response[0].split())
+        
+        moved = [message_id for message_id, uid in held_uids.items() if uid not in present]
+        self._spool.release(moved)
+        self._spool.discard([message_id for message_id, uid in held_uids.items()
+                             if uid in present])
+        self._spool.markHeldUncertain(unknown)
+        
+        info("Recovered held messages from the spool: %d released, %d dropped, %d uncertain"
+             % (len(moved), len(held_uids) - len(moved), len(unknown)))
+    
+    def sendPendingMessages(self, outgoing):
+        
+        held = {}
+        if self._spool is not None:
+            held = self.spoolPendingMessages(outgoing)
+        
+        # Move the originals out of the inbox before sending anything. If
+        # the move of a message didn't happen, sending it now would mean
+        # sending it again next time around, so we leave it for then.
+        moved_uids = self.flushMessageMoves()
+        
+        if held:
+            self._spool.release([message_id for message_uid, message_id in held.items()
+                                 if message_uid in moved_uids])
+            self._spool.discard([message_id for message_uid, message_id in held.items()
+                                 if message_uid not in moved_uids])
+        
+        # With a delivery pool, the sends are handed off as we go and we
+        # collect the outcomes at the end, as (uid, future).
+        pool_jobs = []
+        
+        for message_uid, outgoing_message, remail_addresses_set in outgoing:
+            if message_uid not in moved_uids:
+                print("*** Message %s was not moved - not sending."
+                      % self.msgId(message_uid))
+                continue
             
-            # Spit out some diagnostic messages.
-            debug("Content-Type: %s" % content_type)
-            debug("Content-Charset: %s" % content_charset)
-            debug("Content-Disposition: %s" % content_disposition)
-            
-            # Multipart parts are basically containers, so we don't process
-            # them. But we process all others.
-            if not part.is_multipart():
-                main_type, sub_type = self.typeAndSubtype(content_type)
-                
-                # Optional configuration: just delete all HTML parts because
-                # something in them is causing emails to get filed as SPAM.
-                if self.delete_html_parts and sub_type == "html":
-                    pl = obj.get_payload()
-                    pl.remove(part)
-                    
-                    # This part has been deleted - no further processing
-                    # needed for this part.
+            try:
+                self.archiveRemailMessage(outgoing_message)
+                
+                recipients = sorted(remail_addresses_set)
+                info("%s message %s to %s" % ("Spooled" if self._spool is not None else "Sending",
+                                              self.msgId(message_uid),
+                                              ', '.join('<%s>' % r for r in recipients)))
+                
+                # A spooled message was let go for delivery above.
+                if self._spool is not None:
                     continue
-                    
-                debug("main_type = <%s>, sub_type = <%s>" % (main_type, sub_type))
                 
-                # Get the message_part_str of this part of the message.
-                # If this part of the message was encoded in (possibly)
-                # MIME quoted-printable, it will be decoded into a string
-                # in (proabably) UTF-8 unicode. (Which is good, because
-                # it's easier to deal with in this form.)
-                message_part_str = part.get_content()
+                if self._delivery_pool is not None:
+                    future = self._delivery_pool.submit(self._mailbox.global_from_addr,
+                                                        recipients, outgoing_message)
+                    pool_jobs.append((message_uid, future))
+                else:
+                    self.sendRemailMessage(outgoing_message, recipients)
+                
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error sending message - skipping.")
+                errors_total.inc('send')
                 
-                # Now some real processing...
+        for message_uid, future in pool_jobs:
+            try:
+                self.reportRefusedRecipients(future.result())
                 
-                maybe_modified_content_str = scanPartForTruncateTags(message_part_str)
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error sending message %s - skipping."
+                      % self.msgId(message_uid))
+                errors_total.inc('send')
                 
-                # Scan the part for remail-to: tags, replace them,
-                # and accumulate the recipient addresses.
-                maybe_modified_content_str, more_remail_addresses_set = \
-                    scanPartForRemailTags(maybe_modified_content_str)
-                    
-                # Get the union of the two sets.
-                remail_addresses_set |= more_remail_addresses_set
-                
-                # # Now perform mapping of any infusion-link URLs to their
-                # # direct link conterparts.
-                # maybe_modified_content_str = self.remapURLs(maybe_modified_content_str)
-                #
-                # # Finally, nuke any tracking pixel URLs
-                # maybe_modified_content_str = self.suppressTrackingPixels(maybe_modified_content_str)
-
-                # If any of these steps have modified the content of this
-                # part of the message, then replace that part of the
-                # message object.                
-                if maybe_modified_content_str != message_part_str:
+        outgoing.clear()
+ 
+    def processMessagesSerially(self, message_uids, outgoing):
+        
+        # Loop through all the messages in the inbox that may need
+        # remailing, fetching them in batches as we go.
+        for message_uid, message_bytes in self.fetchMessageUIDsAsBytes(message_uids):
+            
+            # Wrap this processing in a try block so
+            # that if a message fails we may still be
+            # able to process others.
+            try:
+                remail_addresses_set, outgoing_message = \
+                    self.transformMessage(message_uid, message_bytes)
+                self.queueRemail(message_uid, remail_addresses_set,
+                                 outgoing_message, outgoing)
                     
-                    part.set_content(maybe_modified_content_str, subtype = sub_type,
-                                        charset = content_charset,
-                                        disposition = content_disposition)
-
-        # Return any remail-to addresses we found. (It's not
-        # to return the message object. It's passed by reference,
-        # and the caller's reference will retain any changes
-        # we've made here.)
-        return remail_addresses_set
+            except Exception as e:
+                self.reportMessageError(message_uid, message_bytes, e)
+                
+            # Don't hold on to too many messages during a big backlog.
+            if len(outgoing) >= self.fetch_chunk_size:
+                self.sendPendingMessages(outgoing)
+                
+    # Optional configuration: run fetching, transforming and
+    # archiving/delivery as overlapping stages, with this many transform
+    # threads and at most this many messages queued between stages. With
+    # no transform threads, messages are handled one after another.
+    pipeline_transform_workers = 0
+    pipeline_queue_size = 16
     
-    from email.policy import default
-    MHTMLPolicy = default.clone(linesep='\r\n', max_line_length=0)
+    def processMessagesPipelined(self, message_uids, outgoing):
+        
+        # Three stages joined by bounded queues: a thread fetching
+        # messages, a pool of threads transforming them, and this thread
+        # moving, archiving and sending them. A full queue holds up the
+        # stage feeding it, so no stage gets far ahead of the others. Only
+        # this thread moves and sends, so a message is still never sent
+        # before its original has been moved.
+        fetched = queue.Queue(self.pipeline_queue_size)
+        transformed = queue.Queue(self.pipeline_queue_size)
+        worker_count = self.pipeline_transform_workers
+        
+        queue_length.setFunction(fetched.qsize, 'pipeline_fetched')
+        queue_length.setFunction(transformed.qsize, 'pipeline_transformed')
+        
+        def fetchStage():
+            try:
+                for item in self.fetchMessageUIDsAsBytes(message_uids):
+                    fetched.put(item)
+                    
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error fetching messages - skipping the rest.")
+                errors_total.inc('fetch')
+                
+            finally:
+                # One end marker for each transform thread.
+                for _ in range(worker_count):
+                    fetched.put(None)
+                    
+        def transformStage():
+            while True:
+                item = fetched.get()
+                if item is None:
+                    transformed.put(None)
+                    return
+                
+                message_uid, message_bytes = item
+                try:
+                    remail_addresses_set, outgoing_message = \
+                        self.transformMessage(message_uid, message_bytes)
+                    
+                except Exception as e:
+                    self.reportMessageError(message_uid, message_bytes, e)
+                    continue
+                
+                transformed.put((message_uid, remail_addresses_set, outgoing_message))
+                
+        threads = [ threading.Thread(target = fetchStage, name = 'fetch', daemon = True) ]
+        for i in range(worker_count):
+            threads.append(threading.Thread(target = transformStage,
+                                            name = 'transform-%d' % i, daemon = True))
+        for thread in threads:
+            thread.start()
+            
+        finished_workers = 0
+        
+        while finished_workers < worker_count:
+            try:
+                item = transformed.get_nowait()
+                
+            except queue.Empty:
+                # Nothing ready yet, so use the lull to get the moves and
+                # sends we have so far out of the way.
+                if outgoing or self._pending_moves:
+                    self.sendPendingMessages(outgoing)
+                item = transformed.get()
+                
+            if item is None:
+                finished_workers += 1
+                continue
+            
+            message_uid, remail_addresses_set, outgoing_message = item
+            self.queueRemail(message_uid, remail_addresses_set, outgoing_message, outgoing)
+            
+            if len(outgoing) >= self.fetch_chunk_size:
+                self.sendPendingMessages(outgoing)
+                
+        for thread in threads:
+            thread.join()
  
     def doThemAll(self):
-        first_send_this_iteration = True
+        self._first_send_this_iteration = True
         
-        # Get the UIDs of all the messages in our Inbox and compute
-        # the number of messages, which we key off of for some
+        # Get the UIDs of the messages in our Inbox that need looking at
+        # and compute the number of them, which we key off of for some
         # info messages and housekeeping.
-        message_uids = self.getAllFolderUIDs(incoming_folder)
+        message_uids, folder_count = self.getNewFolderUIDs(self._mailbox.incoming_folder)
+        
+        # Sharing the folder with other workers, only what we claim is ours.
+        if self._claim_keyword is not None:
+            message_uids = self.claimMessageUIDs(message_uids)
+            
         message_count = len(message_uids)
+        inbox_messages.set(folder_count)
+        self._inbox_message_count = folder_count
+        self._cycle_count += 1
+        
+        # Everything is unfinished until it's been moved.
+        self._unfinished_uids.update(message_uids)
+        if message_count > 0:
+            self._unfinished_retry_at = time.monotonic() + self.unfinished_retry_interval
         
         # Report the number of messages in the Inbox.
-        mc_suffix = "" if message_count == 1 else "s"
-        info("%d message%s in %s, Uptime: %s, IMAP uptime: %s, reconnect count: %d" 
-             %(message_count, mc_suffix, incoming_folder,
+        mc_suffix = "" if folder_count == 1 else "s"
+        info("%d message%s in %s (%d new), Uptime: %s, IMAP uptime: %s, reconnect count: %d" 
+             %(folder_count, mc_suffix, self._mailbox.incoming_folder, message_count,
                self._uptimeStr(), self._imapupStr(),
                self._imap_reconnect_count))
         
         if message_count > 0:
             print('################################################################################')
         
-        # Loop through all the messages in the inbox.
-        for message_uid in message_uids:
-            
-            # Wrap this processing in a try block so
-            # that if a message fails we may still be
-            # able to process others.
-            try:
-                        
-                message_bytes = self.fetchMessageUIDAsBytes(message_uid)
-    
-                # Emit some messages to show progress.
-                print()
-                info("Message %s" % self.msgId(message_uid))
-                showMessageSubject(message_bytes)
-                                
-                message_obj = messageBytesAsObject(message_bytes)
-                
-                remail_addresses_set = self.performSubstitutionOnMessageParts(message_obj)
-                
-                remail_count = len(remail_addresses_set)
-                if remail_count > 0:
-                    rm_suffix = "" if remail_count == 1 else "es"
-                    info("Found %d remail address%s" % (remail_count, rm_suffix))
-                    
-                    # We found at least one valid remail-to tag, so the original
-                    # message should be move to the originals folder.
-                    self.moveMessageUID(message_uid, original_folder)
-                    
-                    # The message in message_bytes has already had its body
-                    # modified (remail-to tags removed, infusionlinks URLs
-                    # replaced, tracking pixel URLs deleted). Now we modify
-                    # the headers to make the message look like a brand new
-                    # message, not something that's been bounced around the
-                    # Internet already.
-                    mutateHeaders(message_obj, global_from_addr)
-                    
-                    # Construct a single To: header with all of the email
-                    # addresses in it.
-                    to_header_str = ', '.join(remail_addresses_set)
-                    message_obj.add_header("To", to_header_str)
-                    
-                    # debug("Base message headers:")
-                    # dumpHeaders(message_obj)
-                    
-                    # Save the base message to IMAP so it can easily be resent
-                    # later.
-                    now = Time2Internaldate(time.time())
-                    message_bytes = self._smtp_service.message_bytes(message_obj)
-                    typ, data = self._imap_cxn.append(sent_folder, '', now, message_bytes)
-                    
-                    # message_obj now contains the base message, which we
-                    # send to each of the recipients in turn.
-
-                    # We're about to send an email. If it's the first email
-                    # for this iteration, then we need to get the SMTP server
-                    # ready.                    
-                    if first_send_this_iteration:
-                        debug("Readying SMTP service.")
-                        self._smtp_service.readyService()
-                    
-                    # Send the email to each of its recipients.
-                    for recipient_address in remail_addresses_set:
-                        info("Sending to <%s>" % recipient_address)
-                        self._smtp_service.send_message(global_from_addr,
-                                                        recipient_address,
-                                                        message_obj)
+        # Remailed messages waiting for their originals to be moved
+        # before they are sent, as (uid, outgoing message, addresses).
+        outgoing = []
+        
+        # Messages without any remail tags go straight to the no-tag
+        # folder; only the rest get downloaded.
+        tagged_uids, notag_uids = self.classifyMessageUIDs(message_uids)
+        
+        for message_uid in notag_uids:
+            info("Message %s has no remail addresses - moving to no-tag folder."
+                 % self.msgId(message_uid))
+            self.moveMessageUID(message_uid, self._mailbox.notag_folder)
+            messages_total.inc('notag')
+        
+        if self.pipeline_transform_workers > 0:
+            self.processMessagesPipelined(tagged_uids, outgoing)
+        else:
+            self.processMessagesSerially(tagged_uids, outgoing)
                 
-                else:
-                    # No addresses to remail to - move the original message to the
-                    # original-notag folder
-                    debug("No remail addresses! Moving to no-tag folder.")
-                    self.moveMessageUID(message_uid, notag_folder)
-                    
-            except Exception as e:
-                traceback.print_tb(e.__traceback__)
-                print("*** Error processing message - skipping.")
+        # Do whatever moves and sends are left over.
+        self.sendPendingMessages(outgoing)
                 
         # If we had some messages to process, then do some cleanup...
         if message_count > 0:
             
-            # Close the connection to the SMTP server. SMTP servers don't
-            # like it when connections to them remain open too long, so
-            # we close the connection. This call is harmless if the connection
-            # was never opened.
-            debug("Terminating SMTP service.")
-            self._smtp_service.terminateService()
+            # The connection to the SMTP server stays open for the next
+            # cycle; it's closed once it has been idle for a while (see
+            # runMailbox) or has sent enough.
+            if self._smtp_service.handshakes:
+                info(self._smtp_service.statsString())
+
+            if self._delivery_pool is not None:
+                info(self._delivery_pool.statsString())
+                
+            if self._spool is not None:
+                info(self._spool.statsString())
+                
+            if self._redirect_resolver is not None:
+                info(self._redirect_cache.statsString())
+                info(self._redirect_resolver.statsString())
+                
+            if self._url_rewriter is not None and self._url_rewriter.hits:
+                info(self._url_rewriter.statsString())
 
             info('*** Done ***')
             
+        return message_count
+            
     def testIMAPConnection(self):
         
         self._imap_cxn.noop()
+        
+    def idleUntilNewMail(self, timeout):
+        # See imap_idle.py for what happens to the connection if this fails.
+        return idleUntilNewMail(self._imap_cxn, timeout)
+    
+    # Block until there may be new mail in the incoming folder. Uses IDLE
+    # if the server supports it, otherwise polls with an interval that
+    # shortens while mail is arriving and backs off while the inbox stays
+    # empty.
+    def waitForNewMail(self, last_message_count):
+        limit = self._claimWaitLimit()
+        if limit == 0:
+            return
+        
+        # Wake up in time to close the SMTP connection if it's left idle,
+        # and to retry any messages we couldn't finish.
+        smtp_limit = self._smtp_service.idleTimeLeft()
+        if smtp_limit is not None:
+            limit = smtp_limit if limit is None else min(limit, smtp_limit)
+        
+        if self._unfinished_uids:
+            retry_limit = max(self._unfinished_retry_at - time.monotonic(), 1)
+            limit = retry_limit if limit is None else min(limit, retry_limit)
+        
+        if self._imap_has_idle:
+            # Make sure we're idling on the right folder.
+            if self._selected_folder != self._mailbox.incoming_folder:
+                self.selectFolder(self._mailbox.incoming_folder)
             
-if __name__ == '__main__':
+            # If mail arrived after doThemAll looked at the folder, the
+            # server won't tell us about it again while idling, so
+            # don't wait.
+            self.pollSelectedFolder()
+            if self._new_mail_reported:
+                return
+            
+            debug("Idling on %s" % self._mailbox.incoming_folder)
+            self.idleUntilNewMail(self.idle_timeout if limit is None
+                                  else min(self.idle_timeout, limit))
+            return
+        
+        if last_message_count > 0:
+            self._poll_interval = self.min_poll_interval
+        else:
+            self._poll_interval = min(self._poll_interval * 2,
+                                      self.max_poll_interval)
+        
+        debug("Polling again in %ds" % self._poll_interval)
+        sleep(self._poll_interval if limit is None else min(self._poll_interval, limit))
+            
+def runMailbox(mailbox, report_status = None):
+    # Serve mailbox (a MailboxConfig) until something goes wrong that we
+    # can't get over. If report_status is given, it's called with
+    # Remailer.status() after each cycle.
+    
     # Set up logging
-    logging.basicConfig(filename = 'remailer.log',
+    logging.basicConfig(filename = mailbox.log_file,
                         format = '%(asctime)s:%(levelname)s:%(message)s',
                         level = logging.DEBUG)
     
     logging.info("-----------------------------------------------------------")
-    info("initializing...")
+    info("initializing %s..." % mailbox.name)
     
-    # Set up the timers
-    uptime_timer = Timer()
+    if mailbox.metrics_port is not None:
+        startMetricsServer(mailbox.metrics_port)
+        
+    profiler = CycleProfiler(mailbox.profile_dir, mailbox.profile_control_file)
+    profiler.installSignalHandlers()
     
     # Set up the IMAP server connection
-    imap_creds = RemailerBotCreds()
+    imap_creds = mailbox.imapCreds()
     
-    imap_service = { "server_addr": "imap.gmail.com",
-                     "port": 993 }
-
     imap_interface = IMAPInterface()
-    imap_interface.readyService(imap_service, imap_creds)
+    imap_interface.readyService(mailbox.imap_service, imap_creds)
     
     imap_cxn = imap_interface.getServer()
     
     # Set up the SMTP server connection
-    smtp_creds = SMTPCreds()
+    smtp_creds = mailbox.smtpCreds()
+    
+    # Every connection, ours and the delivery pool's, is kept open
+    # between cycles within the mailbox's limits.
+    def makeSMTPSession():
+        return SMTPSession(mailbox.smtp_service, smtp_creds,
+                           max_idle = mailbox.smtp_max_idle,
+                           max_messages = mailbox.smtp_max_messages)
+    
+    smtp_interface = makeSMTPSession()
     
-    smtp_service = { "server_addr": "smtp.domain.com",
-                      "port": 587,
-                      'local_hostname': 'delligattiassociates.com' }
+    delivery_pool = None
+    if mailbox.smtp_pool_size > 0 or mailbox.spool_path is not None:
+        delivery_pool = SMTPDeliveryPool(makeSMTPSession,
+                                         size = max(mailbox.smtp_pool_size, 1),
+                                         max_recipients = Remailer.max_recipients_per_transaction)
     
-    smtp_interface = SMTPInterface(smtp_service, smtp_creds)
-    # smtp_interface.readyService()
+    # Set up the spool and start delivering anything left in it from
+    # last time.
+    spool = None
+    spool_worker = None
+    if mailbox.spool_path is not None:
+        spool = DeliverySpool(mailbox.spool_path)
+        spool_worker = DeliveryWorker(spool, delivery_pool,
+                                      max_recipients = Remailer.max_recipients_per_transaction)
+        spool_worker.start()
     
-    remailer = Remailer(imap_cxn, smtp_interface)
+    remailer = Remailer(imap_cxn, smtp_interface, delivery_pool, spool, mailbox)
     
     remailer.validateFolderStructure()
+    
+    if spool is not None:
+        remailer.recoverHeldMessages()
 
     try:
         while True:
-            remailer.doThemAll()  
-            sleep(60)
+            with profiler.cycle():
+                message_count = remailer.doThemAll()
+                
+            if report_status is not None:
+                report_status(remailer.status())
+            
+            try:
+                remailer.waitForNewMail(message_count)
+                
+            except Exception as e:
+                # Most likely the connection dropped while idling; the
+                # NOOP below will notice and reconnect.
+                print("*** Error waiting for new mail: %s" % e)
+                errors_total.inc('idle')
+                sleep(Remailer.min_poll_interval)
+            
+            smtp_interface.closeIfIdle()
             
             try:
                 remailer.testIMAPConnection()
@@ -459,7 +1630,7 @@ if __name__ == '__main__':
                 print("IMAP connection failed NOOP... re-establishing connection.")
                 
                 imap_interface = IMAPInterface()
-                imap_interface.readyService(imap_service, imap_creds)
+                imap_interface.readyService(mailbox.imap_service, imap_creds)
                 imap_cxn = imap_interface.getServer()
     
                 remailer.setIMAPConnction(imap_cxn)
@@ -471,9 +1642,42 @@ if __name__ == '__main__':
         # operations don't need to have their results checked because we
         # don't much care if they succeed or fail.
         
+        # Let any sends in progress finish and close the SMTP connections.
+        # Whatever is still in the spool goes out next time we start.
+        if spool_worker is not None:
+            spool_worker.stop()
+            
+        if delivery_pool is not None:
+            delivery_pool.shutdown()
+        
+        smtp_interface.terminateService()
+        
         # Expunge any messages we deleted.
         imap_cxn.expunge()
  
         # Close the context and log out.
         imap_cxn.close()
         imap_cxn.logout()
+
+def mailboxFromArgs(args):
+    # The mailbox named on the command line: a config file (see
+    # mailbox_config.py) and, if it lists more than one, the name of the
+    # one to serve. With no arguments, the default mailbox.
+    if not args:
+        return MailboxConfig()
+    
+    mailboxes, supervisor_settings = loadConfig(args[0])
+    if len(args) > 1:
+        for mailbox in mailboxes:
+            if mailbox.name == args[1]:
+                return mailbox
+        raise ValueError("No mailbox %s in %s" % (args[1], args[0]))
+    
+    if len(mailboxes) != 1:
+        raise ValueError("%s lists %d mailboxes; say which one to serve, or run "
+                         "supervisor.py to serve them all" % (args[0], len(mailboxes)))
+    return mailboxes[0]
+
+if __name__ == '__main__':
+    # python remailer.py [config.json [mailbox name]]
+    runMailbox(mailboxFromArgs(sys.argv[1:]))
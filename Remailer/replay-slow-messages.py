@@ -0,0 +1,116 @@
+'''
+Created on Oct 18, 2026
+
+Replays messages the remailer saved for being slow (see slow_message_dir in
+mailbox_config.py) through parsing and substitution, offline, and compares how
+long each stage takes now with what was recorded at the time. With
+--profile, the replays run under cProfile and the busiest functions are
+printed, or saved with --save-profile.
+
+    python replay-slow-messages.py remailer-slow-messages --repeat 5 --profile
+
+URL rewriting is done as the Remailer class is configured, so redirect
+lookups go out over the network just as they did in the remailer.
+'''
+
+import os
+import sys
+import pstats
+import argparse
+import cProfile
+
+from remailer import Remailer
+from message import messageBytesAsObject
+from prefilter import mayHaveRemailTags
+from profiling import loadSlowMessage
+from timer import Timer
+
+def messagePaths(paths):
+    # The .eml files named, and those in any directories named.
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.eml'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def replay(remailer, message_bytes):
+    # Returns {stage: seconds} for one pass through the message.
+    timings = {}
+    timer = Timer()
+
+    # The message is parsed whatever the prefilter says, to see where the
+    # time goes.
+    prefilter_timer = Timer()
+    mayHaveRemailTags(message_bytes)
+    timings['prefilter'] = prefilter_timer.elapsedTime()
+
+    parse_timer = Timer()
+    message_obj = messageBytesAsObject(message_bytes, raw_attachments = True)
+    timings['parse'] = parse_timer.elapsedTime()
+
+    remailer.performSubstitutionOnMessageParts(message_obj, timings)
+
+    timings['total'] = timer.elapsedTime()
+    return timings
+
+def showTimings(name, size, recorded, replays):
+    print('%s (%d bytes)' % (name, size))
+    print('  %-12s %10s %10s %10s' % ('stage', 'recorded', 'best', 'mean'))
+
+    for stage in ('prefilter', 'parse', 'tag_scan', 'url_rewrite', 'serialize', 'total'):
+        values = [timings[stage] for timings in replays if stage in timings]
+        if stage not in recorded and not values:
+            continue
+
+        recorded_str = '%.4f' % recorded[stage] if stage in recorded else '-'
+        best_str = '%.4f' % min(values) if values else '-'
+        mean_str = '%.4f' % (sum(values) / len(values)) if values else '-'
+        print('  %-12s %10s %10s %10s' % (stage, recorded_str, best_str, mean_str))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Replay slow messages saved by the remailer.')
+    parser.add_argument('paths', nargs = '+',
+                        help = '.eml files, or directories of them')
+    parser.add_argument('--repeat', type = int, default = 3,
+                        help = 'times to replay each message')
+    parser.add_argument('--profile', action = 'store_true',
+                        help = 'run the replays under cProfile')
+    parser.add_argument('--save-profile', default = None,
+                        help = 'save the profile to this .pstats file')
+    args = parser.parse_args()
+
+    # No IMAP or SMTP connection is needed just to transform messages.
+    remailer = Remailer(None, None)
+
+    profile = cProfile.Profile() if args.profile or args.save_profile else None
+
+    for path in messagePaths(args.paths):
+        message_bytes, recorded = loadSlowMessage(path)
+        name = os.path.basename(path)
+
+        replays = []
+        for i in range(args.repeat):
+            if profile is not None:
+                profile.enable()
+            try:
+                replays.append(replay(remailer, message_bytes))
+
+            except Exception as e:
+                print('*** Error replaying %s: %s' % (name, e))
+                break
+
+            finally:
+                if profile is not None:
+                    profile.disable()
+
+        showTimings(name, len(message_bytes), recorded, replays)
+
+    if profile is not None:
+        stats = pstats.Stats(profile, stream = sys.stdout)
+        if args.save_profile is not None:
+            stats.dump_stats(args.save_profile)
+            print('Profile saved to %s' % args.save_profile)
+        if args.profile:
+            stats.sort_stats('cumulative').print_stats(25)
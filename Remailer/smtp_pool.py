@@ -0,0 +1,200 @@
+'''
+Created on Oct 18, 2026
+
+A pool of authenticated SMTP connections with a worker thread apiece.
+Send jobs are queued and picked up by whichever worker is free, so several
+messages can be on the wire at once. Each worker keeps its connection
+open between jobs, and between inbox cycles, for as long as its
+SMTPSession allows: it's checked with a NOOP before it's used again after
+sitting idle, and closed after max_idle seconds without a job, or once
+it has been open for max_age seconds or sent max_messages messages,
+since servers don't like sessions that stay open too long.
+'''
+
+import queue
+import threading
+from concurrent.futures import Future
+
+from smtp_session import deliverToRecipients
+from timer import Timer
+from metrics import queue_length
+
+class SMTPDeliveryPool:
+    def __init__(self, session_factory, size = 4,
+                 max_messages = None, max_age = None, max_idle = None,
+                 max_recipients = 50):
+        # session_factory is called with no arguments to make each
+        # worker's session, e.g. lambda: SMTPSession(service, creds).
+        # max_messages, max_age and max_idle override the session's own
+        # limits; with None, they're left as they are.
+        self._session_factory = session_factory
+        self._size = size
+        self._limits = { 'max_messages': max_messages, 'max_age': max_age,
+                         'max_idle': max_idle }
+        self._max_recipients = max_recipients
+
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._timer = Timer()
+
+        self.jobs_submitted = 0
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.busy_workers = 0
+
+        self._sessions = []
+
+        queue_length.setFunction(self.queueLength, 'smtp_pool')
+
+        self._workers = []
+        for i in range(size):
+            worker = threading.Thread(target = self._work, name = 'smtp-%d' % i,
+                                      daemon = True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, from_addr, recipients, message, retries = 2):
+        # Queue a message (an OutgoingMessage, or plain bytes) for sending,
+        # retrying temporarily refused recipients up to retries times (see
+        # deliverToRecipients). Returns a Future whose result is the
+        # dict of refused recipients that deliverToRecipients returns, or
+        # which raises whatever went wrong.
+        future = Future()
+
+        with self._lock:
+            self.jobs_submitted += 1
+
+        self._jobs.put((future, from_addr, recipients, message, retries))
+        return future
+
+    def _count(self, name, delta = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def _newSession(self):
+        session = self._session_factory()
+        for name, value in self._limits.items():
+            if value is not None:
+                setattr(session, name, value)
+
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def _work(self):
+        session = self._newSession()
+
+        while True:
+            try:
+                # Wait for a job, but not so long that an open connection
+                # outstays its welcome.
+                job = self._jobs.get(timeout = session.idleTimeLeft())
+            except queue.Empty:
+                session.closeIfIdle()
+                continue
+            
+            if job is None:
+                break
+
+            future, from_addr, recipients, message, retries = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self._count('busy_workers')
+
+            try:
+                # The connection from the last job is used again if it's
+                # still good; otherwise the session makes a new one, and if
+                # the server drops it before the message has gone, sends
+                # again over another.
+                session.readyService()
+                refused = deliverToRecipients(session, from_addr, recipients,
+                                              message, self._max_recipients,
+                                              retries)
+
+                self._count('jobs_done')
+                future.set_result(refused)
+
+            except Exception as e:
+                # Don't trust the connection after a failure; start afresh
+                # with the next job.
+                try:
+                    session.terminateService()
+                except Exception:
+                    pass
+
+                self._count('jobs_failed')
+                future.set_exception(e)
+
+            finally:
+                self._count('busy_workers', -1)
+
+        session.terminateService()
+
+    def queueLength(self):
+        return self._jobs.qsize()
+
+    def throughput(self):
+        # Messages sent per second since the pool started.
+        elapsed = self._timer.elapsedTime()
+        if elapsed <= 0:
+            return 0.0
+        return self.jobs_done / elapsed
+
+    def handshakeStats(self):
+        # (handshakes, seconds spent on them, reuses of idle connections)
+        # over all the workers' sessions.
+        with self._lock:
+            sessions = list(self._sessions)
+
+        return (sum(session.handshakes for session in sessions),
+                sum(session.handshake_seconds for session in sessions),
+                sum(session.reuses for session in sessions))
+
+    def statsString(self):
+        handshakes, handshake_seconds, reuses = self.handshakeStats()
+        return "SMTP pool: %d connections (%d busy), %d queued, %d sent, %d failed, " \
+               "%d handshakes (%.2fs), %d reused, %.2f msgs/s" \
+            % (self._size, self.busy_workers, self.queueLength(), self.jobs_done,
+               self.jobs_failed, handshakes, handshake_seconds, reuses, self.throughput())
+
+    def shutdown(self):
+        # Let the workers finish what's queued, then close their
+        # connections.
+        for worker in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join()
+
+if __name__ == '__main__':
+    # Test code. Runs a local stand-in server that takes a little while to
+    # accept each message, and sends a batch through pools of different
+    # sizes.
+    import time
+    from fake_smtp_server import FakeSMTPServer
+    from smtp_session import SMTPSession
+
+    message_count = 20
+
+    server = FakeSMTPServer(latency = 0.2).start()
+
+    service = { 'server_addr': '127.0.0.1', 'port': server.port(), 'starttls': False }
+    message_bytes = b'Subject: test\r\n\r\nHello.\r\n'
+
+    for size in [ 1, 4, 8 ]:
+        pool = SMTPDeliveryPool(lambda: SMTPSession(service, None), size = size,
+                                max_messages = 5)
+        start = time.monotonic()
+
+        futures = [ pool.submit('from@example.com', [ 'to%d@example.com' % i ],
+                                message_bytes)
+                    for i in range(message_count) ]
+        for future in futures:
+            future.result()
+
+        print("Pool of %d: %d messages in %.2fs" % (size, message_count,
+                                                   time.monotonic() - start))
+        print("  " + pool.statsString())
+        pool.shutdown()
+
+    server.stop()
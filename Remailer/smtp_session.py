@@ -0,0 +1,359 @@
+'''
+Created on Oct 18, 2026
+
+An SMTP connection for the remailer. It offers the same calls as the
+SMTPInterface we've been using (readyService, terminateService,
+message_bytes and send_message) plus sendmail, which sends one message to a
+list of recipients in a single transaction and reports which of them the
+server refused.
+
+The connection is kept open between inbox cycles rather than logged out
+and made again for every batch, which costs a TCP connect, STARTTLS and
+AUTH each time. Before a connection that has been sitting idle is used
+again it's checked with a NOOP, and one that has been idle for max_idle
+seconds, open for max_age seconds or has sent max_messages messages is
+closed and made afresh.
+If the server drops the connection before a message has gone, we connect
+again and carry on.
+'''
+
+import re
+import time
+import socket
+import smtplib
+from time import sleep
+from email.policy import default
+
+from metrics import stage_seconds
+from metrics import recipients_total
+from metrics import smtp_sessions_total
+
+from message import messageObjectAsBytes
+
+# The policy used to turn message objects into bytes for the wire.
+MHTMLPolicy = default.clone(linesep='\r\n', max_line_length=0)
+
+# Lines starting with a period need another one in front of them in DATA.
+leading_period_prog = re.compile(rb'^\.', re.MULTILINE)
+
+class OutgoingMessage:
+    # A message in wire format, made once and then used for the sent-folder
+    # archive and every SMTP transaction without being generated or copied
+    # again. message_bytes is the message itself (CRLF line endings);
+    # payload is a view of what goes after DATA, periods already doubled,
+    # and terminator is what ends it.
+    def __init__(self, message_bytes):
+        self.message_bytes = message_bytes
+
+        # re.sub hands back the very same object when there's nothing to
+        # double, so usually this is no copy at all. Looking for a period
+        # after a newline first is much quicker than the regular
+        # expression over a big attachment, and usually all we need.
+        if b'\n.' in message_bytes or message_bytes.startswith(b'.'):
+            payload = leading_period_prog.sub(b'..', message_bytes)
+        else:
+            payload = message_bytes
+        self.payload = memoryview(payload)
+
+        if payload.endswith(b'\r\n'):
+            self.terminator = b'.\r\n'
+        else:
+            self.terminator = b'\r\n.\r\n'
+
+def outgoingMessage(message_obj):
+    # Generate the wire format of a message object, once.
+    return OutgoingMessage(messageObjectAsBytes(message_obj, MHTMLPolicy))
+
+class SMTPSession:
+    # SMTP servers don't like connections that stay open too long, so
+    # one that has been idle for max_idle seconds, open for max_age
+    # seconds, or has sent max_messages messages, is closed rather than
+    # used again.
+    max_idle = 240
+    max_age = 300
+    max_messages = 100
+
+    # A connection idle for longer than this is checked with a NOOP
+    # before it's used again; the server may have given up on it.
+    probe_after = 5
+
+    def __init__(self, service, creds, max_idle = None, max_messages = None, max_age = None):
+        self._service = service
+        self._creds = creds
+        self._server = None
+
+        if max_idle is not None:
+            self.max_idle = max_idle
+        if max_messages is not None:
+            self.max_messages = max_messages
+        if max_age is not None:
+            self.max_age = max_age
+
+        self._opened_at = 0
+        self._last_used = 0
+        self._sent_count = 0
+
+        # Connections made and time spent making them, and times an open
+        # connection was picked up again after being idle.
+        self.handshakes = 0
+        self.handshake_seconds = 0.0
+        self.reuses = 0
+
+    def _connect(self):
+        # Connect, secure the connection and log in.
+        start = time.monotonic()
+
+        with stage_seconds.time('smtp_handshake'):
+            server = smtplib.SMTP(host = self._service['server_addr'],
+                                  port = self._service['port'],
+                                  local_hostname = self._service.get('local_hostname'))
+
+            # Commands and the end of a message are small writes that wait
+            # on each other's replies; without this, the kernel can hold
+            # each one back waiting for the previous one to be acknowledged.
+            server.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            # A local stand-in server for testing may do without TLS and
+            # logging in.
+            if self._service.get('starttls', True):
+                server.starttls()
+            if self._creds is not None:
+                server.login(self._creds.username, self._creds.password)
+
+        self.handshakes += 1
+        self.handshake_seconds += time.monotonic() - start
+        smtp_sessions_total.inc('opened')
+
+        self._server = server
+        self._opened_at = self._last_used = time.monotonic()
+        self._sent_count = 0
+
+    def _drop(self):
+        # Close the connection without saying goodbye; it's no good to us.
+        server = self._server
+        self._server = None
+        server.close()
+
+    def _probe(self):
+        # Whether the server still answers on the connection.
+        try:
+            code, response = self._server.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return code == 250
+
+    def readyService(self):
+        # Make sure we have a connection that's good to use: keep the one
+        # we have if it's still answering and hasn't done enough, or else
+        # make a new one.
+        if self._server is not None:
+            now = time.monotonic()
+            idle = now - self._last_used
+
+            if idle >= self.max_idle or now - self._opened_at >= self.max_age or \
+                    self._sent_count >= self.max_messages:
+                self.terminateService()
+                smtp_sessions_total.inc('retired')
+
+            elif idle >= self.probe_after:
+                if self._probe():
+                    self.reuses += 1
+                    smtp_sessions_total.inc('reused')
+                else:
+                    self._drop()
+                    smtp_sessions_total.inc('stale')
+
+        if self._server is None:
+            self._connect()
+
+    def terminateService(self):
+        # Log out and close the connection. Harmless if we never connected.
+        if self._server is None:
+            return
+
+        server = self._server
+        self._server = None
+
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def idleTimeLeft(self):
+        # Seconds until the connection has been idle long enough to close
+        # (at least one), or None if there's no connection.
+        if self._server is None:
+            return None
+        return max(self._last_used + self.max_idle - time.monotonic(), 1)
+
+    def closeIfIdle(self):
+        # Close the connection if it has been idle for max_idle seconds.
+        if self._server is not None and \
+                time.monotonic() - self._last_used >= self.max_idle:
+            self.terminateService()
+            smtp_sessions_total.inc('retired')
+
+    def statsString(self):
+        return "SMTP session: %d handshakes (%.2fs), %d reused, %d sent on this connection" \
+            % (self.handshakes, self.handshake_seconds, self.reuses, self._sent_count)
+
+    def message_bytes(self, message_obj):
+        return message_obj.as_bytes(policy = MHTMLPolicy)
+
+    def _reset(self):
+        # Abandon the current transaction, if the connection is still up.
+        try:
+            self._server.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    def sendmail(self, from_addr, recipients, message):
+        # Send the message (an OutgoingMessage, or plain bytes) to all of
+        # recipients in one transaction. Returns a dict of
+        # {recipient: (code, message)} for each recipient the server
+        # refused; the rest were accepted. Other failures raise.
+        #
+        # If the server drops the connection before the message has gone,
+        # we send it again over a new one.
+        if not isinstance(message, OutgoingMessage):
+            message = OutgoingMessage(message)
+
+        self.readyService()
+
+        try:
+            refused = self._transaction(from_addr, recipients, message)
+
+        except smtplib.SMTPServerDisconnected:
+            if self._data_sent:
+                raise
+
+            if self._server is not None:
+                self._drop()
+            smtp_sessions_total.inc('dropped')
+
+            self.readyService()
+            refused = self._transaction(from_addr, recipients, message)
+
+        self._sent_count += 1
+        self._last_used = time.monotonic()
+
+        return refused
+
+    def _transaction(self, from_addr, recipients, message):
+        # This is smtplib's sendmail, except that the DATA payload is sent
+        # from the OutgoingMessage's buffer as is, rather than having its
+        # periods doubled (and so being copied) again for every send.
+        self._data_sent = False
+
+        server = self._server
+        server.ehlo_or_helo_if_needed()
+
+        code, response = server.mail(from_addr)
+        if code != 250:
+            if code == 421:
+                server.close()
+            else:
+                self._reset()
+            raise smtplib.SMTPSenderRefused(code, response, from_addr)
+
+        refused = {}
+        for recipient in recipients:
+            code, response = server.rcpt(recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, response)
+            if code == 421:
+                server.close()
+                raise smtplib.SMTPRecipientsRefused(refused)
+
+        if len(refused) == len(recipients):
+            self._reset()
+            return refused
+
+        server.putcmd('data')
+        code, response = server.getreply()
+        if code != 354:
+            self._reset()
+            raise smtplib.SMTPDataError(code, response)
+
+        self._data_sent = True
+        server.send(message.payload)
+        server.send(message.terminator)
+
+        code, response = server.getreply()
+        if code != 250:
+            if code == 421:
+                server.close()
+            else:
+                self._reset()
+            raise smtplib.SMTPDataError(code, response)
+
+        return refused
+
+    def send_message(self, from_addr, to_addr, message_obj):
+        refused = self.sendmail(from_addr, [to_addr], outgoingMessage(message_obj))
+        if refused:
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+def deliverToRecipients(session, from_addr, recipients, message,
+                        max_recipients = 50, retries = 2, retry_delay = 2):
+    # Send message (an OutgoingMessage, or plain bytes) to every recipient,
+    # max_recipients per transaction. Recipients the server refuses with a
+    # temporary (4xx) error are retried on their own, up to retries more
+    # times; permanent refusals aren't. Returns a dict of
+    # {recipient: (code, message)} for the recipients that never got it.
+    refused = {}
+    pending = list(recipients)
+
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            sleep(retry_delay)
+
+        retry = []
+
+        for i in range(0, len(pending), max_recipients):
+            chunk = pending[i:i + max_recipients]
+            with stage_seconds.time('smtp_send'):
+                chunk_refused = session.sendmail(from_addr, chunk, message)
+
+            for recipient, (code, response) in chunk_refused.items():
+                if 400 <= code < 500 and attempt < retries:
+                    retry.append(recipient)
+                else:
+                    refused[recipient] = (code, response)
+
+        pending = retry
+        if not pending:
+            break
+
+    recipients_total.inc('accepted', amount = len(recipients) - len(refused))
+    recipients_total.inc('refused', amount = len(refused))
+
+    return refused
+
+if __name__ == '__main__':
+    # Test code. Sends to more recipients than fit in one transaction,
+    # with one of them put off the first time, and checks that every
+    # transaction, the retry included, carried the message.
+    from fake_smtp_server import FakeSMTPServer
+
+    server = FakeSMTPServer(defer_pattern = '^a@').start()
+    service = { 'server_addr': '127.0.0.1', 'port': server.port(), 'starttls': False }
+    message_bytes = b'Subject: test\r\n\r\n.A line starting with a period.\r\n'
+
+    session = SMTPSession(service, None)
+    refused = deliverToRecipients(session, 'from@example.com',
+                                  [ 'a@example.com', 'b@example.com', 'c@example.com' ],
+                                  OutgoingMessage(message_bytes),
+                                  max_recipients = 2, retry_delay = 0)
+    session.terminateService()
+    server.stop()
+
+    print("Refused:", refused)
+    for received_at, from_addr, recipients, received_bytes in server.messages:
+        print(recipients, received_bytes)
+
+    assert not refused
+    assert sorted(sum((recipients for _, _, recipients, _ in server.messages), [])) == \
+        [ 'a@example.com', 'b@example.com', 'c@example.com' ]
+    assert all(received_bytes == message_bytes for _, _, _, received_bytes in server.messages)
+    print("OK")
@@ -0,0 +1,72 @@
+'''
+Created on Oct 18, 2026
+
+Lists the recipients in a mailbox's delivery spool (see spool.py) that
+haven't been sent to, and lets an operator decide what to do about those
+that have failed or whose delivery was interrupted:
+
+    python spool-admin.py spool/alpha.sqlite
+    python spool-admin.py spool/alpha.sqlite --resend 12 bob@example.com
+    python spool-admin.py spool/alpha.sqlite --forget 12 bob@example.com
+
+--resend puts a recipient back in line for delivery, which a running
+remailer picks up within its spool worker's poll interval; --forget counts
+it as dealt with, e.g. after checking the server's logs shows it was sent.
+'''
+
+import os
+import sys
+import time
+import argparse
+
+from spool import DeliverySpool
+
+def listUndelivered(spool):
+    rows = spool.undelivered()
+    if not rows:
+        print('Nothing undelivered.')
+        return
+
+    print('%6s  %-16s  %-10s  %8s  %-30s  %s' % ('id', 'spooled', 'state', 'attempts',
+                                                 'recipient', 'source'))
+
+    for message_id, source, created, recipient, state, attempts, last_error in rows:
+        print('%6d  %-16s  %-10s  %8d  %-30s  %s' % (message_id,
+                                                     time.strftime('%Y-%m-%d %H:%M',
+                                                                   time.localtime(created)),
+                                                     state, attempts, recipient, source))
+        if last_error is not None:
+            print('        last error: %s' % last_error)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Inspect a remailer delivery spool.')
+    parser.add_argument('spool_path',
+                        help = "the mailbox's spool_path")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--resend', nargs = 2, metavar = ('ID', 'RECIPIENT'),
+                       help = 'send to a failed or uncertain recipient again')
+    group.add_argument('--forget', nargs = 2, metavar = ('ID', 'RECIPIENT'),
+                       help = 'count a failed or uncertain recipient as dealt with')
+    args = parser.parse_args()
+
+    # Don't make a new, empty spool out of a typo.
+    if not os.path.exists(args.spool_path):
+        parser.error('no spool at %s' % args.spool_path)
+
+    spool = DeliverySpool(args.spool_path)
+
+    try:
+        if args.resend is None and args.forget is None:
+            listUndelivered(spool)
+            sys.exit(0)
+
+        message_id, recipient = args.resend or args.forget
+        if not spool.resolve(int(message_id), recipient, resend = args.resend is not None):
+            print('No failed or uncertain recipient <%s> for message %s.' % (recipient, message_id))
+            sys.exit(1)
+
+        print('%s <%s> for message %s.' % ('Resending to' if args.resend else 'Forgot',
+                                           recipient, message_id))
+
+    finally:
+        spool.close()
@@ -0,0 +1,393 @@
+'''
+Created on Oct 18, 2026
+
+A crash-safe outbound spool. A remailed message goes into the spool (an
+SQLite database, fully synced on every commit) with a state for each of its
+recipients before its original is moved out of the inbox, and the inbox
+cycle moves on. A delivery worker thread drains the spool in the
+background, retrying with exponential backoff, so slow or failing SMTP
+doesn't hold up the inbox and a restart picks up where it left off.
+
+Recipient states:
+
+    held        spooled, but the original hasn't been moved out of the
+                inbox yet; released to pending once it has, or dropped if
+                the move didn't happen (see Remailer.recoverHeldMessages)
+    pending     waiting to be sent (possibly after an earlier failure)
+    sending     handed to the SMTP server, outcome not yet recorded
+    sent        accepted by the server
+    failed      refused permanently, or out of attempts
+    uncertain   was being sent when we stopped, so we don't know; these are
+                reported rather than retried, to avoid sending twice
+
+Failed and uncertain recipients stay in the spool until an operator deals
+with them with spool-admin.py, or until they expire (see DeliveryWorker).
+'''
+
+import os
+import time
+import sqlite3
+import threading
+import traceback
+
+from smtp_session import OutgoingMessage
+from metrics import errors_total
+from metrics import queue_length
+
+class DeliverySpool:
+    def __init__(self, path = 'remailer-spool.sqlite'):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+        # Each mailbox may keep its spool in a directory of its own.
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = FULL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS messages '
+                         '(id INTEGER PRIMARY KEY, from_addr TEXT, message BLOB, '
+                         'source TEXT, created REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS recipients '
+                         '(message_id INTEGER, recipient TEXT, state TEXT, '
+                         'attempts INTEGER, next_attempt REAL, last_error TEXT, '
+                         'PRIMARY KEY (message_id, recipient))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS recipients_due '
+                         'ON recipients (state, next_attempt)')
+        self._db.commit()
+
+        queue_length.setFunction(self.pendingCount, 'spool')
+
+    def recoverInterrupted(self):
+        # Call at startup. Anything still marked sending was in flight
+        # when we stopped; mark it uncertain and return it as
+        # (message_id, source, recipient) so it can be reported.
+        with self._lock:
+            rows = self._db.execute('SELECT r.message_id, m.source, r.recipient '
+                                    'FROM recipients r JOIN messages m ON m.id = r.message_id '
+                                    "WHERE r.state = 'sending'").fetchall()
+            self._db.execute("UPDATE recipients SET state = 'uncertain' "
+                             "WHERE state = 'sending'")
+            self._db.commit()
+        return rows
+
+    def enqueue(self, from_addr, recipients, message_bytes, source = None,
+                held = False):
+        # Add a message for delivery to recipients. Once this returns, the
+        # message is on disk. A held message isn't sent until it's
+        # released.
+        now = time.time()
+        state = 'held' if held else 'pending'
+
+        with self._lock:
+            with self._db:
+                cursor = self._db.execute('INSERT INTO messages (from_addr, message, source, created) '
+                                          'VALUES (?, ?, ?, ?)',
+                                          (from_addr, bytes(message_bytes), source, now))
+                message_id = cursor.lastrowid
+                self._db.executemany('INSERT INTO recipients VALUES (?, ?, ?, 0, ?, NULL)',
+                                     [(message_id, recipient, state, now)
+                                      for recipient in recipients])
+
+        if not held:
+            self._wake.set()
+        return message_id
+
+    def held(self):
+        # The held messages, as [(message_id, source), ...].
+        with self._lock:
+            return self._db.execute('SELECT DISTINCT m.id, m.source '
+                                    'FROM messages m JOIN recipients r ON r.message_id = m.id '
+                                    "WHERE r.state = 'held' ORDER BY m.id").fetchall()
+
+    def _setMessageState(self, message_ids, from_state, to_state):
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.executemany('UPDATE recipients SET state = ?, next_attempt = ? '
+                                     'WHERE message_id = ? AND state = ?',
+                                     [(to_state, now, message_id, from_state)
+                                      for message_id in message_ids])
+
+    def release(self, message_ids):
+        # Let held messages go out.
+        self._setMessageState(message_ids, 'held', 'pending')
+        self._wake.set()
+
+    def markHeldUncertain(self, message_ids):
+        # For held messages we can't tell whether to send or not.
+        self._setMessageState(message_ids, 'held', 'uncertain')
+
+    def discard(self, message_ids):
+        # Drop messages altogether.
+        with self._lock:
+            with self._db:
+                self._db.executemany('DELETE FROM recipients WHERE message_id = ?',
+                                     [(message_id,) for message_id in message_ids])
+                self._db.executemany('DELETE FROM messages WHERE id = ?',
+                                     [(message_id,) for message_id in message_ids])
+
+    def due(self, now, limit = 50):
+        # Return up to limit messages with recipients due for a send, as
+        # [(message_id, from_addr, message_bytes, [recipient, ...]), ...].
+        with self._lock:
+            rows = self._db.execute("SELECT message_id, recipient FROM recipients "
+                                    "WHERE state = 'pending' AND next_attempt <= ? "
+                                    "ORDER BY message_id", (now,)).fetchall()
+
+            recipients_by_message = {}
+            for message_id, recipient in rows:
+                if message_id not in recipients_by_message:
+                    if len(recipients_by_message) >= limit:
+                        break
+                    recipients_by_message[message_id] = []
+                recipients_by_message[message_id].append(recipient)
+
+            jobs = []
+            for message_id, recipients in recipients_by_message.items():
+                from_addr, message_bytes = self._db.execute(
+                    'SELECT from_addr, message FROM messages WHERE id = ?',
+                    (message_id,)).fetchone()
+                jobs.append((message_id, from_addr, message_bytes, recipients))
+
+        return jobs
+
+    def nextDueTime(self):
+        # When the next pending recipient is due, or None if there are none.
+        with self._lock:
+            row = self._db.execute("SELECT MIN(next_attempt) FROM recipients "
+                                   "WHERE state = 'pending'").fetchone()
+        return row[0]
+
+    def _setState(self, message_id, recipients, state, error = None,
+                  next_attempt = None, count_attempt = False):
+        with self._lock:
+            with self._db:
+                for recipient in recipients:
+                    self._db.execute('UPDATE recipients SET state = ?, '
+                                     'last_error = COALESCE(?, last_error), '
+                                     'next_attempt = COALESCE(?, next_attempt), '
+                                     'attempts = attempts + ? '
+                                     'WHERE message_id = ? AND recipient = ?',
+                                     (state, error, next_attempt, 1 if count_attempt else 0,
+                                      message_id, recipient))
+
+    def markSending(self, message_id, recipients):
+        self._setState(message_id, recipients, 'sending', count_attempt = True)
+
+    def markSent(self, message_id, recipients):
+        self._setState(message_id, recipients, 'sent')
+
+    def markFailed(self, message_id, recipient, error):
+        self._setState(message_id, [recipient], 'failed', error)
+
+    def attempts(self, message_id, recipient):
+        with self._lock:
+            row = self._db.execute('SELECT attempts FROM recipients '
+                                   'WHERE message_id = ? AND recipient = ?',
+                                   (message_id, recipient)).fetchone()
+        return row[0]
+
+    def markRetry(self, message_id, recipient, error, next_attempt):
+        self._setState(message_id, [recipient], 'pending', error, next_attempt)
+
+    def undelivered(self):
+        # The recipients that haven't been sent to, as [(message_id,
+        # source, created, recipient, state, attempts, last_error), ...].
+        with self._lock:
+            return self._db.execute('SELECT r.message_id, m.source, m.created, r.recipient, '
+                                    'r.state, r.attempts, r.last_error '
+                                    'FROM recipients r JOIN messages m ON m.id = r.message_id '
+                                    "WHERE r.state != 'sent' "
+                                    'ORDER BY r.message_id, r.recipient').fetchall()
+
+    def resolve(self, message_id, recipient, resend):
+        # An operator's decision on a failed or uncertain recipient: send
+        # to it again, or count it as dealt with. Returns False if there's
+        # no such recipient in either state.
+        state = 'pending' if resend else 'sent'
+
+        with self._lock:
+            with self._db:
+                cursor = self._db.execute('UPDATE recipients SET state = ?, next_attempt = ?, '
+                                          'attempts = 0 '
+                                          'WHERE message_id = ? AND recipient = ? '
+                                          "AND state IN ('failed', 'uncertain')",
+                                          (state, time.time(), message_id, recipient))
+
+        if resend:
+            self._wake.set()
+        return cursor.rowcount > 0
+
+    def purgeExpired(self, before):
+        # Drop messages spooled before the time given that have nothing
+        # left to send, whatever became of their recipients. Returns the
+        # recipients that weren't sent to, as [(source, recipient, state)].
+        with self._lock:
+            with self._db:
+                expired = ('SELECT id FROM messages WHERE created < ? AND id NOT IN '
+                           '(SELECT message_id FROM recipients '
+                           "WHERE state IN ('held', 'pending', 'sending'))")
+                rows = self._db.execute('SELECT m.source, r.recipient, r.state '
+                                        'FROM recipients r JOIN messages m ON m.id = r.message_id '
+                                        "WHERE r.state != 'sent' AND r.message_id IN (%s)" % expired,
+                                        (before,)).fetchall()
+                self._db.execute('DELETE FROM recipients WHERE message_id IN (%s)' % expired,
+                                 (before,))
+                self._db.execute('DELETE FROM messages WHERE id NOT IN '
+                                 '(SELECT message_id FROM recipients)')
+        return rows
+
+    def purgeDelivered(self):
+        # Drop messages that every recipient has received.
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM messages WHERE id NOT IN "
+                                 "(SELECT message_id FROM recipients WHERE state != 'sent')")
+                self._db.execute("DELETE FROM recipients WHERE message_id NOT IN "
+                                 "(SELECT id FROM messages)")
+
+    def counts(self):
+        # The number of recipients in each state, e.g. {'pending': 3}.
+        with self._lock:
+            rows = self._db.execute('SELECT state, COUNT(*) FROM recipients '
+                                    'GROUP BY state').fetchall()
+        return dict(rows)
+
+    def pendingCount(self):
+        return self.counts().get('pending', 0)
+
+    def statsString(self):
+        counts = self.counts()
+        return "spool: " + ', '.join('%d %s' % (counts.get(state, 0), state)
+                                     for state in ('held', 'pending', 'sending', 'sent',
+                                                   'failed', 'uncertain'))
+
+    def waitForWork(self, timeout):
+        # Sleep until something is enqueued or timeout seconds pass.
+        self._wake.wait(timeout)
+        self._wake.clear()
+
+    def wake(self):
+        self._wake.set()
+
+    def close(self):
+        self._db.close()
+
+class DeliveryWorker:
+    # Failed and uncertain recipients nobody has dealt with are forgotten
+    # this many seconds after their message was spooled.
+    expire_after = 14 * 24 * 3600
+
+    def __init__(self, spool, delivery_pool, max_recipients = 50,
+                 retry_base = 60, retry_max = 3600, max_attempts = 8,
+                 poll_interval = 30):
+        self._spool = spool
+        self._delivery_pool = delivery_pool
+        self._max_recipients = max_recipients
+        self._retry_base = retry_base
+        self._retry_max = retry_max
+        self._max_attempts = max_attempts
+        self._poll_interval = poll_interval
+
+        self._stopping = False
+        self._thread = None
+
+    def _retryDelay(self, attempts):
+        return min(self._retry_base * 2 ** (attempts - 1), self._retry_max)
+
+    def _retryOrFail(self, message_id, recipient, error):
+        attempts = self._spool.attempts(message_id, recipient)
+
+        if attempts >= self._max_attempts:
+            print("*** Giving up on <%s> after %d attempts: %s" % (recipient, attempts, error))
+            self._spool.markFailed(message_id, recipient, error)
+        else:
+            next_attempt = time.time() + self._retryDelay(attempts)
+            self._spool.markRetry(message_id, recipient, error, next_attempt)
+
+    def drainOnce(self):
+        # Hand every due recipient to the delivery pool and record what
+        # happened to each. Returns the number of recipients attempted.
+        jobs = []
+
+        for message_id, from_addr, message_bytes, recipients in self._spool.due(time.time()):
+            outgoing_message = OutgoingMessage(message_bytes)
+
+            # One pool job per transaction's worth of recipients, so that a
+            # failure only puts those recipients in doubt.
+            for i in range(0, len(recipients), self._max_recipients):
+                chunk = recipients[i:i + self._max_recipients]
+                self._spool.markSending(message_id, chunk)
+                future = self._delivery_pool.submit(from_addr, chunk, outgoing_message,
+                                                    retries = 0)
+                jobs.append((message_id, chunk, future))
+
+        attempted = 0
+
+        for message_id, chunk, future in jobs:
+            attempted += len(chunk)
+
+            try:
+                refused = future.result()
+            except Exception as e:
+                # Nothing was accepted; try them all again later.
+                errors_total.inc('send')
+                for recipient in chunk:
+                    self._retryOrFail(message_id, recipient, str(e))
+                continue
+
+            self._spool.markSent(message_id, [r for r in chunk if r not in refused])
+
+            for recipient, (code, response) in refused.items():
+                error = '%d %s' % (code, response.decode('utf-8', 'replace'))
+                if 400 <= code < 500:
+                    self._retryOrFail(message_id, recipient, error)
+                else:
+                    print("*** <%s> refused: %s" % (recipient, error))
+                    self._spool.markFailed(message_id, recipient, error)
+
+        if attempted > 0:
+            self._spool.purgeDelivered()
+
+        return attempted
+
+    def expireOld(self):
+        for source, recipient, state in self._spool.purgeExpired(time.time() - self.expire_after):
+            print("*** Forgetting %s recipient <%s> of %s after %d days."
+                  % (state, recipient, source, self.expire_after // (24 * 3600)))
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                self.drainOnce()
+                self.expireOld()
+            except Exception as e:
+                traceback.print_tb(e.__traceback__)
+                print("*** Error draining spool: %s" % e)
+                errors_total.inc('spool')
+
+            # Sleep until new work arrives or the next retry falls due.
+            timeout = self._poll_interval
+            next_due = self._spool.nextDueTime()
+            if next_due is not None:
+                timeout = max(0, min(timeout, next_due - time.time()))
+
+            self._spool.waitForWork(timeout)
+
+    def start(self):
+        for message_id, source, recipient in self._spool.recoverInterrupted():
+            print("*** Delivery of %s to <%s> was interrupted; not resending "
+                  "(see spool-admin.py)." % (source, recipient))
+
+        self._thread = threading.Thread(target = self._run, name = 'spool',
+                                        daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._spool.wake()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,279 @@
+'''
+Created on Oct 18, 2026
+
+Serves several mailboxes at once, each in a process of its own, so that
+between them they can keep every core busy and one mailbox's trouble can't
+hold up another's. The mailboxes are listed in a config file (see
+mailbox_config.py):
+
+    python supervisor.py remailer-mailboxes.json
+
+A mailbox whose process dies is started again after a delay that doubles
+with each crash in a row, from min_restart_delay up to max_restart_delay;
+once it has stayed up for stable_seconds the delay goes back to the start.
+Each mailbox reports how it's doing after every cycle. The supervisor logs
+a summary of them all every status_interval seconds, and serves the same,
+labelled by mailbox, at /metrics if the config's "supervisor" section has a
+metrics_port. With "async": true there, the mailboxes run on
+async_remailer.
+'''
+
+import sys
+import time
+import queue
+import signal
+import logging
+import multiprocessing
+
+from metrics import MetricsRegistry
+from metrics import startMetricsServer
+from mailbox_config import loadConfig
+from timer import Timer
+
+def info(str_):
+    logging.info("Supervisor: " + str_)
+    print("Supervisor: " + str_)
+
+def _stopOnTerminate(signum, frame):
+    # Turn SIGTERM into SystemExit, so that the remailer's finally blocks
+    # get to close its connections and stop its spool worker.
+    raise SystemExit(0)
+
+def runShard(mailbox, status_queue, use_async):
+    # What each mailbox's process runs. Ctrl-C is the supervisor's to
+    # deal with; it stops us with SIGTERM.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _stopOnTerminate)
+
+    if use_async:
+        from async_remailer import runMailbox
+    else:
+        from remailer import runMailbox
+
+    runMailbox(mailbox, status_queue.put)
+
+class _Shard:
+    # One mailbox and the process serving it.
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+        self.process = None
+        self.timer = None
+
+        # Crashes in a row, and when to start it again after the last.
+        self.crashes = 0
+        self.restart_at = 0
+
+        self.restarts = 0
+
+        # The last Remailer.status() it sent us.
+        self.status = None
+
+class Supervisor:
+    min_restart_delay = 5
+    max_restart_delay = 300
+    stable_seconds = 600
+
+    status_interval = 60
+
+    # How long to wait for a mailbox to finish up when stopping it before
+    # killing it.
+    stop_timeout = 30
+
+    def __init__(self, mailboxes, use_async = False):
+        # Each mailbox gets a fresh interpreter, rather than a copy of
+        # this one with its threads and sockets.
+        self._context = multiprocessing.get_context('spawn')
+        self._status_queue = self._context.Queue()
+        self._use_async = use_async
+
+        self._shards = dict((mailbox.name, _Shard(mailbox)) for mailbox in mailboxes)
+
+        self.registry = MetricsRegistry()
+
+        self._up = self.registry.gauge(
+            'remailer_mailbox_up',
+            "Whether each mailbox's process is running",
+            labels = ('mailbox',))
+
+        self._restarts_total = self.registry.counter(
+            'remailer_mailbox_restarts_total',
+            "Times each mailbox's process has been started again after dying",
+            labels = ('mailbox',))
+
+        self._cycles = self.registry.gauge(
+            'remailer_mailbox_cycles',
+            'Inbox cycles since the process started',
+            labels = ('mailbox',))
+
+        self._inbox_messages = self.registry.gauge(
+            'remailer_mailbox_inbox_messages',
+            'Messages in the incoming folder when it was last checked',
+            labels = ('mailbox',))
+
+        self._messages = self.registry.gauge(
+            'remailer_mailbox_messages',
+            'Messages taken from the inbox since the process started, by what became of them',
+            labels = ('mailbox', 'outcome'))
+
+        self._errors = self.registry.gauge(
+            'remailer_mailbox_errors',
+            'Errors since the process started, by where they happened',
+            labels = ('mailbox', 'stage'))
+
+    def startShard(self, shard):
+        name = shard.mailbox.name
+        process = self._context.Process(target = runShard, name = 'remailer-' + name,
+                                        args = (shard.mailbox, self._status_queue,
+                                                self._use_async))
+        process.start()
+        shard.process = process
+        shard.timer = Timer()
+        shard.status = None
+
+        info("Started mailbox %s (pid %d)" % (name, shard.process.pid))
+        self._up.set(1, name)
+
+    def checkShards(self):
+        # Notice any mailboxes that have died, and start again any whose
+        # time has come.
+        now = time.monotonic()
+
+        for name, shard in self._shards.items():
+            if shard.process is not None and not shard.process.is_alive():
+                exit_code = shard.process.exitcode
+                shard.process.join()
+                shard.process = None
+                self._up.set(0, name)
+
+                if shard.timer.elapsedTime() >= self.stable_seconds:
+                    shard.crashes = 0
+                shard.crashes += 1
+
+                delay = min(self.min_restart_delay * 2 ** (shard.crashes - 1),
+                            self.max_restart_delay)
+                shard.restart_at = now + delay
+
+                print("*** Error: mailbox %s exited with code %s after %s; restarting in %ds"
+                      % (name, exit_code, shard.timer.simpleElapsedTimeString(), delay))
+                logging.error("Supervisor: mailbox %s exited with code %s" % (name, exit_code))
+
+            if shard.process is None and now >= shard.restart_at:
+                info("Restarting mailbox %s" % name)
+                shard.restarts += 1
+                self._restarts_total.inc(name)
+                self.startShard(shard)
+
+    def receiveStatus(self, timeout):
+        # Take in the mailboxes' reports, waiting up to timeout seconds for
+        # the first.
+        try:
+            status = self._status_queue.get(timeout = timeout)
+            while True:
+                self.noteStatus(status)
+                status = self._status_queue.get_nowait()
+
+        except queue.Empty:
+            pass
+
+    def noteStatus(self, status):
+        name = status['name']
+        shard = self._shards.get(name)
+        if shard is None:
+            return
+
+        shard.status = status
+
+        self._cycles.set(status['cycles'], name)
+        if status['inbox_messages'] is not None:
+            self._inbox_messages.set(status['inbox_messages'], name)
+        for outcome, count in status['messages'].items():
+            self._messages.set(count, name, outcome)
+        for stage, count in status['errors'].items():
+            self._errors.set(count, name, stage)
+
+    def statusString(self):
+        lines = []
+
+        for name, shard in self._shards.items():
+            if shard.process is not None:
+                state = 'up %s' % shard.timer.simpleElapsedTimeString()
+            elif shard.restart_at > time.monotonic():
+                state = 'restart in %ds' % (shard.restart_at - time.monotonic())
+            else:
+                state = 'down'
+
+            status = shard.status or {}
+            messages = status.get('messages', {})
+            lines.append("%-20s %-16s restarts: %d, cycles: %d, inbox: %s, remailed: %d, "
+                         "no tag: %d, errors: %d"
+                         % (name, state, shard.restarts, status.get('cycles', 0),
+                            status.get('inbox_messages', '-'), messages.get('remailed', 0),
+                            messages.get('notag', 0), sum(status.get('errors', {}).values())))
+
+        return '\n'.join(lines)
+
+    def stop(self):
+        # SIGTERM every mailbox, give them a while to finish up, then kill
+        # any that haven't.
+        for shard in self._shards.values():
+            if shard.process is not None and shard.process.is_alive():
+                shard.process.terminate()
+
+        for name, shard in self._shards.items():
+            if shard.process is None:
+                continue
+
+            shard.process.join(self.stop_timeout)
+            if shard.process.is_alive():
+                print("*** Error: mailbox %s didn't stop; killing it" % name)
+                shard.process.kill()
+                shard.process.join()
+
+            shard.process = None
+            self._up.set(0, name)
+
+    def run(self):
+        # Serve the mailboxes until we're interrupted or sent SIGTERM.
+        signal.signal(signal.SIGTERM, _stopOnTerminate)
+
+        status_timer = Timer()
+
+        try:
+            for shard in self._shards.values():
+                self.startShard(shard)
+
+            while True:
+                self.checkShards()
+                self.receiveStatus(1)
+
+                if status_timer.elapsedTime() >= self.status_interval:
+                    info("Mailboxes:\n" + self.statusString())
+                    status_timer = Timer()
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            info("Stopping mailboxes...")
+            self.stop()
+            info("Mailboxes:\n" + self.statusString())
+
+if __name__ == '__main__':
+    # python supervisor.py config.json
+    mailboxes, supervisor_settings = loadConfig(sys.argv[1])
+
+    logging.basicConfig(filename = supervisor_settings.get('log_file', 'supervisor.log'),
+                        format = '%(asctime)s:%(levelname)s:%(message)s',
+                        level = logging.DEBUG)
+
+    logging.info("-----------------------------------------------------------")
+    info("supervising %d mailboxes: %s" % (len(mailboxes),
+                                           ', '.join(mailbox.name for mailbox in mailboxes)))
+
+    supervisor = Supervisor(mailboxes, use_async = supervisor_settings.get('async', False))
+
+    metrics_port = supervisor_settings.get('metrics_port')
+    if metrics_port is not None:
+        startMetricsServer(metrics_port, metrics_registry = supervisor.registry)
+
+    supervisor.run()
@@ -0,0 +1,50 @@
+'''
+Created on Oct 18, 2026
+
+A micro-benchmark for tagscan.scan_for_tags. Times the single-pass scanner
+against the old search/substitute/search-again loop on message bodies with
+increasing numbers of ${remail-to:...} tags, to show how each scales.
+'''
+import timeit
+
+from macros import macro_substitute
+from tagscan import prog
+from tagscan import scan_for_tags
+
+tag_counts = [ 10, 100, 1000, 10000 ]
+
+def scan_for_tags_rescan(str_):
+    # The old scanner: strip one tag, then search again from the start.
+    found_tags = []
+    match = prog.search(str_)
+
+    while match is not None:
+        found_tags.append((match.group(2), match.group(3)))
+        str_ = macro_substitute(str_, match, "")
+        match = prog.search(str_)
+
+    return str_, found_tags
+
+def make_body(tag_count):
+    # A mail-merge style body: a line of text around every tag.
+    line = "Dear colleague, please see the attached. ${remail-to:user%d@example.com}\n"
+    return ''.join(line % i for i in range(tag_count))
+
+def best_time(func, arg, repeat):
+    return min(timeit.repeat(lambda: func(arg), number = 1, repeat = repeat))
+
+if __name__ == '__main__':
+    print("%8s %10s %14s %14s %8s" % ("tags", "chars", "rescan (s)", "single (s)", "speedup"))
+
+    for tag_count in tag_counts:
+        body = make_body(tag_count)
+
+        # Both scanners must agree before their times mean anything.
+        assert scan_for_tags(body) == scan_for_tags_rescan(body)
+
+        rescan_time = best_time(scan_for_tags_rescan, body, 3)
+        single_time = best_time(scan_for_tags, body, 5)
+
+        print("%8d %10d %14.6f %14.6f %7.1fx" % (tag_count, len(body),
+                                                rescan_time, single_time,
+                                                rescan_time / single_time))
@@ -4,19 +4,16 @@ Created on Feb 2, 2021
 @author: jct
 '''
 import re
-from macros import macro_substitute
 
 prog = re.compile("\${(([a-zA-Z0-9-]+):)?([^}]*)}")
 
 def scan_for_tags(str_):
     found_tags = []
     
-    # Find the first macro
-    match = prog.search(str_)
-
-    # Loop through every macro we find.
-    while match is not None:
-
+    # Called for every macro we find, in order, as re.sub walks the
+    # string once from start to end.
+    def strip_tag(match):
+        
         # Extract the tag name and value from the match. The name is the
         # substring defined by group 2 of the regex.
         tag_name = match.group(2)
@@ -31,11 +28,13 @@ def scan_for_tags(str_):
         # Record the tag tuple in the return list
         found_tags.append(tag_tuple)
 
-        # Substitute the macro with an empty bytestring
-        str_ = macro_substitute(str_, match, "")
+        # Substitute the macro with an empty string
+        return ""
 
-        # Find the next match
-        match = prog.search(str_)
+    # Strip every macro in a single pass. (Substituting one macro at a
+    # time and searching again from the start is quadratic in the number
+    # of tags.)
+    str_ = prog.sub(strip_tag, str_)
 
     # Finally, return the macro-substituted str_ and list of tags.    
     return str_, found_tags
@@ -5,14 +5,33 @@ Created on Feb 12, 2021
 '''
 
 import requests
+from requests.adapters import HTTPAdapter
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-def get_redirect_for(url):
+# Give up on a tracker host that doesn't answer promptly, rather than
+# holding up the remailer.
+connect_timeout = 3.05
+read_timeout = 5
+
+def make_session(pool_size = 10):
+    # A session keeps connections alive between lookups, so we only pay
+    # for the TLS handshake once per host.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+shared_session = make_session()
+
+def get_redirect_for(url, session = None):
+    if session is None:
+        session = shared_session
     print("  Finding redirect for %s" % url)
-    result = requests.get(url, verify = False, allow_redirects = False)
+    result = session.get(url, verify = False, allow_redirects = False,
+                         timeout = (connect_timeout, read_timeout))
     print("  Result code = %d" % result.status_code)
     location = result.headers.get('location')
     print("  Redirects to: %s" % location)
     return location
-    
\ No newline at end of file
@@ -0,0 +1,128 @@
+'''
+Created on Oct 18, 2026
+
+A table-driven URL rewriting engine. Each rule matches URLs with a regular
+expression and says what to do with them:
+
+    map      replace the URL with the URL it redirects to
+    delete   remove the URL
+    replace  replace the URL with a fixed string
+
+All the rules are compiled into a single alternation, so a part is scanned
+once however many rules there are.
+'''
+
+import re
+import json
+
+class RewriteRule:
+    actions = ('map', 'delete', 'replace')
+
+    def __init__(self, name, pattern, action, replacement = None):
+        if action not in self.actions:
+            raise ValueError("Unknown rewrite action <%s> for rule <%s>" % (action, name))
+        if action == 'replace' and replacement is None:
+            raise ValueError("Rule <%s> needs a replacement" % name)
+
+        # Checked on its own so a bad pattern is reported against its rule.
+        re.compile(pattern)
+
+        self.name = name
+        self.pattern = pattern
+        self.action = action
+        self.replacement = replacement
+
+# The rules the remailer has always had.
+infusion_links_rule = RewriteRule('infusion-links',
+                                  'https://ei194.infusion-links.com/[a-zA-Z0-9/]+',
+                                  'map')
+tracking_pixel_rule = RewriteRule('tracking-pixel',
+                                  'https://is-tracking-pixel-api-prod.appspot.com/[a-zA-Z0-9/]+',
+                                  'delete')
+
+def loadRules(path):
+    # Load a rule table from a JSON file holding a list of objects with
+    # "name", "pattern", "action" and (for replace) "replacement" keys.
+    with open(path) as f:
+        table = json.load(f)
+
+    return [RewriteRule(entry['name'], entry['pattern'], entry['action'],
+                        entry.get('replacement'))
+            for entry in table]
+
+class URLRewriter:
+    def __init__(self, rules):
+        self._rules = {}
+        alternatives = []
+
+        for i, rule in enumerate(rules):
+            group_name = 'rule%d' % i
+            self._rules[group_name] = rule
+            alternatives.append('(?P<%s>%s)' % (group_name, rule.pattern))
+
+        self._prog = re.compile('|'.join(alternatives)) if alternatives else None
+
+        self.hits = dict((rule.name, 0) for rule in rules)
+
+    def _rule(self, match):
+        # Each rule's group encloses any groups of its own, so it's
+        # always the last one to close.
+        return self._rules[match.lastgroup]
+
+    def mapTargets(self, strs):
+        # Return the set of URLs in the given strings that map rules will
+        # need looked up.
+        urls = set()
+        if self._prog is None:
+            return urls
+
+        for str_ in strs:
+            for match in self._prog.finditer(str_):
+                if self._rule(match).action == 'map':
+                    urls.add(match.group(0))
+
+        return urls
+
+    def rewrite(self, str_, url_map = None):
+        # Apply every rule in one pass over the string. url_map holds the
+        # lookups for map rules; a URL that isn't in it is left alone.
+        if self._prog is None:
+            return str_
+
+        if url_map is None:
+            url_map = {}
+
+        def apply(match):
+            rule = self._rule(match)
+            self.hits[rule.name] += 1
+            matched_url = match.group(0)
+
+            if rule.action == 'map':
+                return url_map.get(matched_url, matched_url)
+
+            if rule.action == 'delete':
+                return ""
+
+            return rule.replacement
+
+        return self._prog.sub(apply, str_)
+
+    def statsString(self):
+        return "URL rewrites: " + ', '.join('%s %d' % (name, count)
+                                            for name, count in self.hits.items())
+
+if __name__ == '__main__':
+    # Test code
+    rewriter = URLRewriter([ infusion_links_rule, tracking_pixel_rule,
+                             RewriteRule('unsubscribe', 'https://example.com/unsub/[0-9]+',
+                                         'replace', 'https://example.com/unsub') ])
+
+    test_string = ("Click https://ei194.infusion-links.com/api/v1/click/1/2 now. "
+                   "<img src=\"https://is-tracking-pixel-api-prod.appspot.com/a/b\"> "
+                   "Unsubscribe at https://example.com/unsub/12345.")
+
+    url_map = dict((url, 'https://example.com/landing')
+                   for url in rewriter.mapTargets([test_string]))
+
+    print(rewriter.rewrite(test_string, url_map))
+    print(rewriter.statsString())